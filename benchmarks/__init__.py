@@ -0,0 +1,5 @@
+"""
+Store benchmarks (not shipped with the package).
+
+    python -m benchmarks.store_bench --help
+"""
@@ -0,0 +1,276 @@
+"""
+Time the session store operations on a synthetic (or copied) data dir.
+
+    python -m benchmarks.store_bench --backend jsonl,sqlite --sessions 500 --out bench.json
+    python -m benchmarks.store_bench --like data --out new.json --baseline bench.json
+
+Results are JSON (stdout, or --out): per backend and operation the call
+count, throughput, mean/p50/p99/max latency and the process's peak RSS
+after that phase. With --baseline, operations slower than the baseline by
+more than --max-regression percent are listed and the exit status is 1.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore[assignment]
+
+from benchmarks.synth import Generator, Shape, populate, shape_of
+from snlite.store import STORE_BACKENDS, open_store
+from snlite.store_base import BaseSessionStore
+
+RESULT_VERSION = 1
+
+
+def peak_rss_kb() -> int:
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak  # bytes on macOS, KiB elsewhere
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Timings:
+    """Latency samples of one operation."""
+    def __init__(self) -> None:
+        self.samples: List[float] = []
+
+    def time(self, fn: Callable[..., Any], *args: Any) -> Any:
+        started = time.perf_counter()
+        result = fn(*args)
+        self.samples.append(time.perf_counter() - started)
+        return result
+
+    def summary(self) -> Dict[str, Any]:
+        values = sorted(self.samples)
+        total = sum(values)
+        n = len(values)
+        return {
+            "n": n,
+            "ops_per_s": round(n / total, 2) if total else 0.0,
+            "mean_ms": round(total / n * 1000, 4) if n else 0.0,
+            "p50_ms": round(percentile(values, 50) * 1000, 4),
+            "p99_ms": round(percentile(values, 99) * 1000, 4),
+            "max_ms": round(values[-1] * 1000, 4) if n else 0.0,
+            "peak_rss_kb": peak_rss_kb(),
+        }
+
+
+def bench_store(
+    store_factory: Callable[[str], BaseSessionStore],
+    data_dir: str,
+    shape: Shape,
+    ids: List[str],
+    repeat: int,
+) -> Dict[str, Dict[str, Any]]:
+    rng = random.Random(shape.seed)
+    gen = Generator(shape)
+    store = store_factory(data_dir)
+    ops: Dict[str, Timings] = {}
+
+    def timings(name: str) -> Timings:
+        return ops.setdefault(name, Timings())
+
+    for _ in range(repeat):
+        timings("list_sessions").time(store.list_sessions)
+
+    for sid in rng.choices(ids, k=repeat):
+        timings("get_session").time(store.get_session, sid)
+
+    for sid in rng.choices(ids, k=repeat):
+        sess = store.get_session(sid)
+        if sess is None:
+            continue
+        sess.messages.append(gen.user_message())
+        sess.messages.append(gen.assistant_message())
+        timings("save_session").time(store.save_session, sess)
+    store.close()
+
+    exported: Dict[str, Any] = {}
+    for _ in range(max(1, repeat // 50)):
+        exported = timings("export_all").time(store.export_all)
+
+    victims = rng.sample(ids, k=min(len(ids), max(2, repeat // 10)))
+    half = len(victims) // 2
+    for sid in victims[:half]:
+        timings("archive_session").time(store.archive_session, sid)
+    for sid in victims[half:]:
+        timings("delete_session").time(store.delete_session, sid)
+
+    timings("compact").time(store.compact)
+    store.close()
+
+    for _ in range(max(1, repeat // 50)):
+        fresh = tempfile.mkdtemp(prefix="snlite-bench-import-")
+        try:
+            target = store_factory(fresh)
+            timings("import_all").time(target.import_all, exported.get("sessions") or [], "append")
+            target.close()
+        finally:
+            shutil.rmtree(fresh, ignore_errors=True)
+
+    return {name: t.summary() for name, t in ops.items()}
+
+
+def run_backend(backend: str, shape: Shape, repeat: int, source: Optional[str], keep: bool) -> Dict[str, Any]:
+    def factory(path: str) -> BaseSessionStore:
+        return open_store(path, backend)
+
+    data_dir = tempfile.mkdtemp(prefix=f"snlite-bench-{backend}-")
+    try:
+        populate_ops: Dict[str, Any] = {}
+        if source:
+            shutil.copytree(source, data_dir, dirs_exist_ok=True)
+            store = factory(data_dir)
+            ids = [s["id"] for s in store.list_sessions()]
+        else:
+            store = factory(data_dir)
+            started = time.perf_counter()
+            ids = populate(store, shape)
+            elapsed = time.perf_counter() - started
+            saves = shape.sessions * ((shape.messages + 1) // 2 + 2 * shape.churn)
+            populate_ops = {"populate": {"n": saves, "ops_per_s": round(saves / elapsed, 2) if elapsed else 0.0}}
+        garbage_before = store.garbage_stats()
+        store.close()
+        if not ids:
+            raise SystemExit(f"{backend}: no sessions to benchmark")
+        ops = bench_store(factory, data_dir, shape, ids, repeat)
+        return {
+            "data_dir": data_dir if keep else None,
+            "garbage_before": garbage_before,
+            "ops": {**populate_ops, **ops},
+            "peak_rss_kb": peak_rss_kb(),
+        }
+    finally:
+        if not keep:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+# ---- baseline comparison ----
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], max_regression: float, noise_ms: float) -> List[str]:
+    """
+    Regressions of `current` against `baseline` results: p50/p99 latency up,
+    or throughput down, by more than `max_regression` percent. Latencies
+    below `noise_ms` in both runs are ignored.
+    """
+    limit = 1 + max_regression / 100
+    problems = []
+    for backend, result in current.get("backends", {}).items():
+        base_ops = baseline.get("backends", {}).get(backend, {}).get("ops", {})
+        for op, now in result["ops"].items():
+            before = base_ops.get(op)
+            if not before:
+                continue
+            for key in ("p50_ms", "p99_ms"):
+                old, new = before.get(key), now.get(key)
+                if old is None or new is None or max(old, new) < noise_ms:
+                    continue
+                if new > old * limit:
+                    problems.append(f"{backend}.{op}.{key}: {old} -> {new} (+{(new / max(old, 1e-9) - 1) * 100:.0f}%)")
+            old, new = before.get("ops_per_s"), now.get("ops_per_s")
+            if old and new is not None and new * limit < old and now.get("p50_ms", noise_ms) >= noise_ms:
+                problems.append(f"{backend}.{op}.ops_per_s: {old} -> {new} (-{(1 - new / old) * 100:.0f}%)")
+    return problems
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    defaults = Shape()
+    p = argparse.ArgumentParser(prog="python -m benchmarks.store_bench", description=__doc__.strip().splitlines()[0])
+    p.add_argument("--backend", default="jsonl", help=f"comma-separated: {', '.join(STORE_BACKENDS)}")
+    p.add_argument("--sessions", type=int, default=defaults.sessions)
+    p.add_argument("--messages", type=int, default=defaults.messages, help="messages per session")
+    p.add_argument("--message-chars", type=int, default=defaults.message_chars, help="mean message length")
+    p.add_argument("--churn", type=int, default=defaults.churn, help="regenerated answers per session")
+    p.add_argument("--attach-ratio", type=float, default=defaults.attach_ratio, help="share of turns with a file excerpt")
+    p.add_argument("--seed", type=int, default=defaults.seed)
+    p.add_argument("--like", metavar="DATA_DIR", help="take the shape (counts, median sizes) from an existing data dir")
+    p.add_argument("--data-dir", metavar="DATA_DIR", help="benchmark a copy of an existing data dir instead")
+    p.add_argument("--repeat", type=int, default=200, help="calls per timed operation")
+    p.add_argument("--out", help="write the JSON results here instead of stdout")
+    p.add_argument("--baseline", help="results file to compare against")
+    p.add_argument("--max-regression", type=float, default=20.0, help="allowed slowdown in percent (default 20)")
+    p.add_argument("--noise-ms", type=float, default=0.05, help="ignore latencies below this (default 0.05)")
+    p.add_argument("--keep", action="store_true", help="keep the generated data dirs")
+    args = p.parse_args(argv)
+
+    backends = [b.strip() for b in args.backend.split(",") if b.strip()]
+    for b in backends:
+        if b not in STORE_BACKENDS:
+            p.error(f"unknown backend: {b}")
+
+    if args.like:
+        # read a copy: opening a store may write index and lock files
+        with tempfile.TemporaryDirectory(prefix="snlite-bench-like-") as tmp:
+            shutil.copytree(args.like, tmp, dirs_exist_ok=True)
+            shape = shape_of(open_store(tmp), args.seed)
+        shape.churn = args.churn
+        if not shape.sessions:
+            p.error(f"no sessions in {args.like}")
+    else:
+        shape = Shape(
+            sessions=args.sessions,
+            messages=args.messages,
+            message_chars=args.message_chars,
+            churn=args.churn,
+            attach_ratio=args.attach_ratio,
+            seed=args.seed,
+        )
+
+    results: Dict[str, Any] = {
+        "version": RESULT_VERSION,
+        "created_at": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "shape": None if args.data_dir else shape.to_dict(),
+        "source": args.data_dir,
+        "repeat": args.repeat,
+        "durability": os.getenv("SNLITE_STORE_DURABILITY") or None,
+        "record_format": os.getenv("SNLITE_STORE_FORMAT") or None,
+        "backends": {},
+    }
+    for backend in backends:
+        print(f"[bench] {backend} ...", file=sys.stderr)
+        results["backends"][backend] = run_backend(backend, shape, args.repeat, args.data_dir, args.keep)
+
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        problems = compare(results, baseline, args.max_regression, args.noise_ms)
+        for line in problems:
+            print(f"[bench] regression {line}", file=sys.stderr)
+        if problems:
+            return 1
+        print("[bench] no regressions against baseline", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import random
+import statistics
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List
+
+from snlite.store_base import BaseSessionStore, Session
+
+_WORDS = (
+    "store session message archive index snapshot delta model prompt token "
+    "context answer question file excerpt stream latency budget cache local "
+    "模型 会话 消息 归档 文件 摘录 上下文 回答 问题 索引"
+).split()
+
+
+@dataclass
+class Shape:
+    """What a synthetic data dir looks like."""
+    sessions: int = 200
+    messages: int = 40  # per session, user and assistant alternating
+    message_chars: int = 400  # mean content length; lengths vary +-50%
+    churn: int = 4  # extra regenerate-style rewrites of the last answer per session
+    attach_ratio: float = 0.1  # share of user turns that carry a file excerpt
+    groups: int = 5
+    seed: int = 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def shape_of(store: BaseSessionStore, seed: int = 1) -> Shape:
+    """A Shape with the session count and median sizes of an existing store."""
+    counts: List[int] = []
+    chars: List[int] = []
+    attached = 0
+    user_turns = 0
+    groups = set()
+    for raw in store.iter_sessions():
+        msgs = raw["messages"]
+        counts.append(len(msgs))
+        chars.extend(len(str(m.get("content") or "")) for m in msgs)
+        groups.add(raw["group"])
+        for m in msgs:
+            if m.get("role") == "user":
+                user_turns += 1
+                meta = m.get("meta") or {}
+                attached += int(bool(meta.get("file_excerpts") or (meta.get("file_extract") or {}).get("files")))
+    return Shape(
+        sessions=len(counts),
+        messages=int(statistics.median(counts)) if counts else 0,
+        message_chars=int(statistics.median(chars)) if chars else 0,
+        churn=0,
+        attach_ratio=round(attached / user_turns, 3) if user_turns else 0.0,
+        groups=max(1, len(groups)),
+        seed=seed,
+    )
+
+
+class Generator:
+    """Deterministic (per `shape.seed`) sessions, messages and excerpts."""
+    def __init__(self, shape: Shape) -> None:
+        self.shape = shape
+        self.rng = random.Random(shape.seed)
+        # a handful of documents that users attach again and again
+        self.documents = [self.text(6000) for _ in range(3)]
+        self.system_prompts = ["", "You are a helpful assistant. " * 20]
+
+    def text(self, mean_chars: int) -> str:
+        target = max(1, int(mean_chars * self.rng.uniform(0.5, 1.5)))
+        words: List[str] = []
+        size = 0
+        while size < target:
+            w = self.rng.choice(_WORDS)
+            words.append(w)
+            size += len(w) + 1
+        return " ".join(words)
+
+    def user_message(self) -> Dict[str, Any]:
+        text = self.text(self.shape.message_chars)
+        system_text = self.rng.choice(self.system_prompts)
+        meta: Dict[str, Any] = {
+            "system_text": system_text,
+            "params": {"temperature": 0.7},
+            "think_mode": "auto",
+            "has_images": False,
+        }
+        if self.rng.random() < self.shape.attach_ratio:
+            doc = self.rng.choice(self.documents)
+            meta.update(user_text=text, file_excerpts=doc)
+            meta["file_extract"] = {"files": [{"name": "doc.pdf", "status": "ok", "chars": len(doc), "truncated": False}]}
+            content = "[File] doc.pdf\n" + text
+        else:
+            meta["prompt"] = text
+            content = text
+        return {"role": "user", "content": content, "meta": meta}
+
+    def assistant_message(self) -> Dict[str, Any]:
+        return {
+            "role": "assistant",
+            "content": self.text(self.shape.message_chars * 2),
+            "meta": {"provider": "ollama", "model": "bench", "usage": {"eval_count": self.rng.randint(10, 500)}},
+        }
+
+    def session(self, store: BaseSessionStore, index: int) -> Session:
+        return store.create_session(
+            title=f"bench {index} " + self.text(20),
+            group=f"group-{index % max(1, self.shape.groups)}",
+        )
+
+
+def populate(store: BaseSessionStore, shape: Shape) -> List[str]:
+    """
+    Fill `store` the way the app does: one save per chat turn, then `churn`
+    regenerated answers per session. Returns the session ids.
+    """
+    gen = Generator(shape)
+    ids = []
+    for i in range(shape.sessions):
+        sess = gen.session(store, i)
+        for _ in range(shape.messages // 2):
+            sess.messages.append(gen.user_message())
+            sess.messages.append(gen.assistant_message())
+            store.save_session(sess)
+        if shape.messages % 2:
+            sess.messages.append(gen.user_message())
+            store.save_session(sess)
+        for _ in range(shape.churn):
+            if sess.messages and sess.messages[-1]["role"] == "assistant":
+                sess.messages.pop()
+                store.save_session(sess)
+            sess.messages.append(gen.assistant_message())
+            store.save_session(sess)
+        ids.append(sess.id)
+    store.close()
+    return ids
@@ -0,0 +1,319 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# A segment stops taking new archives once it reaches this size.
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+# Segments with at least this share of dead bytes are rewritten by repack().
+REPACK_DEAD_RATIO = 0.3
+
+_SEGMENT_RE = re.compile(r"^seg-(\d{6})\.z$")
+_LOCATION_KEYS = ("segment", "offset", "length")
+
+
+def _public(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in row.items() if k not in _LOCATION_KEYS}
+
+
+class ArchiveSegments:
+    """
+    Archive texts packed into compressed segment files:
+    - data/archives/seg-NNNNNN.z: concatenated zlib streams, one per archive
+    - data/archives.jsonl: catalogue log; each row is the archive metadata
+      plus its `segment`/`offset`/`length`, or a tombstone
+      `{"archive_id", "deleted": true}`
+
+    The catalogue is parsed once into memory (and again only if the file
+    was changed by someone else), so lookups never touch the log and
+    reading an archive decompresses just its own entry. A delete removes
+    the archive's data at once: its bytes in the segment are overwritten
+    with zeros and the catalogue is rewritten without its row (tombstones
+    from older versions are still read). `repack` rewrites segments that
+    are mostly dead, moves old one-file-per-archive `.txt` rows
+    (`file_path`) into a segment, and rewrites the catalogue without dead
+    rows.
+
+    Not thread-safe; the owning store serializes access.
+    """
+    def __init__(self, archives_dir: str, catalogue_path: str) -> None:
+        self.archives_dir = archives_dir
+        self.catalogue_path = catalogue_path
+        os.makedirs(self.archives_dir, exist_ok=True)
+        self._rows: Dict[str, Dict[str, Any]] = {}
+        self._log_rows = 0  # rows in the catalogue file, including dead ones
+        self._key: Optional[Tuple[int, int, int]] = None  # (dev, ino, size) of the catalogue
+
+    # ---- catalogue ----
+
+    def _stat_key(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.catalogue_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_dev, st.st_ino, st.st_size)
+
+    def _ensure_loaded(self) -> None:
+        key = self._stat_key()
+        if key == self._key:
+            return
+        rows: Dict[str, Dict[str, Any]] = {}
+        count = 0
+        if key is not None:
+            with open(self.catalogue_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        row = json.loads(line)
+                    except Exception:
+                        continue
+                    archive_id = str(row.get("archive_id") or "").strip()
+                    if not archive_id:
+                        continue
+                    count += 1
+                    if row.get("deleted"):
+                        rows.pop(archive_id, None)
+                    else:
+                        rows[archive_id] = row
+        self._rows = rows
+        self._log_rows = count
+        self._key = key
+
+    def _append_rows(self, rows: List[Dict[str, Any]]) -> None:
+        with open(self.catalogue_path, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self._log_rows += len(rows)
+        self._key = self._stat_key()
+
+    # ---- segments ----
+
+    def _segment_path(self, name: str) -> str:
+        return os.path.join(self.archives_dir, name)
+
+    def _segments(self) -> List[str]:
+        return sorted(n for n in os.listdir(self.archives_dir) if _SEGMENT_RE.match(n))
+
+    def _new_segment_name(self) -> str:
+        names = self._segments()
+        n = int(_SEGMENT_RE.match(names[-1]).group(1)) + 1 if names else 1
+        return f"seg-{n:06d}.z"
+
+    def _writable_segment(self) -> str:
+        names = self._segments()
+        if names and os.path.getsize(self._segment_path(names[-1])) < SEGMENT_MAX_BYTES:
+            return names[-1]
+        return self._new_segment_name()
+
+    def _read_blob(self, row: Dict[str, Any]) -> bytes:
+        with open(self._segment_path(row["segment"]), "rb") as f:
+            f.seek(int(row["offset"]))
+            return f.read(int(row["length"]))
+
+    # ---- archives ----
+
+    def list(self) -> List[Dict[str, Any]]:
+        self._ensure_loaded()
+        rows = [_public(r) for r in self._rows.values()]
+        rows.sort(key=lambda x: float(x.get("archived_at", 0)), reverse=True)
+        return rows
+
+    def get(self, archive_id: str) -> Optional[Dict[str, Any]]:
+        self._ensure_loaded()
+        row = self._rows.get(archive_id)
+        if not row:
+            return None
+        if row.get("segment"):
+            try:
+                content = zlib.decompress(self._read_blob(row)).decode("utf-8")
+            except (OSError, zlib.error):
+                return None
+        else:
+            file_path = row.get("file_path") or ""
+            if not file_path or not os.path.exists(file_path):
+                return None
+            with open(file_path, "r", encoding="utf-8") as f:
+                content = f.read()
+        return {**_public(row), "content": content}
+
+    def put(self, meta: Dict[str, Any], content: str) -> Dict[str, Any]:
+        return self.put_many([(meta, content)])[0]
+
+    def put_many(self, items: List[Tuple[Dict[str, Any], str]]) -> List[Dict[str, Any]]:
+        """Append several archives to one segment with a single catalogue write."""
+        self._ensure_loaded()
+        segment = self._writable_segment()
+        rows = []
+        with open(self._segment_path(segment), "ab") as f:
+            for meta, content in items:
+                blob = zlib.compress(content.encode("utf-8"))
+                rows.append({**meta, "segment": segment, "offset": f.tell(), "length": len(blob)})
+                f.write(blob)
+        self._append_rows(rows)
+        for row in rows:
+            self._rows[row["archive_id"]] = row
+        return [_public(row) for row in rows]
+
+    def delete(self, archive_id: str) -> bool:
+        self._ensure_loaded()
+        row = self._rows.get(archive_id)
+        if not row:
+            return False
+        if row.get("segment"):
+            self._zero_blob(row)
+        rows = dict(self._rows)
+        del rows[archive_id]
+        self._write_catalogue(rows)
+        file_path = str(row.get("file_path") or "").strip()
+        if file_path and os.path.exists(file_path):
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+        return True
+
+    def _zero_blob(self, row: Dict[str, Any]) -> None:
+        """Overwrite an archive's compressed text in its segment; the space stays dead until repack."""
+        try:
+            with open(self._segment_path(row["segment"]), "r+b") as f:
+                f.seek(int(row["offset"]))
+                f.write(bytes(int(row["length"])))
+                f.flush()
+                os.fsync(f.fileno())
+        except FileNotFoundError:
+            pass
+
+    def _write_catalogue(self, rows: Dict[str, Dict[str, Any]]) -> None:
+        """Atomically replace the catalogue with one row per live archive."""
+        tmp = self.catalogue_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for row in rows.values():
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.catalogue_path)
+        self._rows = rows
+        self._log_rows = len(rows)
+        self._key = self._stat_key()
+
+    # ---- maintenance ----
+
+    def _segment_usage(self) -> Dict[str, Tuple[int, int]]:
+        """segment -> (file size, live bytes)"""
+        live: Dict[str, int] = {}
+        for row in self._rows.values():
+            if row.get("segment"):
+                live[row["segment"]] = live.get(row["segment"], 0) + int(row["length"])
+        return {
+            name: (os.path.getsize(self._segment_path(name)), live.get(name, 0))
+            for name in self._segments()
+        }
+
+    def stats(self) -> Dict[str, int]:
+        self._ensure_loaded()
+        usage = self._segment_usage()
+        total = sum(size for size, _ in usage.values())
+        live = sum(n for _, n in usage.values())
+        return {
+            "archive_bytes": total,
+            "archive_dead_bytes": max(0, total - live),
+            "archives": len(self._rows),
+            "archive_segments": len(usage),
+            "archive_legacy_files": sum(1 for r in self._rows.values() if not r.get("segment")),
+        }
+
+    def repack(self) -> Dict[str, int]:
+        """
+        Move live entries out of mostly-dead segments and legacy .txt files
+        into a fresh segment, then rewrite the catalogue. Old files are
+        removed only after the new catalogue is in place.
+        """
+        self._ensure_loaded()
+        usage = self._segment_usage()
+        victims = {
+            name for name, (size, live) in usage.items()
+            if size and (size - live) / size >= REPACK_DEAD_RATIO
+        }
+        moving = [
+            r for r in self._rows.values()
+            if (r.get("segment") in victims) or not r.get("segment")
+        ]
+        if not moving and not victims and self._log_rows == len(self._rows):
+            return {"moved": 0, "segments_removed": 0, "legacy_removed": 0}
+
+        rows = dict(self._rows)
+        legacy_files: List[str] = []
+        target = self._new_segment_name() if moving else None
+        if target:
+            with open(self._segment_path(target), "ab") as out:
+                for row in moving:
+                    if row.get("segment"):
+                        blob = self._read_blob(row)
+                    else:
+                        file_path = row.get("file_path") or ""
+                        if not file_path or not os.path.exists(file_path):
+                            continue
+                        with open(file_path, "r", encoding="utf-8") as f:
+                            blob = zlib.compress(f.read().encode("utf-8"))
+                        legacy_files.append(file_path)
+                    new = {k: v for k, v in row.items() if k not in ("file_path", "file_name")}
+                    new.update(segment=target, offset=out.tell(), length=len(blob))
+                    out.write(blob)
+                    rows[row["archive_id"]] = new
+                out.flush()
+                os.fsync(out.fileno())
+
+        self._write_catalogue(rows)
+
+        referenced = {r["segment"] for r in rows.values() if r.get("segment")}
+        removed = 0
+        for name in usage:
+            if name not in referenced:
+                os.remove(self._segment_path(name))
+                removed += 1
+        for file_path in legacy_files:
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+        return {"moved": len(moving), "segments_removed": removed, "legacy_removed": len(legacy_files)}
+
+
+class SegmentArchivesMixin:
+    """
+    Archive methods of BaseSessionStore backed by `self._archives`
+    (ArchiveSegments), serialized with the store's `self._lock` and, across
+    processes, its `self._flock` (InterProcessLock).
+    """
+    _archives: ArchiveSegments
+    _lock: Any
+    _flock: Any
+
+    def list_archives(self) -> List[Dict[str, Any]]:
+        with self._lock, self._flock.shared():
+            return self._archives.list()
+
+    def get_archive(self, archive_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock, self._flock.shared():
+            return self._archives.get(archive_id)
+
+    def delete_archive(self, archive_id: str) -> bool:
+        with self._lock, self._flock.exclusive():
+            if not self._archives.delete(archive_id):
+                return False
+            self._search_archive_deleted(archive_id)  # type: ignore[attr-defined]
+            return True
+
+    def _put_archive(self, archive_meta: Dict[str, Any], content: str) -> Dict[str, Any]:
+        with self._lock, self._flock.exclusive():
+            return self._archives.put(archive_meta, content)
+
+    def _put_archives(self, items: List[Tuple[Dict[str, Any], str]]) -> List[Dict[str, Any]]:
+        with self._lock, self._flock.exclusive():
+            return self._archives.put_many(items)
@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import zlib
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Message meta fields that may hold large, often repeated text: the full
+# model prompt, the attached file excerpts and the system prompt.
+BLOB_META_KEYS = ("prompt", "file_excerpts", "system_text")
+# Shorter values stay inline; a reference costs about 50 bytes.
+BLOB_MIN_CHARS = 512
+BLOB_REF = "$blob"
+
+_CACHE_ENTRIES = 64
+
+
+def blob_key(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _blob_ref(value: Any) -> Optional[str]:
+    if isinstance(value, dict) and isinstance(value.get(BLOB_REF), str):
+        return value[BLOB_REF]
+    return None
+
+
+def dehydrate(messages: List[Dict[str, Any]], put: Callable[[str, str], None]) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    Copy of `messages` with large BLOB_META_KEYS values replaced by
+    `{"$blob": key}` (each stored with `put(key, text)`), plus the keys used.
+    Messages without such values are shared, not copied.
+    """
+    out = []
+    keys: Dict[str, None] = {}
+    for m in messages:
+        meta = m.get("meta") if isinstance(m, dict) else None
+        if isinstance(meta, dict):
+            swapped = None
+            for k in BLOB_META_KEYS:
+                value = meta.get(k)
+                ref = _blob_ref(value)
+                if ref is None and isinstance(value, str) and len(value) >= BLOB_MIN_CHARS:
+                    ref = blob_key(value)
+                    put(ref, value)
+                    if swapped is None:
+                        swapped = dict(meta)
+                    swapped[k] = {BLOB_REF: ref}
+                if ref is not None:
+                    keys[ref] = None
+            if swapped is not None:
+                m = {**m, "meta": swapped}
+        out.append(m)
+    return out, list(keys)
+
+
+def hydrate(messages: List[Dict[str, Any]], get: Callable[[str], Optional[str]]) -> List[Dict[str, Any]]:
+    """Replace blob references in message meta with their text (in place)."""
+    for m in messages:
+        meta = m.get("meta") if isinstance(m, dict) else None
+        if not isinstance(meta, dict):
+            continue
+        for k in BLOB_META_KEYS:
+            ref = _blob_ref(meta.get(k))
+            if ref is None:
+                continue
+            text = get(ref)
+            if text is None:
+                logger.warning("message meta %s refers to missing blob %s", k, ref)
+                text = ""
+            meta[k] = text
+    return messages
+
+
+def message_blob_keys(messages: Iterable[Dict[str, Any]]) -> List[str]:
+    """Blob keys referenced by (dehydrated) messages."""
+    keys: Dict[str, None] = {}
+    for m in messages:
+        meta = m.get("meta") if isinstance(m, dict) else None
+        if isinstance(meta, dict):
+            for k in BLOB_META_KEYS:
+                ref = _blob_ref(meta.get(k))
+                if ref is not None:
+                    keys[ref] = None
+    return list(keys)
+
+
+class BlobStore:
+    """
+    Content-addressed text blobs for the file-based stores:
+    data/blobs/<xx>/<key>.z, zlib-compressed, named by the BLAKE2b hash of
+    the text. Writing a blob that exists is a no-op, so a document attached
+    turn after turn is kept once.
+
+    Blobs carry no count of their own: the owning store counts, from its
+    index, how many sessions reference each key and passes those counts to
+    `release` (with the keys of what it just deleted) or `sweep`.
+    Callers serialize writes and deletes with their exclusive lock.
+    """
+    def __init__(self, root: str, fsync: bool = False) -> None:
+        self.root = root
+        self.fsync = fsync
+        os.makedirs(self.root, exist_ok=True)
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + ".z")
+
+    def put(self, key: str, text: str) -> None:
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(zlib.compress(text.encode("utf-8")))
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def get(self, key: str) -> Optional[str]:
+        text = self._cache.get(key)
+        if text is not None:
+            self._cache.move_to_end(key)
+            return text
+        try:
+            with open(self._path(key), "rb") as f:
+                text = zlib.decompress(f.read()).decode("utf-8")
+        except (OSError, zlib.error):
+            return None
+        self._cache[key] = text
+        if len(self._cache) > _CACHE_ENTRIES:
+            self._cache.popitem(last=False)
+        return text
+
+    def dehydrate(self, messages: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[str]]:
+        return dehydrate(messages, self.put)
+
+    def hydrate(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return hydrate(messages, self.get)
+
+    def keys(self) -> Iterator[str]:
+        for sub in os.scandir(self.root):
+            if sub.is_dir():
+                for f in os.scandir(sub.path):
+                    if f.name.endswith(".z"):
+                        yield f.name[: -len(".z")]
+
+    def delete(self, keys: Iterable[str]) -> int:
+        removed = 0
+        for key in keys:
+            self._cache.pop(key, None)
+            try:
+                os.remove(self._path(key))
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def release(self, keys: Iterable[str], refs: Counter) -> int:
+        """Delete those of `keys` that nothing references any more."""
+        return self.delete(k for k in set(keys) if not refs.get(k))
+
+    def sweep(self, refs: Counter) -> int:
+        """Delete every blob that is not referenced."""
+        return self.delete([k for k in self.keys() if not refs.get(k)])
+
+    def stats(self, refs: Counter) -> Dict[str, int]:
+        count = 0
+        size = 0
+        dead = 0
+        for key in self.keys():
+            try:
+                n = os.path.getsize(self._path(key))
+            except OSError:
+                continue
+            count += 1
+            size += n
+            if not refs.get(key):
+                dead += n
+        return {"blobs": count, "blob_bytes": size, "blob_dead_bytes": dead}
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import base64
+import os
+from io import BytesIO
+from typing import Any, Dict, List, Tuple
+
+from docx import Document
+from pypdf import PdfReader
+
+MAX_FILES = 3
+MAX_FILE_BYTES = 6 * 1024 * 1024
+MAX_EXTRACT_CHARS_PER_FILE = 8000
+MAX_TOTAL_EXTRACT_CHARS = 16000
+
+
+class FileRejected(ValueError):
+    """An attachment that can't be accepted at all (count, size, encoding)."""
+
+
+def _safe_b64_to_bytes(b64: str) -> bytes:
+    try:
+        return base64.b64decode(b64, validate=False)
+    except Exception as e:
+        raise FileRejected(f"Invalid base64 file data: {e}")
+
+
+def _extract_text_pdf(data: bytes) -> str:
+    bio = BytesIO(data)
+    reader = PdfReader(bio)
+    out_parts = []
+    for page in reader.pages[:20]:
+        try:
+            t = page.extract_text() or ""
+        except Exception:
+            t = ""
+        if t.strip():
+            out_parts.append(t)
+        if sum(len(x) for x in out_parts) > MAX_EXTRACT_CHARS_PER_FILE:
+            break
+    return "\n\n".join(out_parts).strip()
+
+
+def _extract_text_docx(data: bytes) -> str:
+    doc = Document(BytesIO(data))
+    parts = []
+    for p in doc.paragraphs:
+        if p.text:
+            parts.append(p.text)
+        if sum(len(x) for x in parts) > MAX_EXTRACT_CHARS_PER_FILE:
+            break
+    return "\n".join(parts).strip()
+
+
+def _extract_text_plain(data: bytes) -> str:
+    try:
+        return data.decode("utf-8", errors="ignore").strip()
+    except Exception:
+        return data.decode("latin-1", errors="ignore").strip()
+
+
+def _snip(s: str, n: int) -> str:
+    s = (s or "").strip()
+    if len(s) <= n:
+        return s
+    return s[:n].rstrip() + "…"
+
+
+def parse_files(files: List[Dict[str, Any]]) -> Tuple[str, List[str], Dict[str, Any]]:
+    """
+    Decode and extract text from chat attachments ({name, mime, b64}).
+    Returns (text to inject into the prompt, one marker line per file, meta).
+
+    CPU-bound and free of app state, so it can run in a worker process.
+    Raises FileRejected for requests that should fail with 400.
+    """
+    if not files:
+        return "", [], {"files": [], "total_chars": 0, "truncated": False}
+
+    if len(files) > MAX_FILES:
+        raise FileRejected(f"Too many files. Max {MAX_FILES}.")
+
+    total_chars = 0
+    injected_blocks: List[str] = []
+    markers: List[str] = []
+    file_stats: List[Dict[str, Any]] = []
+    total_truncated = False
+
+    for f in files:
+        name = (f.get("name") or "file").strip()
+        mime = (f.get("mime") or "").strip().lower()
+        b64 = f.get("b64")
+        if not isinstance(b64, str) or not b64:
+            raise FileRejected(f"File {name} missing b64")
+
+        data = _safe_b64_to_bytes(b64)
+        if len(data) > MAX_FILE_BYTES:
+            raise FileRejected(f"File too large: {name} (max {MAX_FILE_BYTES//1024//1024}MB)")
+
+        ext = os.path.splitext(name)[1].lower()
+
+        text = ""
+        try:
+            if ext == ".pdf" or mime == "application/pdf":
+                text = _extract_text_pdf(data)
+            elif ext == ".docx" or mime in ("application/vnd.openxmlformats-officedocument.wordprocessingml.document",):
+                text = _extract_text_docx(data)
+            elif ext in (".txt", ".md") or mime.startswith("text/"):
+                text = _extract_text_plain(data)
+            else:
+                text = _extract_text_plain(data)
+        except Exception as e:
+            injected_blocks.append(f"> [File: {name}] (parse failed: {e})")
+            markers.append(f"[File] {name} (parse failed)")
+            file_stats.append({"name": name, "status": "parse_failed", "chars": 0, "truncated": False})
+            continue
+
+        text = (text or "").strip()
+        if not text:
+            injected_blocks.append(f"> [File: {name}] (no extractable text)")
+            markers.append(f"[File] {name} (empty)")
+            file_stats.append({"name": name, "status": "empty", "chars": 0, "truncated": False})
+            continue
+
+        raw_len = len(text)
+        text = _snip(text, MAX_EXTRACT_CHARS_PER_FILE)
+        file_truncated = len(text) < raw_len
+        if total_chars + len(text) > MAX_TOTAL_EXTRACT_CHARS:
+            remain = max(0, MAX_TOTAL_EXTRACT_CHARS - total_chars)
+            text = _snip(text, remain) if remain > 0 else ""
+            file_truncated = True
+        total_chars += len(text)
+        total_truncated = total_truncated or file_truncated
+
+        injected_blocks.append(f"> [File: {name}]\n> " + "\n> ".join(text.splitlines()))
+        trunc_mark = " (truncated)" if file_truncated else ""
+        one_line = _snip(text.replace("\n", " "), 120)
+        markers.append(f"[File] {name}: {one_line} [injected {len(text)} chars{trunc_mark}]")
+        file_stats.append({"name": name, "status": "ok", "chars": len(text), "truncated": file_truncated})
+
+        if total_chars >= MAX_TOTAL_EXTRACT_CHARS:
+            injected_blocks.append("> [Note] File excerpts truncated due to total limit.")
+            total_truncated = True
+            break
+
+    injected_text = "\n\n".join(injected_blocks).strip() if injected_blocks else ""
+    return injected_text, markers, {"files": file_stats, "total_chars": total_chars, "truncated": total_truncated}
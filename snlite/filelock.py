@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import os
+from contextlib import contextmanager
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, single process only
+    fcntl = None  # type: ignore[assignment]
+
+_LOCK_SH, _LOCK_EX, _LOCK_UN = (fcntl.LOCK_SH, fcntl.LOCK_EX, fcntl.LOCK_UN) if fcntl else (0, 0, 0)
+
+
+class InterProcessLock:
+    """
+    Reader/writer lock shared by every process that opens the same data
+    directory (advisory `flock` on `path`), plus a generation counter kept
+    in the lock file itself.
+
+    Writers bump the generation whenever they replace a file that other
+    processes index by byte offset, so a reader that sees a new generation
+    knows its offsets are stale even if the new file happens to reuse the
+    old inode and is not shorter.
+
+    Re-entrant within a process: nested `shared()`/`exclusive()` calls only
+    take the lock once. Asking for exclusive while holding shared upgrades
+    the lock until it is fully released; the upgrade is not atomic, so
+    re-check shared state after it.
+    Not thread-safe; the owning store calls it with its own lock held.
+    Without fcntl every call is a no-op.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._depth = 0
+        self._exclusive = False
+
+    def _flock(self, op: int) -> None:
+        if fcntl is not None:
+            fcntl.flock(self._fd, op)
+
+    @property
+    def held_exclusive(self) -> bool:
+        return self._depth > 0 and self._exclusive
+
+    def acquire(self, exclusive: bool) -> None:
+        if not self._depth:
+            self._flock(_LOCK_EX if exclusive else _LOCK_SH)
+            self._exclusive = exclusive
+        elif exclusive and not self._exclusive:
+            self._flock(_LOCK_EX)
+            self._exclusive = True
+        self._depth += 1
+
+    def release(self) -> None:
+        self._depth -= 1
+        if not self._depth:
+            self._flock(_LOCK_UN)
+            self._exclusive = False
+
+    @contextmanager
+    def shared(self) -> Iterator[None]:
+        self.acquire(exclusive=False)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        self.acquire(exclusive=True)
+        try:
+            yield
+        finally:
+            self.release()
+
+    # ---- generation counter ----
+
+    def generation(self) -> int:
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        try:
+            return int(os.read(self._fd, 32).strip() or 0)
+        except ValueError:
+            return 0
+
+    def bump_generation(self) -> int:
+        """Increment the shared generation (exclusive lock held)."""
+        n = self.generation() + 1
+        data = f"{n}\n".encode("ascii")
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        os.write(self._fd, data)
+        os.ftruncate(self._fd, len(data))
+        return n
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
@@ -0,0 +1,255 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from itertools import islice
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from snlite.registry import CancelToken
+from snlite.sse import Coalescer, sse_event
+
+logger = logging.getLogger(__name__)
+
+TOKEN_EVENTS = ("content", "thinking")
+# Superseded by the stage a resync event carries
+REPLACED_BY_RESYNC = ("status",)
+
+# How long a new generation waits for its first follower, at least
+ATTACH_TIMEOUT_S = 10.0
+
+
+class _Subscriber:
+    __slots__ = ("frames", "wake", "dropped")
+
+    def __init__(self) -> None:
+        self.frames: List[str] = []
+        self.wake = asyncio.Event()
+        self.dropped = False
+
+
+class Generation:
+    """
+    One chat generation, run as a server-side task that does not depend on
+    the HTTP response following it. Its SSE events are numbered (`id:`
+    lines) and kept in a bounded ring buffer, so a client that lost its
+    connection can come back with Last-Event-ID and replay what it missed.
+
+    The producer appends to `content_parts` / `thinking_parts` before
+    publishing the matching frames. A follower that fell behind the ring
+    buffer gets them as one `resync` event instead, followed by the other
+    (status, error, done) events still buffered.
+    """
+    def __init__(
+        self,
+        request_id: str,
+        session_id: str,
+        token: CancelToken,
+        buffer_events: int,
+        orphan_grace_s: float,
+        subscriber_queue: int,
+    ) -> None:
+        self.request_id = request_id
+        self.session_id = session_id
+        self.token = token
+        self.started_at = time.time()
+        self.events: Deque[Tuple[int, str, str]] = deque(maxlen=max(1, buffer_events))
+        self.seq = 0
+        self.stage = "answering"
+        self.content_parts: List[str] = []
+        self.thinking_parts: List[str] = []
+        self.coalescer: Optional[Coalescer] = None
+        self.orphan_grace_s = orphan_grace_s
+        self.subscriber_queue = max(1, subscriber_queue)
+        self.dropped = 0  # subscribers cut off for reading too slowly
+        self.finished = False
+        self.task: Optional[asyncio.Task] = None
+        self._subscribers: List[_Subscriber] = []
+        self._orphan_timer: Optional[asyncio.TimerHandle] = None
+
+    def publish(self, frames: List[str]) -> None:
+        """Number and buffer SSE frames (each one complete event) and pass them to subscribers."""
+        numbered = []
+        for frame in frames:
+            self.seq += 1
+            kind = frame[len("event: "):frame.index("\n")]
+            text = f"id: {self.seq}\n{frame}"
+            self.events.append((self.seq, kind, text))
+            numbered.append(text)
+        for sub in list(self._subscribers):
+            if len(sub.frames) + len(numbered) > self.subscriber_queue:
+                # never wait for a slow reader: drop it, it can come back
+                # with Last-Event-ID
+                self._subscribers.remove(sub)
+                sub.dropped = True
+                self.dropped += 1
+            else:
+                sub.frames.extend(numbered)
+            sub.wake.set()
+
+    def finish(self) -> None:
+        self.finished = True
+        self._cancel_orphan_timer()
+        for sub in self._subscribers:
+            sub.wake.set()
+
+    def _resync_frame(self) -> str:
+        data = {"stage": self.stage, "content": "".join(self.content_parts), "thinking": "".join(self.thinking_parts)}
+        return f"id: {self.seq}\n" + sse_event("resync", data)
+
+    def _backlog(self, after: int) -> List[str]:
+        oldest = self.events[0][0] if self.events else self.seq + 1
+        if after < oldest - 1:
+            # The resync carries the newest id and the current stage; the
+            # other buffered events (error, done, ...) follow without their
+            # older ids, so the client's Last-Event-ID never goes back
+            # behind text the resync already included.
+            pending = [self._resync_frame()]
+            pending.extend(
+                frame.split("\n", 1)[1]
+                for _, kind, frame in self.events
+                if kind not in TOKEN_EVENTS and kind not in REPLACED_BY_RESYNC
+            )
+            return pending
+        return [frame for _, _, frame in islice(self.events, max(0, after - oldest + 1), None)]
+
+    @property
+    def followers(self) -> int:
+        return len(self._subscribers)
+
+    async def follow(self, after: int = 0) -> AsyncIterator[str]:
+        """
+        Frames after event id `after`, then live ones until the generation
+        is over. Everything pending is written as one chunk. Any number of
+        clients may follow; each gets its own bounded queue.
+        """
+        sub = _Subscriber()
+        backlog = self._backlog(after)
+        self._subscribers.append(sub)
+        self._cancel_orphan_timer()
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                if backlog or sub.frames:
+                    pending = backlog + sub.frames
+                    backlog = []
+                    sub.frames = []
+                    sent_at = loop.time()
+                    yield "".join(pending)
+                    if self.coalescer:
+                        self.coalescer.sent(loop.time() - sent_at)
+                elif sub.dropped:
+                    yield sse_event("dropped", {"reason": "slow_consumer"})
+                    return
+                elif self.finished:
+                    return
+                else:
+                    sub.wake.clear()
+                    await sub.wake.wait()
+        finally:
+            if sub in self._subscribers:
+                self._subscribers.remove(sub)
+            if not self._subscribers and not self.finished:
+                self._start_orphan_timer()
+
+    # ---- orphans ----
+
+    def _start_orphan_timer(self, grace_s: Optional[float] = None) -> None:
+        self._cancel_orphan_timer()
+        grace_s = self.orphan_grace_s if grace_s is None else grace_s
+        if grace_s <= 0:
+            self.token.cancel("disconnect")
+            return
+        self._orphan_timer = asyncio.get_running_loop().call_later(grace_s, self.token.cancel, "disconnect")
+
+    def _cancel_orphan_timer(self) -> None:
+        if self._orphan_timer is not None:
+            self._orphan_timer.cancel()
+            self._orphan_timer = None
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "request_id": self.request_id,
+            "session_id": self.session_id,
+            "started_at": self.started_at,
+            "stage": self.stage,
+            "events": self.seq,
+            "output_chars": sum(len(p) for p in self.content_parts),
+            "followers": self.followers,
+            "dropped": self.dropped,
+            "finished": self.finished,
+        }
+
+
+class GenerationHub:
+    """
+    Running generations by request id. A generation stays attachable for
+    `retain_s` after it finished; one nobody follows is cancelled after
+    `orphan_grace_s` (reason "disconnect"). A follower more than
+    `subscriber_queue` events behind is dropped.
+    """
+    def __init__(
+        self,
+        buffer_events: int = 2048,
+        orphan_grace_s: float = 30.0,
+        retain_s: float = 60.0,
+        subscriber_queue: int = 1024,
+    ) -> None:
+        self.buffer_events = buffer_events
+        self.orphan_grace_s = orphan_grace_s
+        self.retain_s = retain_s
+        self.subscriber_queue = subscriber_queue
+        self._generations: Dict[str, Generation] = {}
+
+    def start(
+        self,
+        request_id: str,
+        session_id: str,
+        token: CancelToken,
+        run: Callable[[Generation], Awaitable[None]],
+    ) -> Generation:
+        """Register a generation and run `run(gen)` in a task of its own."""
+        gen = Generation(request_id, session_id, token, self.buffer_events, self.orphan_grace_s, self.subscriber_queue)
+        self._generations[request_id] = gen
+        gen.task = asyncio.create_task(self._run(gen, run))
+        # in case the response that should follow it never starts
+        gen._start_orphan_timer(max(self.orphan_grace_s, ATTACH_TIMEOUT_S))
+        return gen
+
+    async def _run(self, gen: Generation, run: Callable[[Generation], Awaitable[None]]) -> None:
+        try:
+            await run(gen)
+        except Exception:
+            logger.exception("generation %s failed", gen.request_id)
+        finally:
+            gen.finish()
+            asyncio.get_running_loop().call_later(self.retain_s, self._forget, gen)
+
+    def _forget(self, gen: Generation) -> None:
+        if self._generations.get(gen.request_id) is gen:
+            del self._generations[gen.request_id]
+
+    def get(self, request_id: str) -> Optional[Generation]:
+        return self._generations.get(request_id)
+
+    def list(self, session_id: Optional[str] = None, include_finished: bool = False) -> List[Dict[str, Any]]:
+        """Summaries of the generations (of one session), oldest first."""
+        return [
+            gen.summary()
+            for gen in sorted(self._generations.values(), key=lambda g: g.started_at)
+            if (session_id is None or gen.session_id == session_id) and (include_finished or not gen.finished)
+        ]
+
+    def stats(self) -> Dict[str, int]:
+        running = [g for g in self._generations.values() if not g.finished]
+        return {
+            "running": len(running),
+            "retained": len(self._generations) - len(running),
+            "followers": sum(g.followers for g in running),
+            "dropped": sum(g.dropped for g in self._generations.values()),
+        }
+
+    def close(self) -> None:
+        for gen in list(self._generations.values()):
+            gen.token.cancel("shutdown")
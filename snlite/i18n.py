@@ -130,13 +130,18 @@ ZH_CN_MESSAGES: Dict[str, str] = {
     "status.init_error": "初始化错误：{message}",
     "stage.thinking": "思考中…",
     "stage.answering": "回答中…",
+    "stage.queued": "排队中：第 {position} 位，约 {eta} 秒…",
     "session.ungrouped": "未分组",
     "session.new_chat": "新聊天",
+    "session.load_more": "加载更多",
+    "session.content_matches": "内容匹配",
+    "session.archive_group": "归档本组",
     "archive.none": "暂无归档",
     "archive.untitled": "未命名",
     "prompt.new_title": "新标题：",
     "confirm.archive": "归档当前会话？会话将被移除并保存为 TXT。",
     "confirm.delete_session": "永久删除当前会话（不归档）？此操作不可撤销。",
+    "confirm.archive_group": "归档分组「{group}」中的全部 {count} 个会话？",
     "confirm.delete_archive": "永久删除选中的归档？",
     "confirm.import_mode": "导入模式：确定=替换本地会话，取消=仅追加。",
     "confirm.compact": "现在压缩本地会话快照吗？",
@@ -284,13 +289,18 @@ EN_MESSAGES: Dict[str, str] = {
     "status.init_error": "Init error: {message}",
     "stage.thinking": "Thinking…",
     "stage.answering": "Answering…",
+    "stage.queued": "Queued: #{position}, ~{eta}s…",
     "session.ungrouped": "Ungrouped",
     "session.new_chat": "New Chat",
+    "session.load_more": "Load more",
+    "session.content_matches": "Content matches",
+    "session.archive_group": "Archive group",
     "archive.none": "No archives yet",
     "archive.untitled": "Untitled",
     "prompt.new_title": "New title:",
     "confirm.archive": "Archive this session? It will be removed and saved as TXT.",
     "confirm.delete_session": "Delete this session permanently without archiving? This cannot be undone.",
+    "confirm.archive_group": "Archive all {count} sessions in group \"{group}\"?",
     "confirm.delete_archive": "Delete selected archive permanently?",
     "confirm.import_mode": "Import mode: OK = replace all local sessions, Cancel = append only.",
     "confirm.compact": "Compact local session snapshots now?",
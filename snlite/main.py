@@ -4,9 +4,11 @@ import os
 import re
 import json
 import asyncio
-import base64
-from io import BytesIO
-from typing import Any, Dict, List, Optional, Union, Tuple
+import logging
+import time
+import zlib
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
 
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse, JSONResponse
@@ -14,31 +16,172 @@ from fastapi.staticfiles import StaticFiles
 import uvicorn
 
 from snlite.registry import AppRegistry
-from snlite.store import SessionStore, DEFAULT_GROUP
+from snlite.retention import RetentionPolicy, apply_retention, plan_retention
+from snlite.scheduler import ConcurrencyLimits, GenerationScheduler, QueueFull, Ticket
+from snlite.store import open_store, DEFAULT_GROUP
+from snlite.generation import Generation, GenerationHub
+from snlite.search import SearchIndex
+from snlite.sse import Coalescer, sse_event, token_event
+from snlite.extract import FileRejected, parse_files
+from snlite.offload import AsyncStore, BlockingPool, LoopLagMonitor
 from snlite.plugin_manager import PluginRecord, load_provider_plugins
 from snlite.i18n import load_locales
 from snlite.providers.ollama import OllamaProvider
 
-from docx import Document
-from pypdf import PdfReader
-
 SNLITE_HOST = os.getenv("SNLITE_HOST", "127.0.0.1")
 SNLITE_PORT = int(os.getenv("SNLITE_PORT", "8000"))
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://127.0.0.1:11434")
 SNLITE_DATA_DIR = os.getenv("SNLITE_DATA_DIR", os.path.join(os.getcwd(), "data"))
 
-MAX_FILES = 3
-MAX_FILE_BYTES = 6 * 1024 * 1024
-MAX_EXTRACT_CHARS_PER_FILE = 8000
-MAX_TOTAL_EXTRACT_CHARS = 16000
+# Blocking work (store calls, file parsing) runs off the event loop:
+# SNLITE_IO_WORKERS threads for I/O, SNLITE_PARSE_WORKERS processes for
+# PDF/DOCX extraction (0 = parse in the I/O threads). Worker processes are
+# spawned and re-import the launching script, so only enable them when
+# starting via `SNLYao` or `uvicorn snlite.main:app`.
+IO_WORKERS = int(os.getenv("SNLITE_IO_WORKERS", "8"))
+PARSE_WORKERS = int(os.getenv("SNLITE_PARSE_WORKERS", "0"))
+# Event loop stalls longer than this are logged as violations
+LOOP_BUDGET_MS = float(os.getenv("SNLITE_LOOP_BUDGET_MS", "100"))
+LOOP_DEBUG = os.getenv("SNLITE_LOOP_DEBUG", "").strip().lower() in ("1", "true", "yes", "on")
+
+# Background compaction of the session store (interval 0 disables it)
+COMPACT_INTERVAL_S = float(os.getenv("SNLITE_COMPACT_INTERVAL", "60"))
+COMPACT_GARBAGE_RATIO = float(os.getenv("SNLITE_COMPACT_RATIO", "0.5"))
+COMPACT_MIN_BYTES = int(os.getenv("SNLITE_COMPACT_MIN_BYTES", str(8 * 1024 * 1024)))
+COMPACT_MAX_DEAD_BYTES = int(os.getenv("SNLITE_COMPACT_MAX_DEAD_BYTES", str(256 * 1024 * 1024)))
+
+# Retention: archive sessions untouched for N days and/or beyond a per-group
+# cap ("200" or "200,scratch=20"); checked every interval, BATCH per pass
+RETENTION_DAYS = os.getenv("SNLITE_RETENTION_DAYS", "0")
+RETENTION_GROUP_MAX = os.getenv("SNLITE_RETENTION_GROUP_MAX", "")
+RETENTION_POLICY = RetentionPolicy.parse(RETENTION_DAYS, RETENTION_GROUP_MAX)
+RETENTION_INTERVAL_S = float(os.getenv("SNLITE_RETENTION_INTERVAL", "3600"))
+RETENTION_BATCH = int(os.getenv("SNLITE_RETENTION_BATCH", "100"))
+
+# Streamed tokens are merged into one SSE frame per window or byte count
+# (0 ms = only merge what is already waiting); requests can opt out with
+# "coalesce": false
+SSE_COALESCE_MS = float(os.getenv("SNLITE_SSE_COALESCE_MS", "30"))
+SSE_COALESCE_BYTES = int(os.getenv("SNLITE_SSE_COALESCE_BYTES", "256"))
+STATUS_ANSWERING_EVENT = sse_event("status", {"stage": "answering"})
+STATUS_THINKING_EVENT = sse_event("status", {"stage": "thinking"})
+
+# Generations run on after their stream drops: SNLITE_STREAM_BUFFER events
+# are kept for clients that re-attach, a generation nobody follows is
+# cancelled after SNLITE_STREAM_ORPHAN_GRACE seconds (0 = at once), and a
+# finished one stays attachable for SNLITE_STREAM_RETAIN seconds. Any number
+# of clients can follow one; a follower SNLITE_STREAM_SUBSCRIBER_QUEUE
+# events behind is dropped (it can re-attach)
+STREAM_BUFFER_EVENTS = int(os.getenv("SNLITE_STREAM_BUFFER", "2048"))
+STREAM_ORPHAN_GRACE_S = float(os.getenv("SNLITE_STREAM_ORPHAN_GRACE", "30"))
+STREAM_RETAIN_S = float(os.getenv("SNLITE_STREAM_RETAIN", "60"))
+STREAM_SUBSCRIBER_QUEUE = int(os.getenv("SNLITE_STREAM_SUBSCRIBER_QUEUE", "1024"))
+
+# Generations per provider/model allowed to run at once ("2" or
+# "2,ollama=4,ollama/qwen3:4b=1"; 0 = no limit); more wait in a queue of at
+# most SNLITE_GEN_QUEUE_MAX (0 = unbounded), beyond which requests get 429.
+# Title generation waits at most SNLITE_GEN_TITLE_WAIT seconds for a slot
+# before falling back to the heuristic title.
+GEN_CONCURRENCY = ConcurrencyLimits.parse(os.getenv("SNLITE_GEN_CONCURRENCY", "2"))
+GEN_QUEUE_MAX = int(os.getenv("SNLITE_GEN_QUEUE_MAX", "32"))
+GEN_TITLE_WAIT_S = float(os.getenv("SNLITE_GEN_TITLE_WAIT", "20"))
+
+# Full-text search index, written to disk at most every N seconds
+SEARCH_FLUSH_INTERVAL_S = float(os.getenv("SNLITE_SEARCH_FLUSH_INTERVAL", "5"))
+MAX_SEARCH_RESULTS = 100
+
+# Streaming backup export / import
+EXPORT_CHUNK_BYTES = 256 * 1024
+MAX_IMPORT_LINE_BYTES = 64 * 1024 * 1024
+NDJSON_BACKUP_FORMAT = "snlite.sessions.ndjson.v1"
+
+logger = logging.getLogger(__name__)
+
+
+async def _auto_compact_loop() -> None:
+    while True:
+        await asyncio.sleep(COMPACT_INTERVAL_S)
+        try:
+            stats = await astore.maybe_compact(
+                COMPACT_GARBAGE_RATIO,
+                COMPACT_MIN_BYTES,
+                COMPACT_MAX_DEAD_BYTES,
+            )
+        except Exception:
+            logger.exception("background compaction failed")
+            continue
+        if stats:
+            logger.info("background compaction: %s", stats)
+
 
-app = FastAPI(title="SnliteYao", version="1.1.0")
+async def _run_retention(policy: RetentionPolicy) -> Dict[str, Any]:
+    """Archive everything `policy` selects, one batch per store pass."""
+    archived = 0
+    failed = 0
+    while True:
+        report = await io_pool.run("store.retention", apply_retention, store, policy, RETENTION_BATCH)
+        archived += report["archived"]
+        failed += report["failed"]
+        if not report["remaining"] or not report["archived"]:
+            return {"archived": archived, "failed": failed, "remaining": report["remaining"]}
+
+
+async def _retention_loop() -> None:
+    while True:
+        await asyncio.sleep(RETENTION_INTERVAL_S)
+        try:
+            stats = await _run_retention(RETENTION_POLICY)
+        except Exception:
+            logger.exception("retention pass failed")
+            continue
+        if stats["archived"] or stats["failed"]:
+            logger.info("retention: %s", stats)
+
+
+async def _search_flush_loop() -> None:
+    while True:
+        await asyncio.sleep(SEARCH_FLUSH_INTERVAL_S)
+        try:
+            await io_pool.run("search.flush", search_index.flush)
+        except Exception:
+            logger.exception("search index flush failed")
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    await astore.attach_search(search_index)
+    tasks: List[asyncio.Task] = [
+        asyncio.create_task(loop_monitor.run()),
+        asyncio.create_task(_search_flush_loop()),
+    ]
+    if COMPACT_INTERVAL_S > 0:
+        tasks.append(asyncio.create_task(_auto_compact_loop()))
+    if RETENTION_POLICY.enabled and RETENTION_INTERVAL_S > 0:
+        tasks.append(asyncio.create_task(_retention_loop()))
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        generations.close()
+        store.close()
+        search_index.flush()
+        io_pool.shutdown()
+
+
+app = FastAPI(title="SnliteYao", version="1.1.0", lifespan=lifespan)
 
 WEB_DIR = os.path.join(os.path.dirname(__file__), "web")
 app.mount("/static", StaticFiles(directory=WEB_DIR), name="static")
 
 registry = AppRegistry()
-store = SessionStore(SNLITE_DATA_DIR)
+store = open_store(SNLITE_DATA_DIR)
+search_index = SearchIndex(os.path.join(SNLITE_DATA_DIR, "search_index.json"))
+io_pool = BlockingPool(threads=IO_WORKERS, processes=PARSE_WORKERS)
+astore = AsyncStore(store, io_pool)
+generations = GenerationHub(STREAM_BUFFER_EVENTS, STREAM_ORPHAN_GRACE_S, STREAM_RETAIN_S, STREAM_SUBSCRIBER_QUEUE)
+scheduler = GenerationScheduler(GEN_CONCURRENCY, GEN_QUEUE_MAX)
+loop_monitor = LoopLagMonitor(budget_ms=LOOP_BUDGET_MS, debug=LOOP_DEBUG)
 
 ollama_provider = OllamaProvider(base_url=OLLAMA_BASE_URL)
 PROVIDERS = {"ollama": ollama_provider}
@@ -164,17 +307,34 @@ async def unload_model() -> Dict[str, Any]:
 
 
 # Sessions
+MAX_SESSIONS_PAGE = 500
+
+
 @app.get("/api/sessions")
-async def sessions_list() -> List[Dict[str, Any]]:
-    items = store.list_sessions()
-    return [x for x in items if x.get("title") != "__deleted__"]
+async def sessions_list(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    group: Optional[str] = None,
+    prefix: Optional[str] = None,
+    q: Optional[str] = None,
+) -> Any:
+    # Without paging/filter params keep returning the plain list.
+    if limit is None and not (cursor or group is not None or prefix or q):
+        items = await astore.list_sessions()
+        return [x for x in items if x.get("title") != "__deleted__"]
+
+    limit = max(1, min(limit or 50, MAX_SESSIONS_PAGE))
+    try:
+        return await astore.list_sessions_page(limit=limit, cursor=cursor, group=group, title_prefix=prefix, query=q)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.post("/api/sessions")
 async def sessions_create(payload: Dict[str, Any]) -> Dict[str, Any]:
     title = payload.get("title") or "New Chat"
     group = payload.get("group") or DEFAULT_GROUP
-    sess = store.create_session(title=title, group=group)
+    sess = await astore.create_session(title=title, group=group)
     return {
         "id": sess.id,
         "title": sess.title,
@@ -184,19 +344,57 @@ async def sessions_create(payload: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
+# Large per-message meta fields (model prompt, file excerpts, system prompt)
+HEAVY_META_KEYS = ("prompt", "file_excerpts", "system_text")
+
+
+def _strip_heavy_meta(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    out = []
+    for m in messages:
+        meta = m.get("meta")
+        if isinstance(meta, dict) and any(k in meta for k in HEAVY_META_KEYS):
+            m = {**m, "meta": {k: v for k, v in meta.items() if k not in HEAVY_META_KEYS}}
+        out.append(m)
+    return out
+
+
+async def _json_response(content: Any) -> JSONResponse:
+    """Encode in the I/O pool: a long session takes a while to serialize."""
+    return await io_pool.run("json.encode", JSONResponse, content)
+
+
 @app.get("/api/sessions/{session_id}")
-async def sessions_get(session_id: str) -> Dict[str, Any]:
-    sess = store.get_session(session_id)
+async def sessions_get(
+    session_id: str,
+    limit: Optional[int] = None,
+    before: Optional[int] = None,
+    strip_meta: bool = False,
+) -> Any:
+    """
+    `limit` returns only the last `limit` messages before index `before`
+    (default: the end); page backwards with `before=offset` while
+    `has_more`. `strip_meta` drops HEAVY_META_KEYS from message meta.
+    """
+    if limit is None and before is None:
+        sess = await astore.get_session(session_id)
+        total = len(sess.messages) if sess else 0
+        offset = 0
+    else:
+        window = await astore.get_session_window(session_id, limit=max(1, limit or 50), before=before)
+        sess, total, offset = window if window else (None, 0, 0)
     if not sess or sess.title == "__deleted__":
         raise HTTPException(status_code=404, detail="session not found")
-    return {
+    return await _json_response({
         "id": sess.id,
         "title": sess.title,
         "group": sess.group,
         "created_at": sess.created_at,
         "updated_at": sess.updated_at,
-        "messages": sess.messages,
-    }
+        "messages": _strip_heavy_meta(sess.messages) if strip_meta else sess.messages,
+        "total_messages": total,
+        "offset": offset,
+        "has_more": offset > 0,
+    })
 
 
 @app.patch("/api/sessions/{session_id}")
@@ -204,7 +402,7 @@ async def sessions_rename(session_id: str, payload: Dict[str, Any]) -> Dict[str,
     title = payload.get("title")
     group = payload.get("group")
 
-    sess = store.get_session(session_id)
+    sess = await astore.get_session(session_id)
     if not sess or sess.title == "__deleted__":
         raise HTTPException(status_code=404, detail="session not found")
 
@@ -215,11 +413,11 @@ async def sessions_rename(session_id: str, payload: Dict[str, Any]) -> Dict[str,
         title = str(title).strip()
         if not title:
             raise HTTPException(status_code=400, detail="title is required")
-        sess = store.rename_session(session_id, title=title)
+        sess = await astore.rename_session(session_id, title=title)
 
     if group is not None:
         group = str(group).strip()
-        sess = store.set_session_group(session_id, group=group)
+        sess = await astore.set_session_group(session_id, group=group)
 
     if not sess or sess.title == "__deleted__":
         raise HTTPException(status_code=404, detail="session not found")
@@ -228,7 +426,7 @@ async def sessions_rename(session_id: str, payload: Dict[str, Any]) -> Dict[str,
 
 @app.delete("/api/sessions/{session_id}")
 async def sessions_delete(session_id: str) -> Dict[str, Any]:
-    archive_meta = store.archive_session(session_id)
+    archive_meta = await astore.archive_session(session_id)
     if not archive_meta:
         raise HTTPException(status_code=404, detail="session not found")
     return {"ok": True, "archived": archive_meta}
@@ -236,28 +434,45 @@ async def sessions_delete(session_id: str) -> Dict[str, Any]:
 
 @app.delete("/api/sessions/{session_id}/hard")
 async def sessions_delete_hard(session_id: str) -> Dict[str, Any]:
-    ok = store.delete_session(session_id)
+    ok = await astore.delete_session(session_id)
     if not ok:
         raise HTTPException(status_code=404, detail="session not found")
     return {"ok": True, "deleted": True}
 
 
+MAX_BULK_OPS = 1000
+
+
+@app.post("/api/sessions/bulk")
+async def sessions_bulk(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Apply `ops` (rename, set_group, merge_groups, archive, delete; see
+    BaseSessionStore.bulk) in one store pass; returns a result per item.
+    """
+    ops = payload.get("ops")
+    if not isinstance(ops, list) or not ops:
+        raise HTTPException(status_code=400, detail="ops must be a non-empty list")
+    if len(ops) > MAX_BULK_OPS:
+        raise HTTPException(status_code=400, detail=f"Too many ops. Max {MAX_BULK_OPS}.")
+    return await astore.bulk(ops)
+
+
 @app.get("/api/archives")
 async def archives_list() -> List[Dict[str, Any]]:
-    return store.list_archives()
+    return await astore.list_archives()
 
 
 @app.get("/api/archives/{archive_id}")
-async def archives_get(archive_id: str) -> Dict[str, Any]:
-    item = store.get_archive(archive_id)
+async def archives_get(archive_id: str) -> Any:
+    item = await astore.get_archive(archive_id)
     if not item:
         raise HTTPException(status_code=404, detail="archive not found")
-    return item
+    return await _json_response(item)
 
 
 @app.delete("/api/archives/{archive_id}")
 async def archives_delete(archive_id: str) -> Dict[str, Any]:
-    ok = store.delete_archive(archive_id)
+    ok = await astore.delete_archive(archive_id)
     if not ok:
         raise HTTPException(status_code=404, detail="archive not found")
     return {"ok": True, "deleted": True}
@@ -265,7 +480,7 @@ async def archives_delete(archive_id: str) -> Dict[str, Any]:
 
 @app.get("/api/sessions/{session_id}/export.md")
 async def sessions_export_md(session_id: str) -> Any:
-    md = store.export_markdown(session_id)
+    md = await astore.export_markdown(session_id)
     if md is None:
         raise HTTPException(status_code=404, detail="session not found")
     return PlainTextResponse(md, media_type="text/markdown; charset=utf-8")
@@ -273,10 +488,10 @@ async def sessions_export_md(session_id: str) -> Any:
 
 @app.get("/api/sessions/{session_id}/export.json")
 async def sessions_export_json(session_id: str) -> Any:
-    sess = store.get_session(session_id)
+    sess = await astore.get_session(session_id)
     if not sess or sess.title == "__deleted__":
         raise HTTPException(status_code=404, detail="session not found")
-    return JSONResponse({
+    return await _json_response({
         "id": sess.id,
         "title": sess.title,
         "group": sess.group,
@@ -286,9 +501,64 @@ async def sessions_export_json(session_id: str) -> Any:
     })
 
 
+def _export_chunks(pieces: Iterable[str], gzip: bool) -> Iterator[bytes]:
+    """Group text pieces into ~EXPORT_CHUNK_BYTES chunks, gzip-compressed if asked."""
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+    buf: List[bytes] = []
+    size = 0
+    for piece in pieces:
+        data = piece.encode("utf-8")
+        buf.append(data)
+        size += len(data)
+        if size >= EXPORT_CHUNK_BYTES:
+            out = b"".join(buf)
+            buf, size = [], 0
+            out = gz.compress(out) if gz else out
+            if out:
+                yield out
+    out = b"".join(buf)
+    if gz:
+        out = gz.compress(out) + gz.flush()
+    if out:
+        yield out
+
+
+def _backup_json_pieces() -> Iterator[str]:
+    """The "snlite.sessions.backup.v1" document, one session at a time."""
+    yield json.dumps({"format": "snlite.sessions.backup.v1", "exported_at": time.time()})[:-1]
+    yield ', "sessions": ['
+    count = 0
+    for item in store.iter_sessions():
+        yield ("," if count else "") + json.dumps(item, ensure_ascii=False)
+        count += 1
+    yield f'], "count": {count}}}'
+
+
+def _backup_ndjson_pieces() -> Iterator[str]:
+    """A header line, then one session per line."""
+    yield json.dumps({"format": NDJSON_BACKUP_FORMAT, "exported_at": time.time()}) + "\n"
+    for item in store.iter_sessions():
+        yield json.dumps(item, ensure_ascii=False) + "\n"
+
+
+def _export_response(pieces: Iterable[str], media_type: str, filename: str, gzip: bool) -> StreamingResponse:
+    headers = {"Content-Disposition": f'attachment; filename="{filename}{".gz" if gzip else ""}"'}
+    if gzip:
+        media_type = "application/gzip"
+    # each chunk reads sessions from the store: pull it in the I/O pool, not
+    # in Starlette's own threadpool, so exports share its bound and stats
+    chunks = io_pool.iterate("store.export", _export_chunks(pieces, gzip))
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
+
+
 @app.get("/api/export/sessions.json")
-async def sessions_export_all_json() -> Any:
-    return JSONResponse(store.export_all())
+async def sessions_export_all_json(gzip: bool = False) -> Any:
+    return _export_response(_backup_json_pieces(), "application/json", "snlite_sessions.json", gzip)
+
+
+@app.get("/api/export/sessions.ndjson")
+async def sessions_export_all_ndjson(gzip: bool = False) -> Any:
+    return _export_response(_backup_ndjson_pieces(), "application/x-ndjson", "snlite_sessions.ndjson", gzip)
 
 
 @app.post("/api/sessions/import.json")
@@ -298,18 +568,157 @@ async def sessions_import_json(payload: Dict[str, Any]) -> Any:
     if not isinstance(sessions, list):
         raise HTTPException(status_code=400, detail="sessions must be a list")
     try:
-        stats = store.import_all(sessions, mode=mode)
+        stats = await astore.import_all(sessions, mode=mode)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     return {"ok": True, **stats}
 
 
+def _feed_import_line(importer: Any, line: bytes) -> bool:
+    line = line.strip()
+    if not line:
+        return False
+    try:
+        raw = json.loads(line)
+    except ValueError:
+        importer.skipped += 1
+        return False
+    if isinstance(raw, dict) and raw.get("format") and "messages" not in raw:
+        return False  # header line
+    return importer.add(raw)
+
+
+def _feed_import_lines(importer: Any, lines: List[bytes]) -> bool:
+    full = False
+    for line in lines:
+        full = _feed_import_line(importer, line) or full
+    return full
+
+
+@app.post("/api/sessions/import.ndjson")
+async def sessions_import_ndjson(request: Request, mode: str = "append") -> Any:
+    """
+    Import an NDJSON backup (plain or gzip) from the request body as it
+    arrives; sessions are merged in batches.
+    """
+    try:
+        importer = await astore.importer(mode.strip())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    inflate = None
+    sniffed = request.headers.get("content-encoding", "").lower() == "gzip"
+    if sniffed:
+        inflate = zlib.decompressobj(31)
+    buf = bytearray()
+    async for chunk in request.stream():
+        if not chunk:
+            continue
+        if not sniffed:
+            sniffed = True
+            if chunk[:2] == b"\x1f\x8b":
+                inflate = zlib.decompressobj(31)
+        try:
+            data = inflate.decompress(chunk) if inflate else chunk
+        except zlib.error:
+            raise HTTPException(status_code=400, detail="invalid gzip data")
+        start = len(buf)
+        buf += data
+        end = buf.rfind(b"\n", start)
+        if end < 0:
+            if len(buf) > MAX_IMPORT_LINE_BYTES:
+                raise HTTPException(status_code=413, detail="backup line too large")
+            continue
+        lines = bytes(buf[:end]).split(b"\n")
+        del buf[: end + 1]
+        # parsing a large line can take longer than the loop budget
+        if await io_pool.run("import.parse", _feed_import_lines, importer, lines):
+            await io_pool.run("import.flush", importer.flush)
+    if inflate:
+        buf += inflate.flush()
+    await io_pool.run("import.parse", _feed_import_lines, importer, [bytes(buf)])
+    stats = await io_pool.run("import.finish", importer.finish)
+    return {"ok": True, **stats}
+
+
 @app.post("/api/sessions/compact")
 async def sessions_compact() -> Any:
-    stats = store.compact()
+    stats = await astore.compact()
     return {"ok": True, **stats}
 
 
+@app.get("/api/store/stats")
+async def store_stats() -> Dict[str, Any]:
+    stats = await astore.garbage_stats()
+    return {**stats, "writer": store.write_stats()}
+
+
+def _retention_policy(days: Optional[float], group_max: Optional[str]) -> RetentionPolicy:
+    if days is None and group_max is None:
+        return RETENTION_POLICY
+    try:
+        return RetentionPolicy.parse(
+            RETENTION_DAYS if days is None else str(days),
+            RETENTION_GROUP_MAX if group_max is None else group_max,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"invalid retention policy: {e}")
+
+
+@app.get("/api/retention/plan")
+async def retention_plan(days: Optional[float] = None, group_max: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Dry run: the sessions the retention policy would archive now. `days`
+    and `group_max` preview a different policy than the configured one.
+    """
+    policy = _retention_policy(days, group_max)
+    candidates = await io_pool.run("store.retention_plan", plan_retention, store, policy)
+    return {
+        "policy": policy.to_dict(),
+        "enabled": policy.enabled,
+        "background": RETENTION_POLICY.enabled and RETENTION_INTERVAL_S > 0,
+        "count": len(candidates),
+        "candidates": candidates,
+    }
+
+
+@app.post("/api/retention/run")
+async def retention_run() -> Dict[str, Any]:
+    """Apply the configured retention policy now."""
+    if not RETENTION_POLICY.enabled:
+        raise HTTPException(status_code=400, detail="no retention policy configured")
+    stats = await _run_retention(RETENTION_POLICY)
+    return {"ok": True, **stats}
+
+
+@app.get("/api/runtime/stats")
+async def runtime_stats() -> Dict[str, Any]:
+    """
+    Event loop lag, timings of the work offloaded to the I/O pool, and
+    open streams with the stop-to-idle latency of cancelled ones, and the
+    generation queues.
+    """
+    return {
+        "loop": loop_monitor.stats(),
+        "ops": io_pool.stats(),
+        "streams": {**registry.stream_stats(), "generations": generations.stats()},
+        "scheduler": scheduler.stats(),
+    }
+
+
+@app.get("/api/search")
+async def search(q: str = "", limit: int = 20, kind: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Full-text search over session messages and archives.
+    kind: session | archive (default both).
+    """
+    if kind not in (None, "", "session", "archive"):
+        raise HTTPException(status_code=400, detail="kind must be session or archive")
+    limit = max(1, min(limit, MAX_SEARCH_RESULTS))
+    items = await astore.search_text(q, limit, kind or None)
+    return {"query": q, "items": items}
+
+
 def _clean_title(s: str) -> str:
     s = s.strip()
     s = re.sub(r"\s+", " ", s)
@@ -360,9 +769,29 @@ async def _generate_title_with_model(provider: Any, model_id: str, first_user: s
         return None
 
 
+async def _generate_title_queued(provider: Any, loaded_model: Any, session_id: str, first_user: str) -> Optional[str]:
+    """
+    `_generate_title_with_model` in a "title" slot of the scheduler, behind
+    interactive chats. None when the queue is full or no slot frees up
+    within GEN_TITLE_WAIT_S.
+    """
+    try:
+        ticket = scheduler.enqueue(loaded_model.provider_name, loaded_model.model_id, "title", session_id)
+    except QueueFull:
+        return None
+    try:
+        if not await asyncio.wait_for(ticket.wait(), GEN_TITLE_WAIT_S):
+            return None
+        return await _generate_title_with_model(provider, loaded_model.model_id, first_user)
+    except asyncio.TimeoutError:
+        return None
+    finally:
+        ticket.release()
+
+
 @app.post("/api/sessions/{session_id}/auto_title")
 async def sessions_auto_title(session_id: str) -> Dict[str, Any]:
-    sess = store.get_session(session_id)
+    sess = await astore.get_session(session_id)
     if not sess or sess.title == "__deleted__":
         raise HTTPException(status_code=404, detail="session not found")
 
@@ -383,19 +812,50 @@ async def sessions_auto_title(session_id: str) -> Dict[str, Any]:
 
     title: Optional[str] = None
     if loaded_state.get("loaded") and provider and loaded_model:
-        title = await _generate_title_with_model(provider, loaded_model.model_id, first_user)
+        title = await _generate_title_queued(provider, loaded_model, session_id, first_user)
 
     if not title:
         title = _fallback_title_from_first_user(first_user)
 
     title = _clean_title(title)
-    sess2 = store.rename_session(session_id, title=title)
+    sess2 = await astore.rename_session(session_id, title=title)
     if not sess2:
         raise HTTPException(status_code=500, detail="failed to rename")
 
     return {"ok": True, "skipped": False, "title": sess2.title, "updated_at": sess2.updated_at}
 
 
+def _queue_full_error(provider_name: str, model_id: str) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="Too many generations queued for this model. Try again later.",
+        headers={"Retry-After": str(scheduler.retry_after_s(provider_name, model_id))},
+    )
+
+
+async def _reserve_generation(session_id: str, priority: str) -> Ticket:
+    """
+    Queue a chat request with the scheduler before it changes its session,
+    so a full queue (429) or a missing model (400) leaves the session as it
+    was. Until `_stream_chat_common` hands the ticket to the generation,
+    the caller must release it on any error.
+    """
+    loaded_model = await registry.get_loaded_model()
+    if not loaded_model:
+        raise HTTPException(status_code=400, detail="No model loaded. Load a model first.")
+    try:
+        return scheduler.enqueue(loaded_model.provider_name, loaded_model.model_id, priority, session_id)
+    except QueueFull:
+        raise _queue_full_error(loaded_model.provider_name, loaded_model.model_id)
+
+
+def _chat_priority(payload: Dict[str, Any]) -> str:
+    priority = str(payload.get("priority") or "interactive").strip()
+    if priority not in ("interactive", "batch"):
+        raise HTTPException(status_code=400, detail="priority must be interactive or batch")
+    return priority
+
+
 @app.post("/api/chat/stop")
 async def chat_stop(payload: Dict[str, Any]) -> Dict[str, Any]:
     request_id = payload.get("request_id")
@@ -452,128 +912,13 @@ def _resolve_think_value(model_id: str, think_mode: str) -> Optional[Union[bool,
     return None
 
 
-def _safe_b64_to_bytes(b64: str) -> bytes:
-    try:
-        return base64.b64decode(b64, validate=False)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Invalid base64 file data: {e}")
-
-
-def _extract_text_pdf(data: bytes) -> str:
-    bio = BytesIO(data)
-    reader = PdfReader(bio)
-    out_parts = []
-    for page in reader.pages[:20]:
-        try:
-            t = page.extract_text() or ""
-        except Exception:
-            t = ""
-        if t.strip():
-            out_parts.append(t)
-        if sum(len(x) for x in out_parts) > MAX_EXTRACT_CHARS_PER_FILE:
-            break
-    return "\n\n".join(out_parts).strip()
-
-
-def _extract_text_docx(data: bytes) -> str:
-    doc = Document(BytesIO(data))
-    parts = []
-    for p in doc.paragraphs:
-        if p.text:
-            parts.append(p.text)
-        if sum(len(x) for x in parts) > MAX_EXTRACT_CHARS_PER_FILE:
-            break
-    return "\n".join(parts).strip()
-
-
-def _extract_text_plain(data: bytes) -> str:
-    try:
-        return data.decode("utf-8", errors="ignore").strip()
-    except Exception:
-        return data.decode("latin-1", errors="ignore").strip()
-
-
-def _snip(s: str, n: int) -> str:
-    s = (s or "").strip()
-    if len(s) <= n:
-        return s
-    return s[:n].rstrip() + "…"
-
-
-def _parse_files(files: List[Dict[str, Any]]) -> Tuple[str, List[str], Dict[str, Any]]:
+async def _parse_files(files: List[Dict[str, Any]]) -> Any:
     if not files:
         return "", [], {"files": [], "total_chars": 0, "truncated": False}
-
-    if len(files) > MAX_FILES:
-        raise HTTPException(status_code=400, detail=f"Too many files. Max {MAX_FILES}.")
-
-    total_chars = 0
-    injected_blocks: List[str] = []
-    markers: List[str] = []
-    file_stats: List[Dict[str, Any]] = []
-    total_truncated = False
-
-    for f in files:
-        name = (f.get("name") or "file").strip()
-        mime = (f.get("mime") or "").strip().lower()
-        b64 = f.get("b64")
-        if not isinstance(b64, str) or not b64:
-            raise HTTPException(status_code=400, detail=f"File {name} missing b64")
-
-        data = _safe_b64_to_bytes(b64)
-        if len(data) > MAX_FILE_BYTES:
-            raise HTTPException(status_code=400, detail=f"File too large: {name} (max {MAX_FILE_BYTES//1024//1024}MB)")
-
-        ext = os.path.splitext(name)[1].lower()
-
-        text = ""
-        try:
-            if ext == ".pdf" or mime == "application/pdf":
-                text = _extract_text_pdf(data)
-            elif ext == ".docx" or mime in ("application/vnd.openxmlformats-officedocument.wordprocessingml.document",):
-                text = _extract_text_docx(data)
-            elif ext in (".txt", ".md") or mime.startswith("text/"):
-                text = _extract_text_plain(data)
-            else:
-                text = _extract_text_plain(data)
-        except HTTPException:
-            raise
-        except Exception as e:
-            injected_blocks.append(f"> [File: {name}] (parse failed: {e})")
-            markers.append(f"[File] {name} (parse failed)")
-            file_stats.append({"name": name, "status": "parse_failed", "chars": 0, "truncated": False})
-            continue
-
-        text = (text or "").strip()
-        if not text:
-            injected_blocks.append(f"> [File: {name}] (no extractable text)")
-            markers.append(f"[File] {name} (empty)")
-            file_stats.append({"name": name, "status": "empty", "chars": 0, "truncated": False})
-            continue
-
-        raw_len = len(text)
-        text = _snip(text, MAX_EXTRACT_CHARS_PER_FILE)
-        file_truncated = len(text) < raw_len
-        if total_chars + len(text) > MAX_TOTAL_EXTRACT_CHARS:
-            remain = max(0, MAX_TOTAL_EXTRACT_CHARS - total_chars)
-            text = _snip(text, remain) if remain > 0 else ""
-            file_truncated = True
-        total_chars += len(text)
-        total_truncated = total_truncated or file_truncated
-
-        injected_blocks.append(f"> [File: {name}]\n> " + "\n> ".join(text.splitlines()))
-        trunc_mark = " (truncated)" if file_truncated else ""
-        one_line = _snip(text.replace("\n", " "), 120)
-        markers.append(f"[File] {name}: {one_line} [injected {len(text)} chars{trunc_mark}]")
-        file_stats.append({"name": name, "status": "ok", "chars": len(text), "truncated": file_truncated})
-
-        if total_chars >= MAX_TOTAL_EXTRACT_CHARS:
-            injected_blocks.append("> [Note] File excerpts truncated due to total limit.")
-            total_truncated = True
-            break
-
-    injected_text = "\n\n".join(injected_blocks).strip() if injected_blocks else ""
-    return injected_text, markers, {"files": file_stats, "total_chars": total_chars, "truncated": total_truncated}
+    try:
+        return await io_pool.run_cpu("files.parse", parse_files, files)
+    except FileRejected as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 def _make_model_user_text(user_text: str, injected_text: str, has_images: bool) -> str:
@@ -594,7 +939,7 @@ async def files_inspect(payload: Dict[str, Any]) -> Any:
     files = payload.get("files") or []
     if files and not isinstance(files, list):
         raise HTTPException(status_code=400, detail="files must be a list")
-    _, markers, meta = _parse_files(files)
+    _, markers, meta = await _parse_files(files)
     return {"ok": True, "markers": markers, "meta": meta}
 
 
@@ -609,7 +954,9 @@ async def _stream_chat_common(
     think_mode: str,
     show_trace: bool,
     request_id: str,
+    ticket: Ticket,
     request_meta: Optional[Dict[str, Any]] = None,
+    coalesce: bool = True,
 ):
     loaded_state = await registry.get_state()
     provider = await registry.get_provider()
@@ -618,17 +965,9 @@ async def _stream_chat_common(
     if not loaded_state.get("loaded") or not provider or not loaded_model:
         raise HTTPException(status_code=400, detail="No model loaded. Load a model first.")
 
-    cancel_flag = {"v": False}
-
-    async def poll_cancel() -> None:
-        while True:
-            cancel_flag["v"] = await registry.is_cancelled(request_id)
-            if cancel_flag["v"]:
-                return
-            await asyncio.sleep(0.05)
-
-    def cancelled() -> bool:
-        return cancel_flag["v"]
+    token = await registry.stream_token(request_id)
+    if token is None:
+        raise HTTPException(status_code=409, detail="stream was already closed")
 
     think_value = _resolve_think_value(loaded_model.model_id, think_mode)
     stream_params = dict(params)
@@ -637,82 +976,199 @@ async def _stream_chat_common(
 
     messages = _build_messages(system_text=system_text, history=history, user_text=model_user_text, images_b64=images_b64)
 
-    async def event_gen():
-        assistant_accum = ""
-        poll_task = asyncio.create_task(poll_cancel())
+    async def generate(gen: Generation) -> None:
+        answer_parts = gen.content_parts
+        output_chars = 0
         saw_thinking = False
         saw_content = False
         stream_error: Optional[str] = None
         finish_reason = "interrupted"
         elapsed_ms = 0
+        pump_task: Optional[asyncio.Task] = None
+        started_at = asyncio.get_event_loop().time()
 
         try:
-            yield f"event: meta\ndata: {json.dumps({'request_id': request_id}, ensure_ascii=False)}\n\n"
-            if request_meta:
-                yield f"event: request_meta\ndata: {json.dumps(request_meta, ensure_ascii=False)}\n\n"
-            yield f"event: status\ndata: {json.dumps({'stage': 'answering'}, ensure_ascii=False)}\n\n"
-            started_at = asyncio.get_event_loop().time()
-
-            async for chunk in provider.stream_chat(
-                model_id=loaded_model.model_id,
-                messages=messages,
-                params=stream_params,
-                cancelled=cancelled,
-            ):
-                if cancelled():
-                    break
-
-                thinking = (chunk.get("thinking") or "")
-                content = (chunk.get("content") or "")
-
-                if thinking:
-                    if not saw_thinking:
-                        saw_thinking = True
-                        yield f"event: status\ndata: {json.dumps({'stage': 'thinking'}, ensure_ascii=False)}\n\n"
-                    if show_trace:
-                        yield f"event: thinking\ndata: {json.dumps({'token': thinking}, ensure_ascii=False)}\n\n"
-
-                if content:
-                    if not saw_content:
-                        saw_content = True
-                        yield f"event: status\ndata: {json.dumps({'stage': 'answering'}, ensure_ascii=False)}\n\n"
-                    assistant_accum += content
-                    yield f"event: content\ndata: {json.dumps({'token': content}, ensure_ascii=False)}\n\n"
-
-            elapsed_ms = int((asyncio.get_event_loop().time() - started_at) * 1000)
-            if cancelled():
-                finish_reason = "cancelled"
-            elif saw_content:
-                finish_reason = "completed"
-            else:
-                finish_reason = "interrupted"
-
-        except Exception as e:
-            stream_error = str(e)
-            finish_reason = "failed"
-            elapsed_ms = int((asyncio.get_event_loop().time() - started_at) * 1000) if 'started_at' in locals() else 0
-            yield f"event: error\ndata: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+            try:
+                gen.publish([sse_event("meta", {"request_id": request_id})])
+                if request_meta:
+                    gen.publish([sse_event("request_meta", request_meta)])
+
+                if not ticket.running:
+                    def queued(position: int, eta_s: float) -> None:
+                        gen.publish([sse_event("status", {"stage": "queued", "position": position, "eta_ms": int(eta_s * 1000)})])
+
+                    gen.stage = "queued"
+                    ticket.on_position = queued
+                    queued(ticket.position, ticket.eta_s())
+                    if not await ticket.wait():
+                        registry.record_cancelled(token)
+                        finish_reason = "cancelled"
+                        return
+                    ticket.on_position = None
+                    gen.stage = "answering"
+                gen.publish([STATUS_ANSWERING_EVENT])
+
+                # The provider is iterated by its own task, so a stop request
+                # or an abandoned stream can cancel it while it waits for
+                # upstream.
+                chunks: asyncio.Queue = asyncio.Queue()
+                stream = provider.stream_chat(
+                    model_id=loaded_model.model_id,
+                    messages=messages,
+                    params=stream_params,
+                    cancelled=token,
+                )
+
+                async def pump() -> None:
+                    try:
+                        async for chunk in stream:
+                            chunks.put_nowait(chunk)
+                    except asyncio.CancelledError:
+                        await provider.cancel(stream)
+                    except Exception as e:
+                        chunks.put_nowait(e)
+
+                def pump_done(_: asyncio.Task) -> None:
+                    chunks.put_nowait(None)
+                    registry.record_cancelled(token)
+
+                pump_task = asyncio.create_task(pump())
+                pump_task.add_done_callback(pump_done)
+                token.add_callback(lambda _: pump_task.cancel())
+
+                if coalesce:
+                    gen.coalescer = Coalescer(SSE_COALESCE_MS / 1000, SSE_COALESCE_BYTES)
+                coalescer = gen.coalescer
+                while not token():
+                    batch = await coalescer.next_batch(chunks) if coalescer else [await chunks.get()]
+                    frames: List[str] = []
+                    thinking_run: List[str] = []
+                    content_run: List[str] = []
+                    end: Any = False  # None: stream over, Exception: it failed
+                    for chunk in batch:
+                        if not isinstance(chunk, dict):
+                            end = chunk
+                            break
+                        thinking = (chunk.get("thinking") or "")
+                        content = (chunk.get("content") or "")
+
+                        if thinking:
+                            if content_run:
+                                frames.append(token_event("content", "".join(content_run)))
+                                content_run = []
+                            if not saw_thinking:
+                                saw_thinking = True
+                                gen.stage = "thinking"
+                                frames.append(STATUS_THINKING_EVENT)
+                            if show_trace:
+                                thinking_run.append(thinking)
+                                gen.thinking_parts.append(thinking)
+
+                        if content:
+                            if thinking_run:
+                                frames.append(token_event("thinking", "".join(thinking_run)))
+                                thinking_run = []
+                            if not saw_content:
+                                saw_content = True
+                                gen.stage = "answering"
+                                frames.append(STATUS_ANSWERING_EVENT)
+                            content_run.append(content)
+                            answer_parts.append(content)
+                            output_chars += len(content)
+
+                    if thinking_run:
+                        frames.append(token_event("thinking", "".join(thinking_run)))
+                    if content_run:
+                        frames.append(token_event("content", "".join(content_run)))
+                    if frames:
+                        gen.publish(frames)
+                    if end is None:
+                        break
+                    if isinstance(end, Exception):
+                        raise end
+
+                elapsed_ms = int((asyncio.get_event_loop().time() - started_at) * 1000)
+                if token():
+                    finish_reason = "cancelled"
+                elif saw_content:
+                    finish_reason = "completed"
+                else:
+                    finish_reason = "interrupted"
+
+            except Exception as e:
+                stream_error = str(e)
+                finish_reason = "failed"
+                elapsed_ms = int((asyncio.get_event_loop().time() - started_at) * 1000)
+                gen.publish([sse_event("error", {"error": str(e)})])
         finally:
-            yield f"event: done\ndata: {json.dumps({'done': True, 'cancelled': cancelled(), 'finish_reason': finish_reason, 'elapsed_ms': elapsed_ms, 'output_chars': len(assistant_accum), 'error': stream_error}, ensure_ascii=False)}\n\n"
-            poll_task.cancel()
-
-            if assistant_accum.strip():
-                sess2 = store.get_session(session_id)
-                if sess2 and sess2.title != "__deleted__":
-                    sess2.messages.append({
-                        "role": "assistant",
-                        "content": assistant_accum,
-                        "meta": {
-                            "finish_reason": finish_reason,
-                            "elapsed_ms": elapsed_ms,
-                            "output_chars": len(assistant_accum),
-                        }
-                    })
-                    store.save_session(sess2)
-
+            try:
+                if pump_task is not None:
+                    if not pump_task.done():
+                        pump_task.cancel()
+                    # the upstream request is closed before its slot goes
+                    # to the next generation
+                    await asyncio.wait([pump_task])
+            finally:
+                ticket.release()
+
+            # saved before "done", so a client reloading the session on it
+            # sees the answer
+            assistant_accum = "".join(answer_parts)
+            try:
+                if assistant_accum.strip():
+                    sess2 = await astore.get_session(session_id)
+                    if sess2 and sess2.title != "__deleted__":
+                        sess2.messages.append({
+                            "role": "assistant",
+                            "content": assistant_accum,
+                            "meta": {
+                                "finish_reason": finish_reason,
+                                "elapsed_ms": elapsed_ms,
+                                "output_chars": len(assistant_accum),
+                            }
+                        })
+                        await astore.save_session(sess2)
+            except Exception:
+                logger.exception("saving the answer of %s failed", request_id)
             await registry.pop_stream(request_id)
-
-    return StreamingResponse(event_gen(), media_type="text/event-stream")
+            gen.publish([sse_event("done", {
+                "done": True,
+                "cancelled": token(),
+                "finish_reason": finish_reason,
+                "elapsed_ms": elapsed_ms,
+                "output_chars": output_chars,
+                "error": stream_error,
+            })])
+
+    # dequeues a waiting request; a running one keeps its slot until the
+    # finally of generate() has stopped the provider call
+    token.add_callback(lambda _: ticket.cancel())
+
+    gen = generations.start(request_id, session_id, token, generate)
+    return StreamingResponse(gen.follow(), media_type="text/event-stream")
+
+
+@app.get("/api/chat/streams")
+async def chat_streams(session_id: Optional[str] = None, include_finished: bool = False) -> Dict[str, Any]:
+    """Generations in flight (of one session), to attach to with the endpoint below."""
+    return {"items": generations.list(session_id, include_finished)}
+
+
+@app.get("/api/chat/stream/{request_id}")
+async def chat_stream_resume(request_id: str, request: Request, last_event_id: Optional[int] = None) -> Any:
+    """
+    Attach to a running (or just finished) generation, as another viewer
+    or to resume a dropped stream: replays the events after
+    `Last-Event-ID` (header, or `last_event_id` query; none = from the
+    start), then continues live.
+    """
+    gen = generations.get(request_id)
+    if not gen:
+        raise HTTPException(status_code=404, detail="stream not found")
+    if last_event_id is None:
+        header = request.headers.get("last-event-id", "").strip()
+        last_event_id = int(header) if header.isdigit() else 0
+    return StreamingResponse(gen.follow(max(0, last_event_id)), media_type="text/event-stream")
 
 
 @app.post("/api/chat/stream")
@@ -738,57 +1194,67 @@ async def chat_stream(payload: Dict[str, Any]) -> Any:
     if not session_id:
         raise HTTPException(status_code=400, detail="session_id is required")
 
-    sess = store.get_session(session_id)
+    sess = await astore.get_session(session_id)
     if not sess or sess.title == "__deleted__":
         raise HTTPException(status_code=404, detail="session not found")
 
     if not user_text and not images_b64 and not files:
         raise HTTPException(status_code=400, detail="user_text or images/files is required")
 
-    request_id = await registry.new_stream()
-
-    injected_text, file_markers, file_meta = _parse_files(files)
-    model_user_text = _make_model_user_text(user_text, injected_text, has_images=bool(images_b64))
-
-    # Persist user message (NO raw image b64, but DO store prompt text for regen)
-    persisted_lines: List[str] = []
-    if images_b64:
-        marker = f"[Image] {image_name}".strip() if image_name else "[Image]"
-        persisted_lines.append(marker)
-    for mk in file_markers:
-        persisted_lines.append(mk)
-    if user_text:
-        persisted_lines.append(user_text)
-
-    sess.messages.append({
-        "role": "user",
-        "content": "\n".join(persisted_lines).strip(),
-        "meta": {
-            "prompt": model_user_text,
-            "system_text": system_text,
-            "params": params,
-            "think_mode": think_mode,
-            "has_images": bool(images_b64),
-            "file_extract": file_meta,
-        }
-    })
-    store.save_session(sess)
-
-    # history excludes the persisted user message; model receives model_user_text (+ images)
-    history = [{"role": m["role"], "content": m["content"]} for m in sess.messages[:-1] if "role" in m and "content" in m]
-
-    return await _stream_chat_common(
-        session_id=session_id,
-        history=history,
-        system_text=system_text,
-        model_user_text=model_user_text,
-        images_b64=images_b64,
-        params=params,
-        think_mode=think_mode,
-        show_trace=show_trace,
-        request_id=request_id,
-        request_meta={"file_extract": file_meta},
-    )
+    priority = _chat_priority(payload)
+    ticket = await _reserve_generation(session_id, priority)
+    try:
+        request_id = await registry.new_stream()
+
+        injected_text, file_markers, file_meta = await _parse_files(files)
+        model_user_text = _make_model_user_text(user_text, injected_text, has_images=bool(images_b64))
+
+        # Persist user message (NO raw image b64, but DO store prompt text for regen).
+        # File excerpts are kept apart from the user text so the store can share
+        # one copy of a document attached turn after turn.
+        persisted_lines: List[str] = []
+        if images_b64:
+            marker = f"[Image] {image_name}".strip() if image_name else "[Image]"
+            persisted_lines.append(marker)
+        for mk in file_markers:
+            persisted_lines.append(mk)
+        if user_text:
+            persisted_lines.append(user_text)
+
+        sess.messages.append({
+            "role": "user",
+            "content": "\n".join(persisted_lines).strip(),
+            "meta": {
+                **({"user_text": user_text, "file_excerpts": injected_text} if injected_text else {"prompt": model_user_text}),
+                "system_text": system_text,
+                "params": params,
+                "think_mode": think_mode,
+                "has_images": bool(images_b64),
+                "file_extract": file_meta,
+            }
+        })
+        await astore.save_session(sess)
+
+        # history excludes the persisted user message; model receives model_user_text (+ images)
+        history = [{"role": m["role"], "content": m["content"]} for m in sess.messages[:-1] if "role" in m and "content" in m]
+
+        return await _stream_chat_common(
+            session_id=session_id,
+            history=history,
+            system_text=system_text,
+            model_user_text=model_user_text,
+            images_b64=images_b64,
+            params=params,
+            think_mode=think_mode,
+            show_trace=show_trace,
+            request_id=request_id,
+            ticket=ticket,
+            request_meta={"file_extract": file_meta},
+            coalesce=bool(payload.get("coalesce", True)),
+        )
+    except BaseException:
+        ticket.release()
+        raise
 
 
 @app.post("/api/chat/regenerate/stream")
@@ -803,7 +1269,7 @@ async def chat_regenerate_stream(payload: Dict[str, Any]) -> Any:
     if not session_id:
         raise HTTPException(status_code=400, detail="session_id is required")
 
-    sess = store.get_session(session_id)
+    sess = await astore.get_session(session_id)
     if not sess or sess.title == "__deleted__":
         raise HTTPException(status_code=404, detail="session not found")
 
@@ -825,7 +1291,10 @@ async def chat_regenerate_stream(payload: Dict[str, Any]) -> Any:
     if meta.get("has_images"):
         raise HTTPException(status_code=400, detail="Regenerate is not supported for image messages (image binary is not stored).")
 
-    model_user_text = (meta.get("prompt") or user_msg.get("content") or "").strip()
+    if meta.get("file_excerpts"):
+        model_user_text = _make_model_user_text(meta.get("user_text") or "", meta["file_excerpts"], has_images=False)
+    else:
+        model_user_text = (meta.get("prompt") or user_msg.get("content") or "").strip()
     system_text = (meta.get("system_text") or "").strip()
     params = meta.get("params") or {}
     think_mode = meta.get("think_mode") or "auto"
@@ -833,30 +1302,39 @@ async def chat_regenerate_stream(payload: Dict[str, Any]) -> Any:
     if not model_user_text:
         raise HTTPException(status_code=400, detail="Cannot regenerate: missing prompt")
 
-    # Remove last assistant message
-    sess.messages.pop(last_idx)
-    store.save_session(sess)
+    priority = _chat_priority(payload)
+    # before the old answer is dropped: a rejected retry keeps it
+    ticket = await _reserve_generation(session_id, priority)
+    try:
+        # Remove last assistant message
+        sess.messages.pop(last_idx)
+        await astore.save_session(sess)
 
-    # history mode
-    if retry_mode == "clean_context":
-        history = []
-    else:
-        history = [{"role": m["role"], "content": m["content"]} for m in sess.messages[:prev_idx] if "role" in m and "content" in m]
-
-    request_id = await registry.new_stream()
-
-    return await _stream_chat_common(
-        session_id=session_id,
-        history=history,
-        system_text=system_text,
-        model_user_text=model_user_text,
-        images_b64=[],
-        params=params,
-        think_mode=str(think_mode),
-        show_trace=show_trace,
-        request_id=request_id,
-        request_meta={"regenerate": True, "retry_mode": retry_mode},
-    )
+        # history mode
+        if retry_mode == "clean_context":
+            history = []
+        else:
+            history = [{"role": m["role"], "content": m["content"]} for m in sess.messages[:prev_idx] if "role" in m and "content" in m]
+
+        request_id = await registry.new_stream()
+
+        return await _stream_chat_common(
+            session_id=session_id,
+            history=history,
+            system_text=system_text,
+            model_user_text=model_user_text,
+            images_b64=[],
+            params=params,
+            think_mode=str(think_mode),
+            show_trace=show_trace,
+            request_id=request_id,
+            ticket=ticket,
+            request_meta={"regenerate": True, "retry_mode": retry_mode},
+            coalesce=bool(payload.get("coalesce", True)),
+        )
+    except BaseException:
+        ticket.release()
+        raise
 
 
 def run() -> None:
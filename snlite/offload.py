@@ -0,0 +1,229 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def _timed_call(fn: Callable[..., T], args: Tuple[Any, ...]) -> Tuple[T, float]:
+    """Run `fn` in a worker and report how long it took there (picklable)."""
+    started = time.perf_counter()
+    return fn(*args), time.perf_counter() - started
+
+
+class _OpStats:
+    __slots__ = ("calls", "errors", "run_s", "max_run_s", "wait_s", "max_wait_s")
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.run_s = 0.0
+        self.max_run_s = 0.0
+        self.wait_s = 0.0
+        self.max_wait_s = 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        n = max(1, self.calls)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "avg_ms": round(self.run_s / n * 1000, 3),
+            "max_ms": round(self.max_run_s * 1000, 3),
+            "avg_wait_ms": round(self.wait_s / n * 1000, 3),
+            "max_wait_ms": round(self.max_wait_s * 1000, 3),
+        }
+
+
+def _close_quietly(close: Callable[[], Any]) -> None:
+    try:
+        close()
+    except ValueError:
+        # still running in another worker (its pull was cancelled); it is
+        # closed when collected instead
+        pass
+    except Exception:
+        logger.exception("closing an abandoned iterator failed")
+
+
+class BlockingPool:
+    """
+    Bounded executors for work that must not run on the event loop:
+    - a thread pool (`threads` workers) for blocking I/O such as store calls
+    - an optional process pool (`processes` workers, 0 = use the thread
+      pool) for CPU-bound, GIL-holding work such as PDF/DOCX parsing
+
+    Every call is recorded under an operation name: how long it ran in the
+    worker and how long it waited for a free one.
+    """
+    def __init__(self, threads: int = 8, processes: int = 0) -> None:
+        self._threads = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix="snlite-io")
+        self._process_workers = max(0, processes)
+        self._processes: Optional[Executor] = None
+        self._stats: Dict[str, _OpStats] = {}
+        self._stats_lock = threading.Lock()
+
+    def _record(self, op: str, wait_s: float, run_s: float, failed: bool) -> None:
+        with self._stats_lock:
+            st = self._stats.get(op)
+            if st is None:
+                st = self._stats[op] = _OpStats()
+            st.calls += 1
+            st.errors += int(failed)
+            st.run_s += run_s
+            st.wait_s += wait_s
+            st.max_run_s = max(st.max_run_s, run_s)
+            st.max_wait_s = max(st.max_wait_s, wait_s)
+
+    async def run(self, op: str, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run `fn(*args, **kwargs)` in the thread pool."""
+        submitted = time.perf_counter()
+
+        def job() -> T:
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = fn(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                self._record(op, started - submitted, time.perf_counter() - started, failed)
+
+        return await asyncio.get_running_loop().run_in_executor(self._threads, job)
+
+    async def iterate(self, op: str, items: Iterator[T]) -> AsyncIterator[T]:
+        """
+        Yield from a blocking iterator, pulling every item in the thread
+        pool (each pull is recorded as `op`). An iterator the consumer
+        abandons is closed in the pool too.
+        """
+        done: Any = object()
+        exhausted = False
+        try:
+            while True:
+                item = await self.run(op, next, items, done)
+                if item is done:
+                    exhausted = True
+                    return
+                yield item
+        finally:
+            close = getattr(items, "close", None)
+            if not exhausted and close is not None:
+                self._threads.submit(_close_quietly, close)
+
+    def _process_pool(self) -> Optional[Executor]:
+        if not self._process_workers:
+            return None
+        if self._processes is None:
+            # spawn: forking a process that runs threads (store writer, I/O pool) is unsafe
+            ctx = multiprocessing.get_context("spawn")
+            self._processes = ProcessPoolExecutor(max_workers=self._process_workers, mp_context=ctx)
+        return self._processes
+
+    async def run_cpu(self, op: str, fn: Callable[..., T], *args: Any) -> T:
+        """
+        Run `fn(*args)` in the process pool (falls back to the thread pool
+        when there is none). `fn` and its arguments must be picklable.
+        """
+        pool = self._process_pool()
+        if pool is None:
+            return await self.run(op, fn, *args)
+        submitted = time.perf_counter()
+        try:
+            result, run_s = await asyncio.get_running_loop().run_in_executor(pool, _timed_call, fn, args)
+        except BrokenProcessPool:
+            logger.exception("worker process pool broke; running %s in a thread", op)
+            self._processes = None
+            self._process_workers = 0
+            return await self.run(op, fn, *args)
+        except Exception:
+            self._record(op, 0.0, time.perf_counter() - submitted, True)
+            raise
+        self._record(op, max(0.0, time.perf_counter() - submitted - run_s), run_s, False)
+        return result
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._stats_lock:
+            return {op: st.snapshot() for op, st in sorted(self._stats.items())}
+
+    def shutdown(self) -> None:
+        self._threads.shutdown(wait=False, cancel_futures=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=False, cancel_futures=True)
+            self._processes = None
+
+
+class AsyncStore:
+    """
+    Awaitable view of a session store: `await astore.get_session(sid)` runs
+    `store.get_session(sid)` in the pool, timed as "store.get_session".
+    """
+    def __init__(self, store: Any, pool: BlockingPool) -> None:
+        self._store = store
+        self._pool = pool
+
+    def __getattr__(self, name: str) -> Callable[..., Any]:
+        method = getattr(self._store, name)
+        if not callable(method):
+            raise AttributeError(name)
+        op = "store." + name
+
+        async def call(*args: Any, **kwargs: Any) -> Any:
+            return await self._pool.run(op, method, *args, **kwargs)
+
+        call.__name__ = name
+        setattr(self, name, call)
+        return call
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes a periodic timer. Lag beyond
+    `budget_ms` means some callback held the loop that long; each such
+    violation is counted and logged. With `debug`, asyncio debug mode is
+    turned on so the offending callback itself is logged too.
+    """
+    def __init__(self, budget_ms: float = 100.0, interval_ms: float = 50.0, debug: bool = False) -> None:
+        self.budget_s = max(0.001, budget_ms / 1000)
+        self.interval_s = max(0.001, interval_ms / 1000)
+        self.debug = debug
+        self.samples = 0
+        self.violations = 0
+        self.max_lag_s = 0.0
+        self.last_violation: Optional[Dict[str, float]] = None
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self.debug:
+            loop.set_debug(True)
+            loop.slow_callback_duration = self.budget_s
+        while True:
+            expected = loop.time() + self.interval_s
+            await asyncio.sleep(self.interval_s)
+            lag = max(0.0, loop.time() - expected)
+            self.samples += 1
+            self.max_lag_s = max(self.max_lag_s, lag)
+            if lag > self.budget_s:
+                self.violations += 1
+                self.last_violation = {"at": time.time(), "lag_ms": round(lag * 1000, 1)}
+                logger.warning(
+                    "event loop was blocked for %.0f ms (budget %.0f ms)",
+                    lag * 1000, self.budget_s * 1000,
+                )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "budget_ms": round(self.budget_s * 1000, 1),
+            "samples": self.samples,
+            "violations": self.violations,
+            "max_lag_ms": round(self.max_lag_s * 1000, 1),
+            "last_violation": self.last_violation,
+        }
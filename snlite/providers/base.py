@@ -49,3 +49,15 @@ class Provider(ABC):
         cancelled(): bool -> return True if should cancel
         """
         ...
+
+    async def cancel(self, stream: AsyncIterator[Dict[str, str]]) -> None:
+        """
+        Called once a stream_chat() generation was cancelled. By then the
+        task iterating `stream` has been cancelled, which already unwinds an
+        `async with` around the upstream request; the default closes the
+        generator. Override to also stop work the backend keeps doing after
+        its client went away.
+        """
+        aclose = getattr(stream, "aclose", None)
+        if aclose is not None:
+            await aclose()
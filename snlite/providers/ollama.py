@@ -116,6 +116,10 @@ class OllamaProvider(Provider):
 
         url = f"{self.base_url}/api/chat"
 
+        # Cancelling the task that iterates this generator raises inside
+        # aiter_lines(); leaving the `async with` then closes the unread
+        # response and its connection, and Ollama stops generating when its
+        # client hangs up.
         async with self._client.stream("POST", url, json=payload) as resp:
             resp.raise_for_status()
 
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import struct
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from snlite.blobs import BlobStore
+from snlite.store_base import Session, intern_roles
+
+try:
+    import msgpack
+except ImportError:  # optional: pip install "snliteyao[msgpack]"
+    msgpack = None
+
+
+# A session is stored as its latest full snapshot followed by at most this many
+# delta records; the next save after that writes a fresh snapshot (checkpoint).
+CHECKPOINT_EVERY = 32
+
+# json: one JSON object per line. msgpack: a framed binary record -
+# FRAME_MAGIC, schema version, payload length (little-endian u32), msgpack
+# payload, "\n". JSON never contains a raw 0x1e byte, so both kinds can be
+# mixed in one log and are told apart by their first byte.
+RECORD_FORMATS = ("json", "msgpack")
+FRAME_MAGIC = b"\x1e"
+FRAME_VERSION = 1
+_FRAME_HEAD = struct.Struct("<cBI")
+
+
+def fingerprint(message: Dict[str, Any]) -> str:
+    data = json.dumps(message, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+def check_record_format(record_format: str) -> str:
+    if record_format not in RECORD_FORMATS:
+        raise ValueError(f"unknown record format: {record_format} (expected one of {', '.join(RECORD_FORMATS)})")
+    if record_format == "msgpack" and msgpack is None:
+        raise ValueError('record format msgpack needs the msgpack package (pip install "snliteyao[msgpack]")')
+    return record_format
+
+
+def encode_record(obj: Dict[str, Any], record_format: str = "json") -> bytes:
+    if record_format == "msgpack":
+        payload = msgpack.packb(obj, use_bin_type=True)
+        return _FRAME_HEAD.pack(FRAME_MAGIC, FRAME_VERSION, len(payload)) + payload + b"\n"
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def decode_record(data: bytes) -> Dict[str, Any]:
+    """Decode one record of either format; raises ValueError if it is damaged."""
+    if data[:1] != FRAME_MAGIC:
+        return json.loads(data)
+    if msgpack is None:
+        raise ValueError("msgpack record found but the msgpack package is not installed")
+    _, version, length = _FRAME_HEAD.unpack_from(data)
+    if version != FRAME_VERSION:
+        raise ValueError(f"unsupported record schema version {version}")
+    start = _FRAME_HEAD.size
+    return msgpack.unpackb(data[start:start + length])
+
+
+def split_records(data: bytes) -> Tuple[List[bytes], int]:
+    """
+    Cut `data` into complete records (JSON lines or frames); returns them
+    with the number of bytes they cover. An incomplete trailing record is
+    left for later. A frame whose terminator is missing (torn write) is cut
+    at the next newline like a damaged JSON line, so decoding it fails.
+    """
+    if FRAME_MAGIC not in data:
+        end = data.rfind(b"\n") + 1
+        return data[:end].splitlines(keepends=True), end
+    out: List[bytes] = []
+    pos = 0
+    n = len(data)
+    while pos < n:
+        end = -1
+        if data[pos:pos + 1] == FRAME_MAGIC:
+            if pos + _FRAME_HEAD.size > n:
+                break
+            end = pos + _FRAME_HEAD.size + _FRAME_HEAD.unpack_from(data, pos)[2] + 1
+            if end > n:
+                break
+            if data[end - 1:end] != b"\n":
+                end = -1
+        if end < 0:
+            nl = data.find(b"\n", pos)
+            if nl < 0:
+                break
+            end = nl + 1
+        out.append(data[pos:end])
+        pos = end
+    return out, pos
+
+
+class RecordCodec:
+    """
+    The record format shared by the log-based stores: a record is a full
+    session snapshot or a delta record
+    (`{"op": "delta", "id", "updated_at", "pop"?, "append"?, "title"?, "group"?}`)
+    applied on top of the latest snapshot of that session.
+
+    New records are written in `record_format` (see RECORD_FORMATS);
+    records of either format are read back.
+
+    With `blobs` set, large message meta values are written to it and the
+    records hold references (see snlite.blobs); `_hydrate` resolves them
+    once a session has been replayed.
+
+    Mixed into BaseSessionStore subclasses (uses `_normalize_group`).
+    """
+    record_format = "json"
+    blobs: Optional[BlobStore] = None
+
+    def _session_from_raw(self, s: Dict[str, Any]) -> Session:
+        return Session(
+            id=s["id"],
+            title=s.get("title", "Untitled"),
+            group=self._normalize_group(s.get("group")),
+            created_at=float(s.get("created_at", time.time())),
+            updated_at=float(s.get("updated_at", time.time())),
+            messages=intern_roles(list(s.get("messages", []))),
+        )
+
+    def _dehydrate(self, messages: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[str]]:
+        if self.blobs is None:
+            return messages, []
+        return self.blobs.dehydrate(messages)
+
+    def _hydrate(self, sess: Session) -> Session:
+        if self.blobs is not None:
+            self.blobs.hydrate(sess.messages)
+        return sess
+
+    def _encode(self, session: Session) -> Tuple[bytes, List[str]]:
+        """The snapshot record and the blob keys its messages reference."""
+        raw = session.to_dict()
+        raw["messages"], keys = self._dehydrate(session.messages)
+        return encode_record(raw, self.record_format), keys
+
+    def _encode_delta(self, delta: Dict[str, Any]) -> Tuple[bytes, List[str]]:
+        """The delta record and the blob keys its appended messages reference."""
+        keys: List[str] = []
+        if delta.get("append"):
+            delta = dict(delta)
+            delta["append"], keys = self._dehydrate(delta["append"])
+        return encode_record(delta, self.record_format), keys
+
+    def _apply_delta(self, sess: Session, delta: Dict[str, Any]) -> None:
+        pop = int(delta.get("pop") or 0)
+        if pop:
+            del sess.messages[max(0, len(sess.messages) - pop):]
+        sess.messages.extend(intern_roles(delta.get("append") or []))
+        if "title" in delta:
+            sess.title = delta["title"]
+        if "group" in delta:
+            sess.group = self._normalize_group(delta["group"])
+        sess.updated_at = float(delta.get("updated_at", sess.updated_at))
+
+    def _make_delta(self, session: Session, fps: List[str], title: str, group: str) -> Optional[Dict[str, Any]]:
+        """
+        Describe `session` relative to the stored state (message fingerprints
+        `fps`, `title`, `group`) as one delta record, or None when a full
+        snapshot is needed. Messages are only ever appended or popped from
+        the end; the message at the common boundary is fingerprinted to make
+        sure nothing else changed.
+        """
+        keep = min(len(fps), len(session.messages))
+        if keep and fingerprint(session.messages[keep - 1]) != fps[keep - 1]:
+            return None
+
+        delta: Dict[str, Any] = {"op": "delta", "id": session.id, "updated_at": session.updated_at}
+        if len(fps) > keep:
+            delta["pop"] = len(fps) - keep
+        if len(session.messages) > keep:
+            delta["append"] = session.messages[keep:]
+        if session.title != title:
+            delta["title"] = session.title
+        if session.group != group:
+            delta["group"] = session.group
+        return delta
+
+    def _apply_fps(self, fps: List[str], delta: Dict[str, Any]) -> List[str]:
+        keep = len(fps) - int(delta.get("pop") or 0)
+        return fps[:keep] + [fingerprint(m) for m in delta.get("append") or []]
@@ -1,18 +1,83 @@
 from __future__ import annotations
 
 import asyncio
+import logging
+import time
 from dataclasses import dataclass
-from typing import Optional, Dict, Any
+from typing import Any, Callable, Dict, List, Optional
 from uuid import uuid4
 
 from snlite.providers.base import Provider
 
+logger = logging.getLogger(__name__)
+
 @dataclass
 class LoadedModel:
     provider_name: str
     model_id: str
     meta: Dict[str, Any]
 
+class CancelToken:
+    """
+    Cancellation of one stream. Calling the token tells whether it was
+    cancelled, so it can be handed to providers as their `cancelled`
+    callable; `cancel()` additionally runs the registered callbacks right
+    away, so whatever waits on the upstream response is interrupted
+    instead of noticing at the next token.
+    """
+    __slots__ = ("reason", "requested_at", "_event", "_callbacks")
+
+    def __init__(self) -> None:
+        self.reason: Optional[str] = None  # stop | disconnect
+        self.requested_at: Optional[float] = None  # perf_counter()
+        self._event = asyncio.Event()
+        self._callbacks: List[Callable[["CancelToken"], Any]] = []
+
+    def __call__(self) -> bool:
+        return self.reason is not None
+
+    def cancel(self, reason: str = "stop") -> bool:
+        """Cancel once; False if it already was."""
+        if self.reason is not None:
+            return False
+        self.reason = reason
+        self.requested_at = time.perf_counter()
+        self._event.set()
+        callbacks, self._callbacks = self._callbacks, []
+        for cb in callbacks:
+            try:
+                cb(self)
+            except Exception:
+                logger.exception("cancel callback failed")
+        return True
+
+    def add_callback(self, cb: Callable[["CancelToken"], Any]) -> None:
+        """Run `cb(token)` on cancellation (now, if already cancelled)."""
+        if self.reason is not None:
+            cb(self)
+        else:
+            self._callbacks.append(cb)
+
+    async def wait(self) -> None:
+        await self._event.wait()
+
+
+class _CancelStats:
+    __slots__ = ("count", "total_s", "max_s")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_s / max(1, self.count) * 1000, 3),
+            "max_ms": round(self.max_s * 1000, 3),
+        }
+
+
 class AppRegistry:
     """
     Thread-safe-ish registry for:
@@ -26,7 +91,8 @@ class AppRegistry:
         self._loaded: Optional[LoadedModel] = None
         self._status: str = "idle"  # idle | loading | ready | error
         self._error: Optional[str] = None
-        self._active_streams: Dict[str, asyncio.Event] = {}  # request_id -> cancel_event
+        self._active_streams: Dict[str, CancelToken] = {}  # request_id -> cancel token
+        self._cancel_stats: Dict[str, _CancelStats] = {}  # by reason
 
     async def get_state(self) -> Dict[str, Any]:
         async with self._lock:
@@ -85,16 +151,20 @@ class AppRegistry:
     async def new_stream(self) -> str:
         request_id = uuid4().hex
         async with self._lock:
-            self._active_streams[request_id] = asyncio.Event()
+            self._active_streams[request_id] = CancelToken()
         return request_id
 
-    async def cancel_stream(self, request_id: str) -> bool:
+    async def stream_token(self, request_id: str) -> Optional[CancelToken]:
+        async with self._lock:
+            return self._active_streams.get(request_id)
+
+    async def cancel_stream(self, request_id: str, reason: str = "stop") -> bool:
         async with self._lock:
-            ev = self._active_streams.get(request_id)
-            if not ev:
-                return False
-            ev.set()
-            return True
+            token = self._active_streams.get(request_id)
+        if not token:
+            return False
+        token.cancel(reason)
+        return True
 
     async def pop_stream(self, request_id: str) -> None:
         async with self._lock:
@@ -102,5 +172,24 @@ class AppRegistry:
 
     async def is_cancelled(self, request_id: str) -> bool:
         async with self._lock:
-            ev = self._active_streams.get(request_id)
-            return bool(ev and ev.is_set())
\ No newline at end of file
+            token = self._active_streams.get(request_id)
+            return bool(token and token())
+
+    def record_cancelled(self, token: CancelToken) -> None:
+        """Count a cancelled stream and how long it took to go idle."""
+        if token.reason is None or token.requested_at is None:
+            return
+        st = self._cancel_stats.get(token.reason)
+        if st is None:
+            st = self._cancel_stats[token.reason] = _CancelStats()
+        elapsed = time.perf_counter() - token.requested_at
+        st.count += 1
+        st.total_s += elapsed
+        st.max_s = max(st.max_s, elapsed)
+
+    def stream_stats(self) -> Dict[str, Any]:
+        """Open streams and stop-to-idle latency of cancelled ones by reason."""
+        return {
+            "active": len(self._active_streams),
+            "cancelled": {reason: st.snapshot() for reason, st in sorted(self._cancel_stats.items())},
+        }
\ No newline at end of file
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from snlite.store_base import DEFAULT_GROUP, BaseSessionStore
+
+DAY_S = 86400.0
+
+
+@dataclass
+class RetentionPolicy:
+    """
+    When live sessions move to the archive tier:
+    - `max_age_days`: not updated for this many days (0 = never)
+    - `group_max`: more than this many sessions in a group, oldest first
+      (0 = no cap); `group_caps` overrides it per group name
+    """
+    max_age_days: float = 0.0
+    group_max: int = 0
+    group_caps: Dict[str, int] = field(default_factory=dict)
+
+    @classmethod
+    def parse(cls, max_age_days: str = "", group_max: str = "") -> "RetentionPolicy":
+        """
+        From the SNLITE_RETENTION_* settings: `max_age_days` is a number,
+        `group_max` a comma-separated list of `N` (every group) and
+        `group=N` entries, e.g. "200,scratch=20".
+        """
+        policy = cls(max_age_days=float(max_age_days or 0))
+        for part in (group_max or "").split(","):
+            part = part.strip()
+            if not part:
+                continue
+            name, sep, value = part.rpartition("=")
+            if sep:
+                policy.group_caps[name.strip() or DEFAULT_GROUP] = int(value)
+            else:
+                policy.group_max = int(value)
+        if policy.max_age_days < 0 or policy.group_max < 0 or any(v < 0 for v in policy.group_caps.values()):
+            raise ValueError("retention limits must not be negative")
+        return policy
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_age_days > 0 or self.group_max > 0 or any(v > 0 for v in self.group_caps.values())
+
+    def cap_for(self, group: str) -> int:
+        return self.group_caps.get(group, self.group_max)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"max_age_days": self.max_age_days, "group_max": self.group_max, "group_caps": dict(self.group_caps)}
+
+
+def plan_retention(store: BaseSessionStore, policy: RetentionPolicy, now: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    Sessions `policy` would archive, oldest first, each as
+    `{"id", "title", "group", "updated_at", "reason"}` with reason "age" or
+    "group_cap". Nothing is changed.
+    """
+    if not policy.enabled:
+        return []
+    now = time.time() if now is None else now
+    cutoff = now - policy.max_age_days * DAY_S if policy.max_age_days > 0 else None
+    by_group: Dict[str, List[Dict[str, Any]]] = {}
+    for s in store.list_sessions():  # newest first
+        if s.get("title") == "__deleted__":
+            continue
+        by_group.setdefault(store._normalize_group(s.get("group")), []).append(s)
+
+    out = []
+    for group, items in by_group.items():
+        cap = policy.cap_for(group)
+        for rank, s in enumerate(items):
+            if cutoff is not None and float(s.get("updated_at") or 0) < cutoff:
+                reason = "age"
+            elif cap > 0 and rank >= cap:
+                reason = "group_cap"
+            else:
+                continue
+            out.append({
+                "id": s["id"],
+                "title": s.get("title"),
+                "group": group,
+                "updated_at": s.get("updated_at"),
+                "reason": reason,
+            })
+    out.sort(key=lambda c: (c["updated_at"] or 0, c["id"]))
+    return out
+
+
+def apply_retention(
+    store: BaseSessionStore,
+    policy: RetentionPolicy,
+    batch: int,
+    now: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Archive the oldest `batch` sessions of the current plan with one
+    `store.bulk` call, i.e. one pass through the store. Callers repeat
+    while `remaining` is non-zero, letting other store calls in between.
+    """
+    candidates = plan_retention(store, policy, now)
+    chosen = candidates[: max(1, batch)]
+    if not chosen:
+        return {"archived": 0, "failed": 0, "remaining": 0, "archives": []}
+    result = store.bulk([{"op": "archive", "ids": [c["id"] for c in chosen]}])
+    rows = result["results"]
+    archives = [{"id": r["id"], "archive_id": r["archive_id"]} for r in rows if r.get("ok")]
+    return {
+        "archived": len(archives),
+        "failed": len(rows) - len(archives),
+        "remaining": len(candidates) - len(chosen),
+        "archives": archives,
+    }
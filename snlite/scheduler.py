@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+# Lower runs first
+PRIORITIES = {"interactive": 0, "title": 1, "batch": 2}
+
+# Service time assumed for a lane before any generation finished in it
+DEFAULT_SERVICE_S = 10.0
+# Weight of the newest sample in the service time average
+SERVICE_EWMA_ALPHA = 0.2
+# Sessions a lane remembers for round robin before forgetting idle ones
+MAX_TRACKED_SESSIONS = 1024
+
+
+class QueueFull(Exception):
+    """The lane already has the maximum number of requests waiting."""
+
+
+@dataclass
+class ConcurrencyLimits:
+    """
+    How many generations may run at once per provider/model (0 = no
+    limit). The most specific entry wins: "provider/model", then
+    "provider", then `default`.
+    """
+    default: int = 2
+    overrides: Dict[str, int] = field(default_factory=dict)
+
+    @classmethod
+    def parse(cls, spec: str = "") -> "ConcurrencyLimits":
+        """
+        From SNLITE_GEN_CONCURRENCY: a comma-separated list of `N` (every
+        model) and `provider=N` / `provider/model=N` entries, e.g.
+        "2,ollama=4,ollama/qwen3:4b=1".
+        """
+        limits = cls()
+        for part in (spec or "").split(","):
+            part = part.strip()
+            if not part:
+                continue
+            key, sep, value = part.rpartition("=")
+            if sep:
+                limits.overrides[key.strip()] = int(value)
+            else:
+                limits.default = int(value)
+        if limits.default < 0 or any(v < 0 for v in limits.overrides.values()):
+            raise ValueError("concurrency limits must not be negative")
+        return limits
+
+    def limit_for(self, provider: str, model: str) -> int:
+        for key in (f"{provider}/{model}", provider):
+            if key in self.overrides:
+                return self.overrides[key]
+        return self.default
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"default": self.default, "overrides": dict(self.overrides)}
+
+
+class Ticket:
+    """
+    A request's place in a lane. `wait()` until it may call the provider,
+    `release()` once it is done with it (or gave up). `on_position` is
+    called with (position, eta_s) whenever its place in the queue changes.
+    """
+    def __init__(self, lane: "_Lane", priority: int, session_id: str, seq: int) -> None:
+        self.lane = lane
+        self.priority = priority
+        self.session_id = session_id
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.position = 0
+        self.on_position: Optional[Callable[[int, float], None]] = None
+        self._granted = asyncio.get_running_loop().create_future()
+        self._released = False
+
+    @property
+    def running(self) -> bool:
+        return self.started_at is not None and not self._released
+
+    def eta_s(self) -> float:
+        return self.lane.eta_s(self.position)
+
+    async def wait(self) -> bool:
+        """True once the request may run, False if it was cancelled while queued."""
+        try:
+            return await asyncio.shield(self._granted)
+        except asyncio.CancelledError:
+            # the slot may have been granted just now; nobody will use it
+            self.release()
+            raise
+
+    def cancel(self) -> None:
+        """
+        Leave the queue. Does nothing once the ticket runs: its slot stays
+        taken until `release()`, i.e. until the provider call has wound down.
+        """
+        if self.started_at is None and not self._granted.done():
+            self._granted.set_result(False)
+            self.lane.remove(self)
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        if self.started_at is None:
+            self.cancel()
+            return
+        self.lane.finished(self)
+
+
+class _Lane:
+    """Requests for one provider/model: who runs, who waits, and how long generations take."""
+
+    def __init__(self, key: str, limit: int, queue_max: int) -> None:
+        self.key = key
+        self.limit = limit
+        self.queue_max = queue_max
+        self.running: List[Ticket] = []
+        self.waiting: List[Ticket] = []
+        self.service_s = DEFAULT_SERVICE_S
+        self.last_served: Dict[str, int] = {}  # session id -> `admitted` count when it last got a slot
+        self.admitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_total_s = 0.0
+        self.wait_max_s = 0.0
+
+    @property
+    def full(self) -> bool:
+        return self.queue_max > 0 and len(self.waiting) >= self.queue_max
+
+    def eta_s(self, position: int) -> float:
+        """Rough wait of the `position`-th waiter: one slot frees up every service_s / limit."""
+        if position <= 0:
+            return 0.0
+        return position * self.service_s / max(1, self.limit or 1)
+
+    def _sort_key(self, ticket: Ticket) -> Any:
+        # Within a priority class, sessions with fewer generations running
+        # and then the one served longest ago go first (round robin), so one
+        # session queuing many requests cannot starve the others; ties go in
+        # arrival order.
+        busy = sum(1 for t in self.running if t.session_id == ticket.session_id)
+        return (ticket.priority, busy, self.last_served.get(ticket.session_id, 0), ticket.seq)
+
+    def dispatch(self) -> None:
+        while self.waiting and (self.limit <= 0 or len(self.running) < self.limit):
+            self.waiting.sort(key=self._sort_key)
+            ticket = self.waiting.pop(0)
+            ticket.started_at = time.monotonic()
+            waited = ticket.started_at - ticket.enqueued_at
+            self.wait_total_s += waited
+            self.wait_max_s = max(self.wait_max_s, waited)
+            self.admitted += 1
+            self.last_served[ticket.session_id] = self.admitted
+            self.running.append(ticket)
+            ticket.position = 0
+            ticket._granted.set_result(True)
+        if len(self.last_served) > MAX_TRACKED_SESSIONS:
+            queued = {t.session_id for t in self.waiting}
+            self.last_served = {k: v for k, v in self.last_served.items() if k in queued}
+        self._renumber()
+
+    def _renumber(self) -> None:
+        self.waiting.sort(key=self._sort_key)
+        for position, ticket in enumerate(self.waiting, 1):
+            if ticket.position != position:
+                ticket.position = position
+                if ticket.on_position is not None:
+                    ticket.on_position(position, self.eta_s(position))
+
+    def remove(self, ticket: Ticket) -> None:
+        if ticket in self.waiting:
+            self.waiting.remove(ticket)
+            self._renumber()
+
+    def finished(self, ticket: Ticket) -> None:
+        if ticket in self.running:
+            self.running.remove(ticket)
+            took = time.monotonic() - (ticket.started_at or 0.0)
+            if self.completed:
+                self.service_s += SERVICE_EWMA_ALPHA * (took - self.service_s)
+            else:
+                self.service_s = took
+            self.completed += 1
+        self.dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "running": len(self.running),
+            "waiting": len(self.waiting),
+            "admitted": self.admitted,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "service_ms": int(self.service_s * 1000),
+            "avg_wait_ms": int(self.wait_total_s / self.admitted * 1000) if self.admitted else 0,
+            "max_wait_ms": int(self.wait_max_s * 1000),
+        }
+
+
+class GenerationScheduler:
+    """
+    Admission control in front of the providers. Each provider/model is a
+    lane with its own concurrency limit; requests over it wait, ordered by
+    priority class, then fairly across sessions, then by arrival. A lane
+    with `queue_max` requests waiting rejects new ones with QueueFull
+    (0 = unbounded).
+    """
+    def __init__(self, limits: ConcurrencyLimits, queue_max: int = 32) -> None:
+        self.limits = limits
+        self.queue_max = queue_max
+        self._lanes: Dict[str, _Lane] = {}
+        self._seq = 0
+
+    def _lane(self, provider: str, model: str) -> _Lane:
+        key = f"{provider}/{model}"
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _Lane(key, self.limits.limit_for(provider, model), self.queue_max)
+        return lane
+
+    def check(self, provider: str, model: str) -> None:
+        """Raise QueueFull now if `enqueue` would, before the caller does any work."""
+        lane = self._lane(provider, model)
+        if lane.full:
+            lane.rejected += 1
+            raise QueueFull(lane.key)
+
+    def enqueue(self, provider: str, model: str, priority: str, session_id: str) -> Ticket:
+        """
+        Queue a request and return its ticket, already granted when the
+        lane has a free slot and nobody waiting before it.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"unknown priority: {priority}")
+        self.check(provider, model)
+        lane = self._lane(provider, model)
+        self._seq += 1
+        ticket = Ticket(lane, PRIORITIES[priority], session_id, self._seq)
+        lane.waiting.append(ticket)
+        lane.dispatch()
+        return ticket
+
+    def retry_after_s(self, provider: str, model: str) -> int:
+        """Seconds a rejected client should wait before trying again."""
+        lane = self._lane(provider, model)
+        return max(1, int(lane.eta_s(1) + 0.5))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limits": self.limits.to_dict(),
+            "queue_max": self.queue_max,
+            "lanes": {key: lane.stats() for key, lane in sorted(self._lanes.items())},
+        }
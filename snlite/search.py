@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field, asdict
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional
+
+if TYPE_CHECKING:
+    from snlite.store_base import BaseSessionStore, Session
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 2  # 2: CJK unigrams indexed
+
+# Latin words/numbers, or runs of CJK ideographs, kana and hangul.
+_TOKEN_RE = re.compile(
+    r"[0-9a-z_]+"
+    "|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+"
+)
+_MAX_WORD_LEN = 40
+
+# BM25 parameters
+_K1 = 1.2
+_B = 0.75
+
+
+def tokenize(text: str, query: bool = False) -> Iterator[str]:
+    """
+    Latin runs become lowercase words; CJK runs have no word boundaries, so
+    they become overlapping character bigrams, and in documents also every
+    single character. A query run of two or more characters uses only its
+    bigrams, so a Chinese phrase matches documents containing all of them;
+    a one-character query matches through the unigrams.
+    """
+    for m in _TOKEN_RE.finditer((text or "").lower()):
+        w = m.group()
+        if w[0] < "\u3040":
+            if len(w) <= _MAX_WORD_LEN:
+                yield w
+        elif len(w) == 1:
+            yield w
+        else:
+            for i in range(len(w) - 1):
+                yield w[i:i + 2]
+            if not query:
+                yield from w
+
+
+def _count_terms(texts: Iterable[str], into: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+    terms = into if into is not None else {}
+    for text in texts:
+        for tok in tokenize(text):
+            terms[tok] = terms.get(tok, 0) + 1
+    return terms
+
+
+def _content_hash(message: Dict[str, Any]) -> str:
+    data = str(message.get("content") or "").encode("utf-8")
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+def _snippet(text: str, query: str, terms: List[str], width: int = 60) -> str:
+    low = text.lower()
+    pos = low.find(query.lower()) if query else -1
+    if pos < 0:
+        pos = min((p for p in (low.find(t) for t in terms) if p >= 0), default=0)
+    start = max(0, pos - width)
+    end = min(len(text), pos + width * 2)
+    out = re.sub(r"\s+", " ", text[start:end]).strip()
+    return ("…" if start > 0 else "") + out + ("…" if end < len(text) else "")
+
+
+@dataclass
+class _Doc:
+    kind: str  # session | archive
+    ref: str  # session id or archive id
+    title: str
+    group: str
+    updated_at: float
+    count: int = 0  # messages indexed (sessions)
+    tail: str = ""  # content hash of the last indexed message
+    length: int = 0  # total term count
+    terms: Dict[str, int] = field(default_factory=dict)
+
+
+class SearchIndex:
+    """
+    Inverted index over session messages (plus titles) and archive texts,
+    ranked with BM25.
+
+    Sessions are indexed incrementally: when a save only appended messages,
+    only the new messages are tokenized. The per-document term counts are
+    persisted to `path`; on startup `sync` compares them with the store by
+    updated_at and re-indexes only what changed.
+    """
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path
+        self._docs: Dict[str, _Doc] = {}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._total_length = 0
+        self._dirty = False
+        self._lock = threading.RLock()
+        if path:
+            self._load()
+
+    # ---- persistence ----
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != INDEX_VERSION:
+                return
+            for key, raw in (data.get("docs") or {}).items():
+                self._add_doc(key, _Doc(**raw))
+        except Exception:
+            logger.exception("search index %s is unreadable; rebuilding", self.path)
+            self._docs = {}
+            self._postings = {}
+            self._total_length = 0
+
+    def flush(self) -> bool:
+        """Write the index if it changed since the last flush."""
+        with self._lock:
+            if not self.path or not self._dirty:
+                return False
+            data = {"version": INDEX_VERSION, "docs": {k: asdict(d) for k, d in self._docs.items()}}
+            self._dirty = False
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, self.path)
+        return True
+
+    # ---- postings ----
+
+    def _add_doc(self, key: str, doc: _Doc) -> None:
+        self._docs[key] = doc
+        for tok, tf in doc.terms.items():
+            self._postings.setdefault(tok, {})[key] = tf
+        self._total_length += doc.length
+
+    def _add_terms(self, key: str, doc: _Doc, terms: Dict[str, int]) -> None:
+        for tok, tf in terms.items():
+            n = doc.terms.get(tok, 0) + tf
+            doc.terms[tok] = n
+            self._postings.setdefault(tok, {})[key] = n
+            doc.length += tf
+            self._total_length += tf
+
+    def _remove(self, key: str) -> None:
+        doc = self._docs.pop(key, None)
+        if not doc:
+            return
+        for tok in doc.terms:
+            posting = self._postings.get(tok)
+            if posting is not None:
+                posting.pop(key, None)
+                if not posting:
+                    del self._postings[tok]
+        self._total_length -= doc.length
+        self._dirty = True
+
+    # ---- updates ----
+
+    def update_session(self, session: "Session") -> None:
+        key = "s:" + session.id
+        messages = session.messages
+        with self._lock:
+            doc = self._docs.get(key)
+            incremental = (
+                doc is not None
+                and doc.title == session.title
+                and doc.count <= len(messages)
+                and (doc.count == 0 or _content_hash(messages[doc.count - 1]) == doc.tail)
+            )
+            if not incremental:
+                self._remove(key)
+                doc = _Doc(kind="session", ref=session.id, title=session.title, group=session.group, updated_at=session.updated_at)
+                self._add_doc(key, doc)
+                self._add_terms(key, doc, _count_terms([session.title]))
+            assert doc is not None
+            new = messages[doc.count:]
+            if new:
+                self._add_terms(key, doc, _count_terms(str(m.get("content") or "") for m in new))
+                doc.tail = _content_hash(messages[-1])
+            doc.count = len(messages)
+            doc.group = session.group
+            doc.updated_at = session.updated_at
+            self._dirty = True
+
+    def remove_session(self, session_id: str) -> None:
+        with self._lock:
+            self._remove("s:" + session_id)
+
+    def add_archive(self, meta: Dict[str, Any], content: str) -> None:
+        archive_id = str(meta.get("archive_id") or "")
+        key = "a:" + archive_id
+        with self._lock:
+            self._remove(key)
+            doc = _Doc(
+                kind="archive",
+                ref=archive_id,
+                title=str(meta.get("title") or ""),
+                group=str(meta.get("group") or ""),
+                updated_at=float(meta.get("archived_at") or 0),
+            )
+            self._add_doc(key, doc)
+            self._add_terms(key, doc, _count_terms([content]))
+            self._dirty = True
+
+    def remove_archive(self, archive_id: str) -> None:
+        with self._lock:
+            self._remove("a:" + archive_id)
+
+    def sync(self, store: "BaseSessionStore") -> Dict[str, int]:
+        """
+        Bring the index in line with `store`: (re)index sessions whose
+        updated_at changed and archives not indexed yet, drop the rest.
+        """
+        started = time.perf_counter()
+        indexed = removed = 0
+        with self._lock:
+            known = {k: (d.kind, d.updated_at) for k, d in self._docs.items()}
+        live = set()
+        for s in store.list_sessions():
+            key = "s:" + s["id"]
+            live.add(key)
+            if known.get(key) == ("session", s["updated_at"]):
+                continue
+            sess = store.get_session(s["id"])
+            if sess:
+                self.update_session(sess)
+                indexed += 1
+        for a in store.list_archives():
+            key = "a:" + str(a.get("archive_id"))
+            live.add(key)
+            if key in known:
+                continue
+            item = store.get_archive(a["archive_id"])
+            if item:
+                self.add_archive(item, item.get("content") or "")
+                indexed += 1
+        with self._lock:
+            for key in [k for k in self._docs if k not in live]:
+                self._remove(key)
+                removed += 1
+        logger.info(
+            "search index sync: %d indexed, %d removed, %d docs in %.1f ms",
+            indexed, removed, len(self._docs), (time.perf_counter() - started) * 1000,
+        )
+        return {"indexed": indexed, "removed": removed, "docs": len(self._docs)}
+
+    # ---- queries ----
+
+    def query(self, q: str, limit: int = 20, kind: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Documents containing every query term, best BM25 score first:
+        [{kind, id, title, group, updated_at, score}].
+        """
+        terms = list(dict.fromkeys(tokenize(q, query=True)))
+        if not terms:
+            return []
+        with self._lock:
+            postings = [self._postings.get(t) or {} for t in terms]
+            if not all(postings):
+                return []
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for p in postings[1:]:
+                candidates &= p.keys()
+            n_docs = len(self._docs)
+            avg_len = (self._total_length / n_docs) if n_docs else 1.0
+            scored = []
+            for key in candidates:
+                doc = self._docs[key]
+                if kind and doc.kind != kind:
+                    continue
+                score = 0.0
+                for p in postings:
+                    tf = p[key]
+                    idf = math.log(1 + (n_docs - len(p) + 0.5) / (len(p) + 0.5))
+                    score += idf * tf * (_K1 + 1) / (tf + _K1 * (1 - _B + _B * doc.length / max(avg_len, 1.0)))
+                scored.append((score, doc.updated_at, doc))
+            scored.sort(key=lambda x: (x[0], x[1]), reverse=True)
+            return [
+                {
+                    "kind": doc.kind,
+                    "id": doc.ref,
+                    "title": doc.title,
+                    "group": doc.group,
+                    "updated_at": doc.updated_at,
+                    "score": round(score, 4),
+                }
+                for score, _, doc in scored[:limit]
+            ]
+
+    def snippet(self, text: str, q: str) -> str:
+        return _snippet(text, q.strip(), list(dict.fromkeys(tokenize(q, query=True))))
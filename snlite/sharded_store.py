@@ -0,0 +1,550 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from snlite.archive_store import ArchiveSegments, SegmentArchivesMixin
+from snlite.blobs import BlobStore, message_blob_keys
+from snlite.filelock import InterProcessLock
+from snlite.records import CHECKPOINT_EVERY, RecordCodec, check_record_format, decode_record, fingerprint, split_records
+from snlite.store_base import BaseSessionStore, DURABILITY_MODES, Session, WriteStats
+
+logger = logging.getLogger(__name__)
+
+_SAFE_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# The metadata log is rewritten with one row per session once it has at
+# least this many superseded rows, and at least as many as live ones.
+META_CHECKPOINT_ROWS = 1024
+
+
+def _shard_name(session_id: str) -> str:
+    """File name for a session; ids that are not filename-safe are hashed."""
+    if _SAFE_ID_RE.match(session_id):
+        return session_id
+    return "h-" + hashlib.blake2b(session_id.encode("utf-8"), digest_size=16).hexdigest()
+
+
+@dataclass(slots=True)
+class _ShardMeta:
+    """Listing fields of a session plus the shape of its shard file."""
+    title: str
+    group: str
+    created_at: float
+    updated_at: float
+    count: int = 0  # number of messages
+    deltas: int = 0  # delta records after the snapshot
+    size: int = 0  # shard file size
+    blobs: List[str] = field(default_factory=list)  # blob keys referenced; after deltas, also popped messages'
+    row_len: int = field(default=0, repr=False)  # bytes of its latest metadata row
+    fps: Optional[List[str]] = field(default=None, repr=False)
+
+    def row(self, session_id: str) -> Dict[str, Any]:
+        return {
+            "id": session_id,
+            "title": self.title,
+            "group": self.group,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "count": self.count,
+            "deltas": self.deltas,
+            "size": self.size,
+            "blobs": self.blobs,
+        }
+
+    def summary(self, session_id: str) -> Dict[str, Any]:
+        return {
+            "id": session_id,
+            "title": self.title,
+            "group": self.group,
+            "updated_at": self.updated_at,
+            "created_at": self.created_at,
+        }
+
+
+class ShardedSessionStore(SegmentArchivesMixin, RecordCodec, BaseSessionStore):
+    """
+    One log file per session:
+    - data/sessions.d/<xx>/<id>.jsonl: the session's latest snapshot
+      followed by its delta records (same format as sessions.jsonl)
+    - data/sessions.d/index.jsonl: metadata log with one row per save
+      (`{id, title, group, created_at, updated_at, count, deltas, size}`)
+      or a tombstone `{"id", "deleted": true}`; the last row wins
+
+    A checkpoint rewrites the session's file (temp file + rename) instead of
+    appending, so a shard never holds more than one snapshot plus
+    CHECKPOINT_EVERY deltas and never needs compacting. Hard delete unlinks
+    one file, so deleting or archiving a session costs the size of that
+    session only. `compact` just rewrites the metadata log, repacks
+    archives and sweeps blobs (both stored like the jsonl backend's; the
+    metadata rows list each session's blob keys).
+
+    On open, shard sizes are checked against the metadata and shards
+    written after their last metadata row are re-read; an unterminated
+    record left at the end of a shard or of the metadata log by a crashed
+    write is cut off. A shard whose size differs from its metadata gets a
+    fresh snapshot instead of a delta. The metadata log is rewritten once
+    most of its rows are superseded (META_CHECKPOINT_ROWS). Rows appended
+    by another process are picked up incrementally. An existing
+    sessions.jsonl is migrated once.
+
+    Processes sharing the data dir coordinate through `sessions.d/lock`
+    (InterProcessLock): reads take it shared, anything that writes a shard
+    or the metadata log takes it exclusive, and `compact` bumps its
+    generation so the others re-read the rewritten metadata log.
+    """
+    def __init__(self, data_dir: str, durability: Optional[str] = None, record_format: Optional[str] = None) -> None:
+        self.record_format = check_record_format(record_format or "json")
+        self.durability = durability or self.default_durability
+        if self.durability not in DURABILITY_MODES:
+            raise ValueError(f"unknown durability: {self.durability} (expected one of {', '.join(DURABILITY_MODES)})")
+        self.data_dir = data_dir
+        self.root = os.path.join(self.data_dir, "sessions.d")
+        os.makedirs(self.root, exist_ok=True)
+        self.meta_path = os.path.join(self.root, "index.jsonl")
+        self.archives_dir = os.path.join(self.data_dir, "archives")
+        self.archive_index_path = os.path.join(self.data_dir, "archives.jsonl")
+        self._archives = ArchiveSegments(self.archives_dir, self.archive_index_path)
+        self.blobs = BlobStore(os.path.join(self.data_dir, "blobs"), fsync=self.durability != "none")
+
+        self._meta: Dict[str, _ShardMeta] = {}
+        self._meta_offset = 0  # bytes of index.jsonl applied to _meta
+        self._meta_key: Optional[Tuple[int, int]] = None  # (st_dev, st_ino)
+        self._meta_rows = 0
+        self._generation = 0  # of the metadata log we applied
+        self._lock = threading.RLock()
+        self._flock = InterProcessLock(os.path.join(self.root, "lock"))
+        self._write_stats = WriteStats()
+
+        started = time.perf_counter()
+        with self._lock, self._flock.exclusive():
+            fresh = not os.path.exists(self.meta_path)
+            self._refresh()
+            self._verify_shards()
+            if fresh:
+                self._migrate_from_jsonl()
+        logger.info(
+            "sharded store: %d sessions, %d metadata rows, opened in %.1f ms",
+            len(self._meta), self._meta_rows, (time.perf_counter() - started) * 1000,
+        )
+
+    # ---- files ----
+
+    def _shard_path(self, session_id: str) -> str:
+        name = _shard_name(session_id)
+        return os.path.join(self.root, name[-2:], name + ".jsonl")
+
+    def _fsync_wanted(self) -> bool:
+        return self.durability != "none"
+
+    def _write_snapshot(self, session: Session) -> Tuple[int, List[str]]:
+        """Replace the session's shard with a single snapshot; returns its size and blob keys."""
+        path = self._shard_path(session.id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data, keys = self._encode(session)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+            if self._fsync_wanted():
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+        return len(data), keys
+
+    def _shard_size(self, session_id: str) -> int:
+        try:
+            return os.path.getsize(self._shard_path(session_id))
+        except OSError:
+            return -1
+
+    def _append_delta(self, session_id: str, data: bytes) -> None:
+        with open(self._shard_path(session_id), "ab") as f:
+            f.write(data)
+            if self._fsync_wanted():
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _read_shard(self, session_id: str) -> Optional[Tuple[Session, int, int, List[str]]]:
+        """The session replayed from its shard, with its delta count, file size and blob keys."""
+        try:
+            with open(self._shard_path(session_id), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        records, used = split_records(data)
+        lines = [line for line in records if line.strip()]
+        if not lines:
+            return None
+        try:
+            sess = self._session_from_raw(decode_record(lines[0]))
+            for line in lines[1:]:
+                self._apply_delta(sess, decode_record(line))
+        except Exception:
+            return None
+        keys = message_blob_keys(sess.messages)
+        return self._hydrate(sess), len(lines) - 1, used, keys
+
+    # ---- metadata log ----
+
+    def _meta_for(self, session: Session, deltas: int, size: int, blobs: List[str]) -> _ShardMeta:
+        return _ShardMeta(
+            title=session.title,
+            group=session.group,
+            created_at=session.created_at,
+            updated_at=session.updated_at,
+            count=len(session.messages),
+            deltas=deltas,
+            size=size,
+            blobs=blobs,
+        )
+
+    def _append_meta(self, rows: List[Tuple[str, Optional[_ShardMeta]]]) -> None:
+        """Append metadata rows (None: tombstone) and apply them."""
+        out = []
+        for sid, meta in rows:
+            row = meta.row(sid) if meta else {"id": sid, "deleted": True}
+            data = (json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8")
+            if meta:
+                meta.row_len = len(data)
+                self._meta[sid] = meta
+            else:
+                self._meta.pop(sid, None)
+            out.append(data)
+        with open(self.meta_path, "ab") as f:
+            start = f.tell()
+            f.write(b"".join(out))
+        if start == self._meta_offset and self._meta_key is not None:
+            self._meta_offset = start + sum(len(d) for d in out)
+            self._meta_rows += len(out)
+        else:
+            # someone else appended too; re-read from where we were
+            self._refresh()
+        live = len(self._meta)
+        if self._meta_rows - live >= max(META_CHECKPOINT_ROWS, live):
+            self._rewrite_meta()
+
+    def _rewrite_meta(self) -> None:
+        """Replace the metadata log with one row per live session (exclusive lock held)."""
+        tmp = self.meta_path + ".tmp"
+        with open(tmp, "wb") as f:
+            for sid, meta in self._meta.items():
+                data = (json.dumps(meta.row(sid), ensure_ascii=False) + "\n").encode("utf-8")
+                meta.row_len = len(data)
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        os.replace(tmp, self.meta_path)
+        self._generation = self._flock.bump_generation()
+        st = os.stat(self.meta_path)
+        self._meta_key = (st.st_dev, st.st_ino)
+        self._meta_offset = size
+        self._meta_rows = len(self._meta)
+
+    def _apply_meta_line(self, line: bytes) -> None:
+        try:
+            row = json.loads(line)
+            sid = str(row.pop("id"))
+        except Exception:
+            return
+        self._meta_rows += 1
+        if row.get("deleted"):
+            self._meta.pop(sid, None)
+            return
+        try:
+            meta = _ShardMeta(**row)
+        except TypeError:
+            return
+        meta.row_len = len(line)
+        self._meta[sid] = meta
+
+    def _refresh(self) -> None:
+        """Apply metadata rows appended since the last call (by anyone)."""
+        generation = self._flock.generation()
+        if generation != self._generation:
+            # rewritten by another process's compact: start over
+            self._generation = generation
+            self._meta_key = None
+        try:
+            st = os.stat(self.meta_path)
+        except FileNotFoundError:
+            self._meta = {}
+            self._meta_offset = 0
+            self._meta_rows = 0
+            self._meta_key = None
+            return
+        key = (st.st_dev, st.st_ino)
+        if key != self._meta_key or st.st_size < self._meta_offset:
+            self._meta = {}
+            self._meta_offset = 0
+            self._meta_rows = 0
+            self._meta_key = key
+        if st.st_size == self._meta_offset:
+            return
+        with open(self.meta_path, "rb") as f:
+            f.seek(self._meta_offset)
+            data = f.read(st.st_size - self._meta_offset)
+        end = data.rfind(b"\n")
+        if end + 1 < len(data) and self._flock.held_exclusive:
+            # appends hold the exclusive lock, so nobody is still writing this
+            logger.warning(
+                "sessions.d/index.jsonl: removing %d bytes of an incomplete row (interrupted write)",
+                len(data) - end - 1,
+            )
+            os.truncate(self.meta_path, self._meta_offset + end + 1)
+        if end < 0:
+            return
+        for line in data[: end + 1].splitlines(keepends=True):
+            if line.strip():
+                self._apply_meta_line(line)
+        self._meta_offset += end + 1
+
+    def _verify_shards(self) -> None:
+        """Re-read shards that do not match their metadata; drop rows of missing shards."""
+        by_name = {_shard_name(sid): sid for sid in self._meta}
+        seen = set()
+        fixes: List[Tuple[str, Optional[_ShardMeta]]] = []
+        for sub in os.scandir(self.root):
+            if not sub.is_dir():
+                continue
+            for f in os.scandir(sub.path):
+                if not f.name.endswith(".jsonl"):
+                    continue
+                sid = by_name.get(f.name[: -len(".jsonl")])
+                meta = self._meta.get(sid) if sid else None
+                if meta and meta.size == f.stat().st_size:
+                    seen.add(sid)
+                    continue
+                loaded = self._read_shard_file(f.path)
+                if loaded:
+                    sess, deltas, size, keys = loaded
+                    seen.add(sess.id)
+                    fixes.append((sess.id, self._meta_for(sess, deltas, size, keys)))
+        for sid in self._meta:
+            if sid not in seen:
+                fixes.append((sid, None))
+        if fixes:
+            logger.info("sharded store: repaired metadata of %d sessions", len(fixes))
+            self._append_meta(fixes)
+
+    def _read_shard_file(self, path: str) -> Optional[Tuple[Session, int, int, List[str]]]:
+        """Replay a shard found on disk, cutting off a torn last record (exclusive lock held)."""
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            records, used = split_records(data)
+            sid = decode_record(records[0])["id"]
+        except Exception:
+            return None
+        if self._shard_path(sid) != path:
+            return None
+        if used < len(data):
+            logger.warning("%s: removing %d bytes of an incomplete record (interrupted write)", path, len(data) - used)
+            os.truncate(path, used)
+        return self._read_shard(sid)
+
+    def _migrate_from_jsonl(self) -> None:
+        legacy_path = os.path.join(self.data_dir, "sessions.jsonl")
+        if self._meta or not os.path.exists(legacy_path) or os.path.getsize(legacy_path) == 0:
+            return
+        from snlite.store import SessionStore
+
+        started = time.perf_counter()
+        legacy = SessionStore(self.data_dir)
+        rows: List[Tuple[str, Optional[_ShardMeta]]] = []
+        for summary in legacy.list_sessions():
+            sess = legacy.get_session(summary["id"])
+            if sess:
+                rows.append((sess.id, self._meta_for(sess, 0, *self._write_snapshot(sess))))
+        if rows:
+            self._append_meta(rows)
+        logger.info(
+            "migrated %d sessions from sessions.jsonl in %.1f ms",
+            len(rows), (time.perf_counter() - started) * 1000,
+        )
+
+    # ---- sessions ----
+
+    def list_sessions(self) -> List[Dict[str, Any]]:
+        with self._lock, self._flock.shared():
+            self._refresh()
+            items = sorted(self._meta.items(), key=lambda kv: kv[1].updated_at, reverse=True)
+            return [meta.summary(sid) for sid, meta in items]
+
+    def get_session(self, session_id: str) -> Optional[Session]:
+        with self._lock, self._flock.shared():
+            self._refresh()
+            meta = self._meta.get(session_id)
+            if not meta:
+                return None
+            loaded = self._read_shard(session_id)
+            if not loaded:
+                return None
+            sess = loaded[0]
+            if meta.fps is None:
+                meta.fps = [fingerprint(m) for m in sess.messages]
+            return sess
+
+    def save_session(self, session: Session) -> None:
+        self._save_sessions([session])
+
+    def _save_sessions(self, sessions: List[Session]) -> None:
+        """Write each session's shard, then their metadata rows in one append."""
+        with self._lock, self._flock.exclusive():
+            self._refresh()
+            started = time.perf_counter()
+            rows = []
+            written = 0
+            for session in sessions:
+                new, n = self._write_session(session)
+                rows.append((session.id, new))
+                written += n
+            self._append_meta(rows)
+            self._write_stats.record(len(rows), written, time.perf_counter() - started, fsynced=self._fsync_wanted())
+            for session in sessions:
+                self._search_saved(session)
+
+    def _write_session(self, session: Session) -> Tuple[_ShardMeta, int]:
+        """
+        Append a delta to the session's shard, or replace it with a
+        snapshot; returns the new metadata (not yet logged) and bytes written.
+        """
+        session.updated_at = time.time()
+        meta = self._meta.get(session.id)
+        delta = None
+        if meta and meta.deltas < CHECKPOINT_EVERY and self._shard_size(session.id) == meta.size:
+            if meta.fps is None:
+                self.get_session(session.id)
+            if meta.fps is not None:
+                delta = self._make_delta(session, meta.fps, meta.title, meta.group)
+        if delta is not None and meta is not None and meta.fps is not None:
+            data, keys = self._encode_delta(delta)
+            self._append_delta(session.id, data)
+            written = len(data)
+            new = self._meta_for(session, meta.deltas + 1, meta.size + written, list(dict.fromkeys(meta.blobs + keys)))
+            new.fps = self._apply_fps(meta.fps, delta)
+        else:
+            written, keys = self._write_snapshot(session)
+            new = self._meta_for(session, 0, written, keys)
+            new.fps = [fingerprint(m) for m in session.messages]
+        return new, written
+
+    def delete_session(self, session_id: str) -> bool:
+        with self._lock, self._flock.exclusive():
+            self._refresh()
+            meta = self._meta.get(session_id)
+            if meta is None:
+                return False
+            try:
+                os.remove(self._shard_path(session_id))
+            except FileNotFoundError:
+                pass
+            self._append_meta([(session_id, None)])
+            self._release_blobs([meta])
+            self._search_session_deleted(session_id)
+            return True
+
+    # ---- import / maintenance ----
+
+    def import_all(self, sessions: List[Dict[str, Any]], mode: str = "append") -> Dict[str, int]:
+        if mode not in ("append", "replace"):
+            raise ValueError("mode must be append or replace")
+        imported = 0
+        skipped = 0
+        with self._lock, self._flock.exclusive():
+            self._refresh()
+            if mode == "replace":
+                self.delete_sessions(list(self._meta))
+            batch: List[Session] = []
+            for raw in sessions:
+                sess = self._session_from_import(raw) if isinstance(raw, dict) else None
+                if not sess:
+                    skipped += 1
+                    continue
+                prev = self._meta.get(sess.id)
+                if prev and prev.updated_at > sess.updated_at:
+                    skipped += 1
+                    continue
+                batch.append(sess)
+                imported += 1
+            self._import_sessions(batch)
+            total = len(self._meta)
+        self._search_resync()
+        return {"imported": imported, "skipped": skipped, "total": total}
+
+    def _import_sessions(self, sessions: List[Session]) -> None:
+        with self._lock, self._flock.exclusive():
+            self._refresh()
+            replaced = [self._meta[s.id] for s in sessions if s.id in self._meta]
+            rows = [(s.id, self._meta_for(s, 0, *self._write_snapshot(s))) for s in sessions]
+            if rows:
+                self._append_meta(rows)
+            self._release_blobs(replaced)
+
+    # ---- blobs ----
+
+    def _blob_refs(self) -> Counter:
+        """How many sessions reference each blob key."""
+        return Counter(key for meta in self._meta.values() for key in meta.blobs)
+
+    def _release_blobs(self, metas: List[_ShardMeta]) -> None:
+        """Delete the blobs of removed sessions that are no longer referenced (exclusive lock held)."""
+        keys = [key for meta in metas for key in meta.blobs]
+        if keys:
+            self.blobs.release(keys, self._blob_refs())
+
+    def write_stats(self) -> Dict[str, Any]:
+        return {"durability": self.durability, **self._write_stats.snapshot()}
+
+    def garbage_stats(self) -> Dict[str, int]:
+        with self._lock, self._flock.shared():
+            self._refresh()
+            meta_bytes = self._meta_offset
+            live_meta = sum(m.row_len for m in self._meta.values())
+            shard_bytes = sum(m.size for m in self._meta.values())
+            archives = self._archives.stats()
+            archive_live = archives["archive_bytes"] - archives["archive_dead_bytes"]
+            blobs = self.blobs.stats(self._blob_refs())
+            blob_live = blobs["blob_bytes"] - blobs["blob_dead_bytes"]
+            return {
+                "total_bytes": meta_bytes + shard_bytes + archives["archive_bytes"] + blobs["blob_bytes"],
+                "live_bytes": live_meta + shard_bytes + archive_live + blob_live,
+                "dead_bytes": max(0, meta_bytes - live_meta) + archives["archive_dead_bytes"] + blobs["blob_dead_bytes"],
+                "records": self._meta_rows,
+                "live_records": len(self._meta),
+                "dead_records": max(0, self._meta_rows - len(self._meta)),
+                "sessions": len(self._meta),
+                "shard_bytes": shard_bytes,
+                **archives,
+                **blobs,
+            }
+
+    def compact(self) -> Dict[str, int]:
+        """
+        Rewrite the metadata log with one row per live session, repack
+        archive segments and remove unreferenced blobs. Shards are
+        checkpointed as they are saved.
+        """
+        with self._lock, self._flock.exclusive():
+            self._refresh()
+            before = self._meta_rows
+            self._rewrite_meta()
+            repacked = self._archives.repack()
+            blobs_removed = self.blobs.sweep(self._blob_refs())
+        return {
+            "before": before,
+            "after": self._meta_rows,
+            "saved": max(0, before - self._meta_rows),
+            "archives_moved": repacked["moved"],
+            "archive_segments_removed": repacked["segments_removed"],
+            "archive_files_removed": repacked["legacy_removed"],
+            "blobs_removed": blobs_removed,
+        }
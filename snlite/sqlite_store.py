@@ -0,0 +1,542 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from snlite.blobs import dehydrate, hydrate
+from snlite.store_base import DURABILITY_MODES, BaseSessionStore, Session, WriteStats, decode_cursor, encode_cursor, intern_roles
+
+logger = logging.getLogger(__name__)
+
+SYNCHRONOUS = {"none": "OFF", "batch-fsync": "NORMAL", "always-fsync": "FULL"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    grp TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions(updated_at, id);
+CREATE INDEX IF NOT EXISTS idx_sessions_group ON sessions(grp, updated_at, id);
+
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    body TEXT NOT NULL,
+    PRIMARY KEY (session_id, seq)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS archives (
+    archive_id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    grp TEXT NOT NULL,
+    archived_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    message_count INTEGER NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_archives_archived ON archives(archived_at);
+
+CREATE TABLE IF NOT EXISTS blobs (
+    key TEXT PRIMARY KEY,
+    body BLOB NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS session_blobs (
+    session_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    PRIMARY KEY (session_id, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_session_blobs_key ON session_blobs(key);
+
+CREATE TABLE IF NOT EXISTS store_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# Statements are kept as module constants so sqlite3's per-connection
+# statement cache reuses the prepared form.
+SQL_LIST_SESSIONS = "SELECT id, title, grp, updated_at, created_at FROM sessions ORDER BY updated_at DESC"
+SQL_GET_SESSION = "SELECT id, title, grp, created_at, updated_at, message_count FROM sessions WHERE id = ?"
+SQL_GET_MESSAGES = "SELECT body FROM messages WHERE session_id = ? ORDER BY seq"
+SQL_GET_MESSAGE_RANGE = "SELECT body FROM messages WHERE session_id = ? AND seq >= ? AND seq < ? ORDER BY seq"
+SQL_GET_MESSAGE = "SELECT body FROM messages WHERE session_id = ? AND seq = ?"
+SQL_UPSERT_SESSION = (
+    "INSERT INTO sessions (id, title, grp, created_at, updated_at, message_count) VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(id) DO UPDATE SET title = excluded.title, grp = excluded.grp, "
+    "created_at = excluded.created_at, updated_at = excluded.updated_at, message_count = excluded.message_count"
+)
+SQL_TRIM_MESSAGES = "DELETE FROM messages WHERE session_id = ? AND seq >= ?"
+SQL_INSERT_MESSAGE = "INSERT INTO messages (session_id, seq, body) VALUES (?, ?, ?)"
+SQL_DELETE_SESSION = "DELETE FROM sessions WHERE id = ?"
+SQL_DELETE_MESSAGES = "DELETE FROM messages WHERE session_id = ?"
+SQL_GET_BLOB = "SELECT body FROM blobs WHERE key = ?"
+SQL_PUT_BLOB = "INSERT OR IGNORE INTO blobs (key, body) VALUES (?, ?)"
+SQL_SESSION_BLOBS = "SELECT key FROM session_blobs WHERE session_id = ?"
+SQL_LINK_BLOB = "INSERT OR IGNORE INTO session_blobs (session_id, key) VALUES (?, ?)"
+SQL_UNLINK_BLOB = "DELETE FROM session_blobs WHERE session_id = ? AND key = ?"
+SQL_UNLINK_SESSION_BLOBS = "DELETE FROM session_blobs WHERE session_id = ?"
+SQL_RELEASE_BLOB = "DELETE FROM blobs WHERE key = ? AND NOT EXISTS (SELECT 1 FROM session_blobs WHERE key = ?)"
+SQL_DEAD_BLOBS = "FROM blobs WHERE NOT EXISTS (SELECT 1 FROM session_blobs s WHERE s.key = blobs.key)"
+SQL_LIST_ARCHIVES = (
+    "SELECT archive_id, session_id, title, grp, archived_at, created_at, message_count "
+    "FROM archives ORDER BY archived_at DESC"
+)
+SQL_GET_ARCHIVE = (
+    "SELECT archive_id, session_id, title, grp, archived_at, created_at, message_count, content "
+    "FROM archives WHERE archive_id = ?"
+)
+SQL_INSERT_ARCHIVE = (
+    "INSERT OR REPLACE INTO archives (archive_id, session_id, title, grp, archived_at, created_at, message_count, content) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+SQL_DELETE_ARCHIVE = "DELETE FROM archives WHERE archive_id = ?"
+
+
+def _py_lower(value: Any) -> Any:
+    return value.lower() if isinstance(value, str) else value
+
+
+def _like_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _encode_message(message: Dict[str, Any]) -> str:
+    return json.dumps(message, ensure_ascii=False)
+
+
+def _archive_row(row: sqlite3.Row) -> Dict[str, Any]:
+    return {
+        "archive_id": row["archive_id"],
+        "session_id": row["session_id"],
+        "title": row["title"],
+        "group": row["grp"],
+        "archived_at": row["archived_at"],
+        "created_at": row["created_at"],
+        "message_count": row["message_count"],
+    }
+
+
+class SqliteSessionStore(BaseSessionStore):
+    """
+    SQLite store (data/snlite.db) in WAL mode:
+    - sessions: one row per session, indexed by updated_at and group
+    - messages: one row per message, keyed by (session_id, seq)
+    - archives: archive metadata and text
+    - blobs: large message meta values (see snlite.blobs), zlib-compressed
+      and keyed by content hash; session_blobs holds the references, so a
+      blob is deleted with the last session that uses it
+
+    Each thread gets its own connection. On first open, existing
+    sessions.jsonl / archives.jsonl data is migrated once.
+
+    `durability` maps to PRAGMA synchronous (none: OFF, batch-fsync:
+    NORMAL, always-fsync: FULL); WAL already commits concurrent writers in
+    one log append, so there is no separate batching.
+
+    Unlike the log-based stores it defaults to batch-fsync: with
+    synchronous=OFF a power loss can corrupt the database, whereas the logs
+    only lose a tail that the next startup cuts off.
+
+    Title/group filters compare `py_lower()` of the columns, i.e. Python's
+    Unicode lowercasing like the other backends, not SQLite's ASCII-only
+    case folding in LIKE.
+    """
+    default_durability = "batch-fsync"
+
+    def __init__(self, data_dir: str, filename: str = "snlite.db", durability: Optional[str] = None) -> None:
+        self.durability = durability or self.default_durability
+        if self.durability not in SYNCHRONOUS:
+            raise ValueError(f"unknown durability: {self.durability} (expected one of {', '.join(DURABILITY_MODES)})")
+        self._write_stats = WriteStats()
+        self.data_dir = data_dir
+        os.makedirs(self.data_dir, exist_ok=True)
+        self.path = os.path.join(self.data_dir, filename)
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+        self._migrate_from_jsonl()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, cached_statements=64)
+            conn.row_factory = sqlite3.Row
+            conn.create_function("py_lower", 1, _py_lower, deterministic=True)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={SYNCHRONOUS[self.durability]}")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _tx(self) -> Iterator[sqlite3.Connection]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _migrate_from_jsonl(self) -> None:
+        conn = self._conn()
+        if conn.execute("SELECT 1 FROM store_meta WHERE key = 'migrated_from_jsonl'").fetchone():
+            return
+
+        from snlite.store import SessionStore
+
+        sessions_path = os.path.join(self.data_dir, "sessions.jsonl")
+        archives_path = os.path.join(self.data_dir, "archives.jsonl")
+        has_jsonl = any(os.path.exists(p) and os.path.getsize(p) > 0 for p in (sessions_path, archives_path))
+        sessions = archives = 0
+        if has_jsonl:
+            started = time.perf_counter()
+            legacy = SessionStore(self.data_dir)
+            with self._tx() as conn:
+                for summary in legacy.list_sessions():
+                    sess = legacy.get_session(summary["id"])
+                    if sess:
+                        self._write_session(conn, sess)
+                        sessions += 1
+                for meta in legacy.list_archives():
+                    item = legacy.get_archive(meta["archive_id"])
+                    if item:
+                        self._write_archive(conn, item, item["content"])
+                        archives += 1
+            logger.info(
+                "migrated %d sessions and %d archives from JSONL in %.1f ms",
+                sessions, archives, (time.perf_counter() - started) * 1000,
+            )
+        with self._tx() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO store_meta (key, value) VALUES ('migrated_from_jsonl', ?)",
+                (json.dumps({"at": time.time(), "sessions": sessions, "archives": archives}),),
+            )
+
+    # ---- blobs ----
+
+    def _hydrate(self, conn: sqlite3.Connection, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        def get(key: str) -> Optional[str]:
+            row = conn.execute(SQL_GET_BLOB, (key,)).fetchone()
+            return zlib.decompress(row["body"]).decode("utf-8") if row else None
+
+        return hydrate(intern_roles(messages), get)
+
+    def _dehydrate(self, conn: sqlite3.Connection, messages: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[str]]:
+        def put(key: str, text: str) -> None:
+            if not conn.execute(SQL_GET_BLOB, (key,)).fetchone():
+                conn.execute(SQL_PUT_BLOB, (key, zlib.compress(text.encode("utf-8"))))
+
+        return dehydrate(messages, put)
+
+    def _release_blobs(self, conn: sqlite3.Connection, keys: Iterable[str]) -> None:
+        conn.executemany(SQL_RELEASE_BLOB, [(k, k) for k in set(keys)])
+
+    # ---- sessions ----
+
+    def list_sessions(self) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(SQL_LIST_SESSIONS).fetchall()
+        return [
+            {
+                "id": r["id"],
+                "title": r["title"],
+                "group": r["grp"],
+                "updated_at": r["updated_at"],
+                "created_at": r["created_at"],
+            }
+            for r in rows
+        ]
+
+    def list_sessions_page(
+        self,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        group: Optional[str] = None,
+        title_prefix: Optional[str] = None,
+        query: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        where = ["title != '__deleted__'"]
+        args: List[Any] = []
+        prefix = (title_prefix or "").strip()
+        if prefix:
+            where.append("py_lower(title) LIKE ? ESCAPE '\\'")
+            args.append(_like_escape(prefix.lower()) + "%")
+        q = (query or "").strip()
+        if q:
+            where.append("(py_lower(title) LIKE ? ESCAPE '\\' OR py_lower(grp) LIKE ? ESCAPE '\\')")
+            args += ["%" + _like_escape(q.lower()) + "%"] * 2
+
+        conn = self._conn()
+        text_filter = " AND ".join(where)
+        groups = {
+            r["grp"]: r["n"]
+            for r in conn.execute(f"SELECT grp, COUNT(*) AS n FROM sessions WHERE {text_filter} GROUP BY grp", args)
+        }
+
+        page_where = list(where)
+        page_args = list(args)
+        if group is not None:
+            page_where.append("grp = ?")
+            page_args.append(group)
+        if cursor:
+            updated_at, session_id = decode_cursor(cursor)
+            page_where.append("(updated_at < ? OR (updated_at = ? AND id < ?))")
+            page_args += [updated_at, updated_at, session_id]
+        rows = conn.execute(
+            "SELECT id, title, grp, updated_at, created_at FROM sessions "
+            f"WHERE {' AND '.join(page_where)} ORDER BY updated_at DESC, id DESC LIMIT ?",
+            page_args + [limit + 1],
+        ).fetchall()
+
+        items = [
+            {
+                "id": r["id"],
+                "title": r["title"],
+                "group": r["grp"],
+                "updated_at": r["updated_at"],
+                "created_at": r["created_at"],
+            }
+            for r in rows[:limit]
+        ]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = encode_cursor(items[-1]["updated_at"], items[-1]["id"])
+        return {"items": items, "next_cursor": next_cursor, "groups": groups}
+
+    def get_session(self, session_id: str) -> Optional[Session]:
+        conn = self._conn()
+        row = conn.execute(SQL_GET_SESSION, (session_id,)).fetchone()
+        if not row:
+            return None
+        messages = self._hydrate(conn, [json.loads(r["body"]) for r in conn.execute(SQL_GET_MESSAGES, (session_id,))])
+        return Session(
+            id=row["id"],
+            title=row["title"],
+            group=row["grp"],
+            created_at=row["created_at"],
+            updated_at=row["updated_at"],
+            messages=messages,
+        )
+
+    def get_session_window(
+        self, session_id: str, limit: int, before: Optional[int] = None,
+    ) -> Optional[Tuple[Session, int, int]]:
+        conn = self._conn()
+        row = conn.execute(SQL_GET_SESSION, (session_id,)).fetchone()
+        if not row:
+            return None
+        total = int(row["message_count"])
+        end = total if before is None else max(0, min(before, total))
+        start = max(0, end - limit)
+        messages = self._hydrate(
+            conn, [json.loads(r["body"]) for r in conn.execute(SQL_GET_MESSAGE_RANGE, (session_id, start, end))],
+        )
+        sess = Session(
+            id=row["id"],
+            title=row["title"],
+            group=row["grp"],
+            created_at=row["created_at"],
+            updated_at=row["updated_at"],
+            messages=messages,
+        )
+        return sess, total, start
+
+    def _write_session(self, conn: sqlite3.Connection, session: Session) -> None:
+        """
+        Upsert `session`, rewriting only the messages after the longest
+        unchanged prefix (messages are appended or popped at the end).
+        Messages are stored dehydrated; the session's blob references are
+        replaced when all of them are rewritten and extended otherwise.
+        """
+        row = conn.execute(SQL_GET_SESSION, (session.id,)).fetchone()
+        stored = int(row["message_count"]) if row else 0
+        keep = min(stored, len(session.messages))
+        tail, keys = self._dehydrate(conn, session.messages[keep - 1:] if keep else session.messages)
+        if keep:
+            last = conn.execute(SQL_GET_MESSAGE, (session.id, keep - 1)).fetchone()
+            if not last or last["body"] != _encode_message(tail[0]):
+                keep = 0
+                tail, keys = self._dehydrate(conn, session.messages)
+            else:
+                tail = tail[1:]
+
+        conn.execute(SQL_UPSERT_SESSION, (
+            session.id,
+            session.title,
+            self._normalize_group(session.group),
+            session.created_at,
+            session.updated_at,
+            len(session.messages),
+        ))
+        if stored > keep:
+            conn.execute(SQL_TRIM_MESSAGES, (session.id, keep))
+        conn.executemany(
+            SQL_INSERT_MESSAGE,
+            [(session.id, seq, _encode_message(m)) for seq, m in enumerate(tail, start=keep)],
+        )
+        if not keep:
+            old = {r["key"] for r in conn.execute(SQL_SESSION_BLOBS, (session.id,))}
+            gone = old.difference(keys)
+            if gone:
+                conn.executemany(SQL_UNLINK_BLOB, [(session.id, k) for k in gone])
+                self._release_blobs(conn, gone)
+        conn.executemany(SQL_LINK_BLOB, [(session.id, k) for k in keys])
+
+    def save_session(self, session: Session) -> None:
+        self._save_sessions([session])
+
+    def _save_sessions(self, sessions: List[Session]) -> None:
+        started = time.perf_counter()
+        with self._tx() as conn:
+            acquired = time.perf_counter()
+            for session in sessions:
+                session.updated_at = time.time()
+                self._write_session(conn, session)
+        self._write_stats.record(
+            len(sessions), 0, time.perf_counter() - acquired, acquired - started, self.durability != "none",
+        )
+        for session in sessions:
+            self._search_saved(session)
+
+    def write_stats(self) -> Dict[str, Any]:
+        return {"durability": self.durability, **self._write_stats.snapshot()}
+
+    def _delete_rows(self, conn: sqlite3.Connection, session_id: str) -> bool:
+        deleted = conn.execute(SQL_DELETE_SESSION, (session_id,)).rowcount > 0
+        conn.execute(SQL_DELETE_MESSAGES, (session_id,))
+        keys = [r["key"] for r in conn.execute(SQL_SESSION_BLOBS, (session_id,))]
+        if keys:
+            conn.execute(SQL_UNLINK_SESSION_BLOBS, (session_id,))
+            self._release_blobs(conn, keys)
+        return deleted
+
+    def delete_session(self, session_id: str) -> bool:
+        with self._tx() as conn:
+            deleted = self._delete_rows(conn, session_id)
+        if deleted:
+            self._search_session_deleted(session_id)
+        return deleted
+
+    def delete_sessions(self, session_ids: Iterable[str]) -> int:
+        ids = set(session_ids)
+        with self._tx() as conn:
+            deleted = sum(1 for sid in ids if self._delete_rows(conn, sid))
+        for sid in ids:
+            self._search_session_deleted(sid)
+        return deleted
+
+    # ---- archives ----
+
+    def _write_archive(self, conn: sqlite3.Connection, meta: Dict[str, Any], content: str) -> None:
+        conn.execute(SQL_INSERT_ARCHIVE, (
+            meta["archive_id"],
+            meta.get("session_id") or "",
+            meta.get("title") or "",
+            self._normalize_group(meta.get("group")),
+            float(meta.get("archived_at") or 0),
+            float(meta.get("created_at") or 0),
+            int(meta.get("message_count") or 0),
+            content,
+        ))
+
+    def list_archives(self) -> List[Dict[str, Any]]:
+        return [_archive_row(r) for r in self._conn().execute(SQL_LIST_ARCHIVES)]
+
+    def get_archive(self, archive_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(SQL_GET_ARCHIVE, (archive_id,)).fetchone()
+        if not row:
+            return None
+        return {**_archive_row(row), "content": row["content"]}
+
+    def delete_archive(self, archive_id: str) -> bool:
+        with self._tx() as conn:
+            deleted = conn.execute(SQL_DELETE_ARCHIVE, (archive_id,)).rowcount > 0
+        if deleted:
+            self._search_archive_deleted(archive_id)
+        return deleted
+
+    def _put_archive(self, archive_meta: Dict[str, Any], content: str) -> Dict[str, Any]:
+        return self._put_archives([(archive_meta, content)])[0]
+
+    def _put_archives(self, items: List[Tuple[Dict[str, Any], str]]) -> List[Dict[str, Any]]:
+        with self._tx() as conn:
+            for archive_meta, content in items:
+                self._write_archive(conn, archive_meta, content)
+        return [archive_meta for archive_meta, _ in items]
+
+    # ---- export / import / maintenance ----
+
+    def import_all(self, sessions: List[Dict[str, Any]], mode: str = "append") -> Dict[str, int]:
+        if mode not in ("append", "replace"):
+            raise ValueError("mode must be append or replace")
+
+        imported = 0
+        skipped = 0
+        with self._tx() as conn:
+            if mode == "replace":
+                conn.execute("DELETE FROM messages")
+                conn.execute("DELETE FROM sessions")
+                conn.execute("DELETE FROM session_blobs")
+                conn.execute("DELETE FROM blobs")
+            for raw in sessions:
+                if not isinstance(raw, dict):
+                    skipped += 1
+                    continue
+                sess = self._session_from_import(raw)
+                if not sess:
+                    skipped += 1
+                    continue
+                prev = conn.execute(SQL_GET_SESSION, (sess.id,)).fetchone()
+                if prev and prev["updated_at"] > sess.updated_at:
+                    skipped += 1
+                    continue
+                self._write_session(conn, sess)
+                imported += 1
+            total = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        self._search_resync()
+        return {"imported": imported, "skipped": skipped, "total": total}
+
+    def _import_sessions(self, sessions: List[Session]) -> None:
+        with self._tx() as conn:
+            for sess in sessions:
+                self._write_session(conn, sess)
+
+    def garbage_stats(self) -> Dict[str, int]:
+        conn = self._conn()
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        pages = conn.execute("PRAGMA page_count").fetchone()[0]
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        blobs, blob_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM blobs").fetchone()
+        blob_dead = conn.execute(f"SELECT COALESCE(SUM(LENGTH(body)), 0) {SQL_DEAD_BLOBS}").fetchone()[0]
+        return {
+            "total_bytes": pages * page_size,
+            "live_bytes": (pages - free) * page_size,
+            "dead_bytes": free * page_size,
+            "sessions": conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0],
+            "blobs": blobs,
+            "blob_bytes": blob_bytes,
+            "blob_dead_bytes": blob_dead,
+        }
+
+    def compact(self) -> Dict[str, int]:
+        conn = self._conn()
+        before = conn.execute("PRAGMA page_count").fetchone()[0]
+        with self._tx() as tx:
+            blobs_removed = tx.execute(f"DELETE {SQL_DEAD_BLOBS}").rowcount
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("VACUUM")
+        after = conn.execute("PRAGMA page_count").fetchone()[0]
+        return {"before": before, "after": after, "saved": max(0, before - after), "blobs_removed": blobs_removed}
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from json.encoder import encode_basestring  # type: ignore[attr-defined]
+from typing import Any, Dict, List
+
+# How much slower than the configured window frames may get when the
+# client reads slowly.
+MAX_WINDOW_FACTOR = 8
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def token_event(event: str, text: str) -> str:
+    """`sse_event(event, {"token": text})` without building and walking a dict."""
+    return "event: " + event + '\ndata: {"token": ' + encode_basestring(text) + "}\n\n"
+
+
+class Coalescer:
+    """
+    Groups provider chunks from a queue into batches, so tokens become one
+    SSE frame per `window_s` (or per `max_bytes` of text) instead of one
+    frame each. A chunk arriving after a quiet spell is passed on at once;
+    only chunks that follow a frame within the window wait for the rest of
+    it. The window widens while sending frames takes longer than the window
+    (the client reads slowly) and narrows back once sends are quick again.
+
+    `window_s <= 0` disables batching beyond draining what is already
+    queued.
+    """
+    def __init__(self, window_s: float, max_bytes: int) -> None:
+        self.base_window_s = max(0.0, window_s)
+        self.window_s = self.base_window_s
+        self.max_bytes = max(1, max_bytes)
+        self._last_flush = 0.0
+
+    async def next_batch(self, queue: "asyncio.Queue[Any]") -> List[Any]:
+        """
+        Wait for the next chunk and return it with whatever else may join
+        its frame. A chunk that is not a dict (end of stream, error) ends
+        the batch.
+        """
+        first = await queue.get()
+        batch = [first]
+        if not isinstance(first, dict):
+            return batch
+        size = self._drain(queue, batch, _chunk_size(first))
+        loop = asyncio.get_running_loop()
+        if self.window_s > 0 and size < self.max_bytes and isinstance(batch[-1], dict):
+            wait = self._last_flush + self.window_s - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                self._drain(queue, batch, size)
+        self._last_flush = loop.time()
+        return batch
+
+    def _drain(self, queue: "asyncio.Queue[Any]", batch: List[Any], size: int) -> int:
+        while size < self.max_bytes and isinstance(batch[-1], dict) and not queue.empty():
+            item = queue.get_nowait()
+            batch.append(item)
+            if isinstance(item, dict):
+                size += _chunk_size(item)
+        return size
+
+    def sent(self, elapsed_s: float) -> None:
+        """Report how long writing the last frame took."""
+        if not self.base_window_s:
+            return
+        if elapsed_s > self.window_s:
+            self.window_s = min(self.window_s * 2, self.base_window_s * MAX_WINDOW_FACTOR)
+        elif self.window_s > self.base_window_s:
+            self.window_s = max(self.base_window_s, self.window_s * 0.75)
+
+
+def _chunk_size(chunk: Dict[str, Any]) -> int:
+    return len(chunk.get("content") or "") + len(chunk.get("thinking") or "")
@@ -1,238 +1,778 @@
 from __future__ import annotations
 
+import atexit
+import functools
 import json
+import logging
 import os
+import threading
 import time
-from dataclasses import dataclass, asdict
-from typing import List, Dict, Any, Optional
-from uuid import uuid4
+from collections import Counter
+from dataclasses import dataclass, field, replace
+from typing import BinaryIO, Collection, Iterable, List, Dict, Any, Optional, Tuple, Union
 
+from snlite.archive_store import ArchiveSegments, SegmentArchivesMixin
+from snlite.blobs import BlobStore, message_blob_keys
+from snlite.filelock import InterProcessLock
+from snlite.records import CHECKPOINT_EVERY, RecordCodec, check_record_format, decode_record, fingerprint, split_records
+from snlite.store_base import BaseSessionStore, DEFAULT_GROUP, DURABILITY_MODES, Session, WriteStats
 
-DEFAULT_GROUP = "未分组"
+logger = logging.getLogger(__name__)
 
-@dataclass
-class Session:
-    id: str
+# The sidecar is rewritten as a checkpoint (one row per session) once it has
+# at least this many superseded rows, and at least as many as live ones.
+INDEX_CHECKPOINT_ROWS = 1024
+
+
+class _CompactionSuperseded(Exception):
+    pass
+
+
+def _locked(fn):
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return fn(self, *args, **kwargs)
+    return wrapper
+
+
+def _reading(fn):
+    """Thread lock plus the shared file lock: no other process rewrites meanwhile."""
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        with self._lock, self._flock.shared():
+            return fn(self, *args, **kwargs)
+    return wrapper
+
+
+def _writing(fn):
+    """Thread lock plus the exclusive file lock."""
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        with self._lock, self._flock.exclusive():
+            return fn(self, *args, **kwargs)
+    return wrapper
+
+
+@dataclass(slots=True)
+class _IndexEntry:
+    """Where a session's records live, plus its listing fields."""
+    offset: int  # latest full snapshot
+    length: int
     title: str
     group: str
     created_at: float
     updated_at: float
-    messages: List[Dict[str, Any]]  # {role, content}
+    count: int = 0  # number of messages after replaying deltas
+    deltas: List[List[int]] = field(default_factory=list)  # [offset, length] after the snapshot
+    blobs: List[str] = field(default_factory=list)  # blob keys referenced; after deltas, also popped messages'
+    # fingerprints of the persisted messages; computed lazily, never written
+    fps: Optional[List[str]] = field(default=None, repr=False)
+
+    def locations(self) -> List[Tuple[int, int]]:
+        return [(self.offset, self.length)] + [(o, n) for o, n in self.deltas]
+
+    def end(self) -> int:
+        off, length = self.locations()[-1]
+        return off + length
+
+    def row(self, session_id: str) -> Dict[str, Any]:
+        return {
+            "id": session_id,
+            "offset": self.offset,
+            "length": self.length,
+            "title": self.title,
+            "group": self.group,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "count": self.count,
+            "deltas": self.deltas,
+            "blobs": self.blobs,
+        }
 
-class SessionStore:
+    def summary(self, session_id: str) -> Dict[str, Any]:
+        return {
+            "id": session_id,
+            "title": self.title,
+            "group": self.group,
+            "updated_at": self.updated_at,
+            "created_at": self.created_at,
+        }
+
+
+class _Batch:
+    """Log records queued for one append, with the events writers wait on."""
+    def __init__(self) -> None:
+        self.records: List[bytes] = []
+        self.rows: List[bytes] = []  # matching sidecar rows
+        self.size = 0
+        self.queued_at = 0.0
+        self.written = threading.Event()
+        self.durable = threading.Event()
+        self.error: Optional[BaseException] = None
+
+
+class SessionStore(SegmentArchivesMixin, RecordCodec, BaseSessionStore):
     """
     Lightweight JSONL store:
     - file: data/sessions.jsonl
-    - each line is a full session snapshot
-    - last snapshot wins
+    - a line is either a full session snapshot or a delta record (see
+      RecordCodec) applied on top of the latest snapshot of that session
+    - last snapshot wins; a new snapshot is written every CHECKPOINT_EVERY deltas
+
+    A sidecar `sessions.index.jsonl` maps each session id to the byte ranges
+    of its latest snapshot and following deltas together with the listing
+    fields, so `get_session` decodes only those lines and `list_sessions`
+    never reads messages. The sidecar is appended by `save_session`,
+    rewritten whenever the log is rewritten, and rebuilt from the log if it
+    does not match it. Bytes appended to the log by someone else are picked
+    up incrementally.
+
+    A rewritten sidecar is a checkpoint: a header row
+    (`{"checkpoint", "offset", "records", "sessions", "generation"}`)
+    followed by one row per session. It is rewritten that way whenever
+    most of its rows are superseded (INDEX_CHECKPOINT_ROWS), so startup
+    reads about one row per session and replays only the log tail past the
+    covered offset. An unterminated record at the end of the log can only
+    be left by a crashed append, since every append holds the exclusive
+    file lock; whoever next holds that lock truncates it, so later appends
+    do not run into it.
+
+    Rewrites go to a temp file that is fsynced and renamed over the log.
+    `compact` builds the new file without holding the store lock and only
+    blocks appends while it copies records written in the meantime and
+    swaps the file in. Public methods are thread-safe.
+
+    Archives are kept in compressed segments (see ArchiveSegments) and
+    repacked by `compact`. Large message meta values are kept once in
+    data/blobs (see BlobStore); each index entry lists the blob keys of its
+    session, which is what deletes and `compact` count references with.
+
+    Saves are group-committed: `save_session` updates the in-memory index
+    at once (offsets are assigned in queue order), queues the record and
+    waits. A writer thread appends everything queued meanwhile - plus
+    whatever arrives within `batch_window_ms`, if set - in a single write.
+    Anything that reads the log flushes the queue first. `durability` (see
+    DURABILITY_MODES) decides when the write is fsynced.
+
+    Several processes may share the data dir (see InterProcessLock on
+    `sessions.lock`): reads hold the shared lock, appends and rewrites the
+    exclusive one. A process holds the exclusive lock from the moment it
+    starts queueing a batch until the batch is written, so deltas are
+    always computed against the latest log. Rewrites bump the lock file's
+    generation, which makes the other processes reload the sidecar instead
+    of trusting their byte offsets.
     """
-    def __init__(self, data_dir: str) -> None:
+    def __init__(
+        self,
+        data_dir: str,
+        durability: Optional[str] = None,
+        batch_window_ms: float = 0.0,
+        record_format: Optional[str] = None,
+    ) -> None:
+        self.record_format = check_record_format(record_format or "json")
+        self.durability = durability or self.default_durability
+        if self.durability not in DURABILITY_MODES:
+            raise ValueError(f"unknown durability: {self.durability} (expected one of {', '.join(DURABILITY_MODES)})")
+        self.batch_window_s = max(0.0, batch_window_ms) / 1000
         self.data_dir = data_dir
         os.makedirs(self.data_dir, exist_ok=True)
         self.path = os.path.join(self.data_dir, "sessions.jsonl")
+        self.index_path = os.path.join(self.data_dir, "sessions.index.jsonl")
         self.archives_dir = os.path.join(self.data_dir, "archives")
-        os.makedirs(self.archives_dir, exist_ok=True)
         self.archive_index_path = os.path.join(self.data_dir, "archives.jsonl")
+        self._archives = ArchiveSegments(self.archives_dir, self.archive_index_path)
+        self.blobs = BlobStore(os.path.join(self.data_dir, "blobs"), fsync=self.durability != "none")
+
+        self._index: Dict[str, _IndexEntry] = {}
+        self._offset = 0  # bytes of sessions.jsonl covered by _index
+        self._file_key: Optional[Tuple[int, int]] = None  # (st_dev, st_ino)
+        self._record_count = 0
+        self._index_rows = 0  # rows in the sidecar file, including superseded ones
+        self._checkpoint_offset = 0  # log bytes covered by the sidecar when it was loaded
+        self._generation = 0  # of the log we indexed; see InterProcessLock
+        self._lock = threading.RLock()
+        self._flock = InterProcessLock(os.path.join(self.data_dir, "sessions.lock"))
+        self._batch = _Batch()
+        self._batch_locked = False  # exclusive file lock held for the queued batch
+        self._wakeup = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+        self._write_stats = WriteStats()
+        started = time.perf_counter()
+        with self._lock, self._flock.exclusive():
+            self._load_index()
+            self._maybe_checkpoint()
+        logger.info(
+            "session log: %d sessions, %d index rows, replayed %d bytes past the checkpoint in %.1f ms",
+            len(self._index), self._index_rows, self._offset - self._checkpoint_offset,
+            (time.perf_counter() - started) * 1000,
+        )
+        atexit.register(self.close)
+
+    # ---- sidecar index ----
+
+    def _index_row(self, session_id: str, entry: _IndexEntry) -> bytes:
+        return (json.dumps(entry.row(session_id), ensure_ascii=False) + "\n").encode("utf-8")
+
+    def _entry_for(self, session: Session, offset: int, length: int) -> _IndexEntry:
+        return _IndexEntry(
+            offset=offset,
+            length=length,
+            title=session.title,
+            group=session.group,
+            created_at=session.created_at,
+            updated_at=session.updated_at,
+            count=len(session.messages),
+        )
 
-    def _normalize_group(self, group: Optional[str]) -> str:
-        g = str(group or "").strip()
-        return g or DEFAULT_GROUP
-
-    def _load_all_snapshots(self) -> List[Dict[str, Any]]:
-        if not os.path.exists(self.path):
-            return []
-        out: List[Dict[str, Any]] = []
-        with open(self.path, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    out.append(json.loads(line))
-                except Exception:
-                    continue
-        return out
+    def _index_record(self, raw: Dict[str, Any], offset: int, length: int) -> Optional[str]:
+        """Fold one decoded log record into the in-memory index; returns its session id."""
+        if raw.get("op") == "delta":
+            sid = str(raw.get("id") or "")
+            entry = self._index.get(sid)
+            if not entry:
+                return None
+            pop = int(raw.get("pop") or 0)
+            entry.count = max(0, entry.count - pop) + len(raw.get("append") or [])
+            if "title" in raw:
+                entry.title = raw["title"]
+            if "group" in raw:
+                entry.group = self._normalize_group(raw["group"])
+            entry.updated_at = float(raw.get("updated_at", entry.updated_at))
+            entry.deltas.append([offset, length])
+            entry.blobs = list(dict.fromkeys(entry.blobs + message_blob_keys(raw.get("append") or [])))
+            entry.fps = None
+            return sid
+        sess = self._session_from_raw(raw)
+        entry = self._entry_for(sess, offset, length)
+        entry.blobs = message_blob_keys(sess.messages)
+        self._index[sess.id] = entry
+        return sess.id
+
+    def _load_index(self) -> None:
+        self._generation = self._flock.generation()
+        index: Dict[str, _IndexEntry] = {}
+        covered = 0
+        rows = 0
+        lines = 0
+        body = 0  # checkpoint rows still to read; their records are in the header's count
+        stale = False
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    lines += 1
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        row = None
+                    if isinstance(row, dict) and "checkpoint" in row:
+                        try:
+                            covered = int(row["offset"])
+                            rows = int(row["records"])
+                            body = int(row["sessions"])
+                            stale = int(row["generation"]) != self._generation
+                        except (KeyError, TypeError, ValueError):
+                            stale = True
+                        continue
+                    in_body = body > 0
+                    body -= in_body
+                    try:
+                        sid = row.pop("id")
+                        entry = _IndexEntry(**row)
+                    except Exception:
+                        continue
+                    prev = index.get(sid)
+                    if not in_body:
+                        if prev is not None and prev.offset == entry.offset:
+                            rows += len(entry.deltas) - len(prev.deltas)
+                        else:
+                            rows += 1 + len(entry.deltas)
+                    index[sid] = entry
+                    covered = max(covered, entry.end())
+
+        if stale or (covered and not self._index_matches_log(index, covered)):
+            logger.warning("sessions.index.jsonl does not match sessions.jsonl; rebuilding it from the log")
+            self._rebuild_index()
+            return
+
+        self._index = index
+        self._offset = covered
+        self._record_count = rows
+        self._index_rows = lines
+        self._checkpoint_offset = covered
+        self._file_key = self._stat_key()
+        self._refresh()
+
+    def _index_matches_log(self, index: Dict[str, _IndexEntry], covered: int) -> bool:
+        """Cheap consistency check: the furthest indexed line must decode to its id."""
+        try:
+            if os.path.getsize(self.path) < covered:
+                return False
+            if not index:
+                return True
+            sid, entry = max(index.items(), key=lambda kv: kv[1].end())
+            off, length = entry.locations()[-1]
+            with open(self.path, "rb") as f:
+                f.seek(off)
+                data = f.read(length)
+            return data.endswith(b"\n") and decode_record(data).get("id") == sid
+        except Exception:
+            return False
 
-    def _materialize(self) -> Dict[str, Session]:
-        snapshots = self._load_all_snapshots()
-        by_id: Dict[str, Session] = {}
-        for s in snapshots:
+    def _rebuild_index(self) -> None:
+        self._index = {}
+        self._offset = 0
+        self._record_count = 0
+        self._checkpoint_offset = 0
+        self._file_key = self._stat_key()
+        self._write_index_file()
+        self._refresh()
+
+    def _write_index_file(self) -> None:
+        """Rewrite the sidecar as a checkpoint of the index (only with the exclusive file lock)."""
+        if not self._flock.held_exclusive:
+            return  # left stale; it is checked against the log on load
+        header = {
+            "checkpoint": time.time(),
+            "offset": self._offset,
+            "records": self._record_count,
+            "sessions": len(self._index),
+            "generation": self._generation,
+        }
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write((json.dumps(header) + "\n").encode("utf-8"))
+            for sid, entry in self._index.items():
+                f.write(self._index_row(sid, entry))
+        os.replace(tmp, self.index_path)
+        self._index_rows = 1 + len(self._index)
+
+    def _maybe_checkpoint(self) -> None:
+        """Rewrite the sidecar once most of its rows are superseded (exclusive lock held)."""
+        live = len(self._index)
+        if self._index_rows - live >= max(INDEX_CHECKPOINT_ROWS, live):
+            self._write_index_file()
+
+    def _stat_key(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_dev, st.st_ino)
+
+    def _refresh(self) -> None:
+        """
+        Index records appended to sessions.jsonl by someone else.
+
+        A trailing line without a newline is left for the next call (it may
+        still be being written). If the file was replaced or shrank, the
+        index is rebuilt from the start; if another process rewrote it
+        (new generation), the sidecar it wrote is reloaded. Queued saves
+        are written first.
+        """
+        self._write_pending()
+        if self._flock.generation() != self._generation:
+            self._load_index()
+            return
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            if self._index:
+                self._index = {}
+                self._offset = 0
+                self._record_count = 0
+                self._write_index_file()
+            self._file_key = None
+            return
+
+        key = (st.st_dev, st.st_ino)
+        if key != self._file_key or st.st_size < self._offset:
+            self._file_key = key
+            if self._offset:
+                self._index = {}
+                self._offset = 0
+                self._record_count = 0
+                self._write_index_file()
+        if st.st_size == self._offset:
+            return
+
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read(st.st_size - self._offset)
+        records, used = split_records(data)
+        if used < len(data) and self._flock.held_exclusive:
+            self._truncate_torn(self._offset + used, len(data) - used)
+        if not used:
+            return
+
+        touched = self._scan(records, self._offset)
+        self._offset += used
+        if touched and self._flock.held_exclusive:
+            with open(self.index_path, "ab") as f:
+                f.write(b"".join(self._index_row(sid, self._index[sid]) for sid in touched))
+            self._index_rows += len(touched)
+            self._maybe_checkpoint()
+
+    def _truncate_torn(self, end: int, torn: int) -> None:
+        """
+        Cut an unterminated record off the end of the log (exclusive lock
+        held, so nobody is still writing it).
+        """
+        logger.warning(
+            "sessions.jsonl: removing %d bytes of an incomplete record at offset %d (interrupted write)",
+            torn, end,
+        )
+        os.truncate(self.path, end)
+
+    def _scan(self, records: List[bytes], base: int) -> Dict[str, None]:
+        """Index consecutive log records (see split_records), the first at byte `base`."""
+        touched: Dict[str, None] = {}
+        damaged: List[int] = []
+        pos = base
+        for line in records:
+            offset, pos = pos, pos + len(line)
+            if not line.strip():
+                continue
             try:
-                sess = Session(
-                    id=s["id"],
-                    title=s.get("title", "Untitled"),
-                    group=self._normalize_group(s.get("group")),
-                    created_at=float(s.get("created_at", time.time())),
-                    updated_at=float(s.get("updated_at", time.time())),
-                    messages=list(s.get("messages", [])),
-                )
-                by_id[sess.id] = sess
+                sid = self._index_record(decode_record(line), offset, len(line))
             except Exception:
+                damaged.append(offset)
                 continue
-        return by_id
+            if sid:
+                touched[sid] = None
+                self._record_count += 1
+        if damaged:
+            logger.warning(
+                "sessions.jsonl: skipped %d damaged records (first at offset %d)", len(damaged), damaged[0],
+            )
+        return touched
+
+    def _read_lines(self, entry: _IndexEntry, src: Optional[BinaryIO] = None) -> List[bytes]:
+        if src is None:
+            with open(self.path, "rb") as f:
+                return self._read_lines(entry, f)
+        out = []
+        for off, length in entry.locations():
+            src.seek(off)
+            out.append(src.read(length))
+        return out
+
+    def _load_session(self, entry: _IndexEntry, src: Optional[BinaryIO] = None) -> Optional[Session]:
+        try:
+            lines = self._read_lines(entry, src)
+            sess = self._session_from_raw(decode_record(lines[0]))
+            for line in lines[1:]:
+                self._apply_delta(sess, decode_record(line))
+        except Exception:
+            return None
+        self._hydrate(sess)
+        if entry.fps is None:
+            entry.fps = [fingerprint(m) for m in sess.messages]
+        return sess
+
+    def _write_records(
+        self, f: BinaryIO, records: Iterable[Tuple[str, List[bytes], _IndexEntry]],
+    ) -> Tuple[Dict[str, _IndexEntry], int, int]:
+        """
+        Write records (a snapshot followed by its deltas, per session) to
+        `f` from offset 0; returns the matching index, size and line count.
+        """
+        index: Dict[str, _IndexEntry] = {}
+        pos = 0
+        count = 0
+        for sid, lines, entry in records:
+            locations = []
+            for data in lines:
+                f.write(data)
+                locations.append([pos, len(data)])
+                pos += len(data)
+                count += 1
+            index[sid] = replace(
+                entry,
+                offset=locations[0][0],
+                length=locations[0][1],
+                deltas=locations[1:],
+            )
+        return index, pos, count
+
+    def _install(self, tmp: str, index: Dict[str, _IndexEntry], size: int, count: int) -> None:
+        os.replace(tmp, self.path)
+        self._index = index
+        self._offset = size
+        self._record_count = count
+        self._file_key = self._stat_key()
+        self._generation = self._flock.bump_generation()
+        self._write_index_file()
+
+    def _rewrite(self, records: Iterable[Tuple[str, List[bytes], _IndexEntry]]) -> None:
+        """
+        Atomically replace sessions.jsonl with the given records, in order,
+        and rewrite the sidecar to match.
+        """
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            index, size, count = self._write_records(f, records)
+            f.flush()
+            os.fsync(f.fileno())
+        self._install(tmp, index, size, count)
+
+    def _snapshot_record(self, sess: Session) -> Tuple[str, List[bytes], _IndexEntry]:
+        data, keys = self._encode(sess)
+        entry = self._entry_for(sess, 0, len(data))
+        entry.blobs = keys
+        entry.fps = [fingerprint(m) for m in sess.messages]
+        return (sess.id, [data], entry)
 
     def _write_all(self, sessions: List[Session]) -> None:
-        with open(self.path, "w", encoding="utf-8") as f:
-            for sess in sessions:
-                f.write(json.dumps(asdict(sess), ensure_ascii=False) + "\n")
+        self._rewrite([self._snapshot_record(sess) for sess in sessions])
+
+    def _live_records(
+        self,
+        exclude: Collection[str] = (),
+        merge: bool = False,
+        entries: Optional[List[Tuple[str, _IndexEntry]]] = None,
+        src: Optional[BinaryIO] = None,
+    ) -> Iterable[Tuple[str, List[bytes], _IndexEntry]]:
+        """
+        Records of every live session, oldest first. Lines are copied without
+        decoding unless `merge` folds a session's deltas into one snapshot.
+        """
+        if entries is None:
+            entries = sorted(self._index.items(), key=lambda kv: kv[1].updated_at)
+        for sid, entry in entries:
+            if sid in exclude:
+                continue
+            if merge and entry.deltas:
+                sess = self._load_session(entry, src)
+                if sess:
+                    yield self._snapshot_record(sess)
+                    continue
+            yield (sid, self._read_lines(entry, src), entry)
 
-    def list_sessions(self) -> List[Dict[str, Any]]:
-        by_id = self._materialize()
-        items = sorted(by_id.values(), key=lambda x: x.updated_at, reverse=True)
-        return [
-            {
-                "id": s.id,
-                "title": s.title,
-                "group": s.group,
-                "updated_at": s.updated_at,
-                "created_at": s.created_at,
-            }
-            for s in items
-        ]
+    # ---- sessions ----
 
-    def get_session(self, session_id: str) -> Optional[Session]:
-        by_id = self._materialize()
-        return by_id.get(session_id)
-
-    def create_session(self, title: str = "New Chat", group: str = DEFAULT_GROUP) -> Session:
-        now = time.time()
-        sess = Session(
-            id=uuid4().hex,
-            title=title,
-            group=self._normalize_group(group),
-            created_at=now,
-            updated_at=now,
-            messages=[],
-        )
-        self.save_session(sess)
-        return sess
+    def _refresh_index(self) -> None:
+        """
+        `_refresh` for callers that only need the index: while saves are
+        queued, foreign appends are picked up when the queue is written.
+        """
+        if not self._batch.records:
+            self._refresh()
 
-    def save_session(self, session: Session) -> None:
-        session.updated_at = time.time()
-        line = json.dumps(asdict(session), ensure_ascii=False)
-        with open(self.path, "a", encoding="utf-8") as f:
-            f.write(line + "\n")
-
-    def rename_session(self, session_id: str, title: str) -> Optional[Session]:
-        sess = self.get_session(session_id)
-        if not sess:
-            return None
-        sess.title = title
-        self.save_session(sess)
-        return sess
+    @_reading
+    def list_sessions(self) -> List[Dict[str, Any]]:
+        self._refresh_index()
+        items = sorted(self._index.items(), key=lambda kv: kv[1].updated_at, reverse=True)
+        return [entry.summary(sid) for sid, entry in items]
 
-    def set_session_group(self, session_id: str, group: str) -> Optional[Session]:
-        sess = self.get_session(session_id)
-        if not sess:
+    @_reading
+    def get_session(self, session_id: str) -> Optional[Session]:
+        self._refresh()
+        entry = self._index.get(session_id)
+        if not entry:
             return None
-        sess.group = self._normalize_group(group)
-        self.save_session(sess)
-        return sess
+        return self._load_session(entry)
 
-    def _build_archive_text(self, sess: Session, archived_at: float) -> str:
-        lines = [
-            f"# {sess.title}",
-            "",
-            f"会话ID: {sess.id}",
-            f"分组: {sess.group}",
-            f"创建时间戳: {sess.created_at}",
-            f"归档时间戳: {archived_at}",
-            "",
-            "---",
-            "",
-        ]
-        for m in sess.messages:
-            role = m.get("role", "unknown")
-            content = m.get("content", "")
-            lines.append(f"[{role}]")
-            lines.append(content)
-            lines.append("")
-        return "\n".join(lines).strip() + "\n"
-
-    def _append_archive_index(self, archive: Dict[str, Any]) -> None:
-        with open(self.archive_index_path, "a", encoding="utf-8") as f:
-            f.write(json.dumps(archive, ensure_ascii=False) + "\n")
-
-    def list_archives(self) -> List[Dict[str, Any]]:
-        if not os.path.exists(self.archive_index_path):
-            return []
-        out: Dict[str, Dict[str, Any]] = {}
-        with open(self.archive_index_path, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    row = json.loads(line)
-                except Exception:
-                    continue
-                archive_id = str(row.get("archive_id") or "").strip()
-                if not archive_id:
-                    continue
-                out[archive_id] = row
-        rows = list(out.values())
-        rows.sort(key=lambda x: float(x.get("archived_at", 0)), reverse=True)
-        return rows
-
-    def get_archive(self, archive_id: str) -> Optional[Dict[str, Any]]:
-        rows = self.list_archives()
-        item = next((x for x in rows if x.get("archive_id") == archive_id), None)
-        if not item:
+    def _delta_for(self, session: Session, entry: _IndexEntry) -> Optional[Dict[str, Any]]:
+        if len(entry.deltas) >= CHECKPOINT_EVERY:
             return None
-        file_path = item.get("file_path") or ""
-        if not file_path or not os.path.exists(file_path):
+        if entry.fps is None and not self._load_session(entry):
             return None
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        return {**item, "content": content}
-
-    def delete_archive(self, archive_id: str) -> bool:
-        rows = self.list_archives()
-        target = next((x for x in rows if x.get("archive_id") == archive_id), None)
-        if not target:
-            return False
+        return self._make_delta(session, entry.fps or [], entry.title, entry.group)
 
-        file_path = str(target.get("file_path") or "").strip()
-        if file_path and os.path.exists(file_path):
+    def save_session(self, session: Session) -> None:
+        self._save_sessions([session])
+
+    def _save_sessions(self, sessions: List[Session]) -> None:
+        """Queue a record per session into the same batch and wait for it."""
+        batch = None
+        with self._lock:
+            self._hold_for_batch()
             try:
-                os.remove(file_path)
-            except OSError:
-                pass
-
-        kept = [x for x in rows if x.get("archive_id") != archive_id]
-        with open(self.archive_index_path, "w", encoding="utf-8") as f:
-            for row in kept:
-                f.write(json.dumps(row, ensure_ascii=False) + "\n")
-        return True
+                for session in sessions:
+                    session.updated_at = time.time()
+                    entry = self._index.get(session.id)
+                    delta = self._delta_for(session, entry) if entry else None
+                    if delta is None:
+                        data, keys = self._encode(session)
+                    else:
+                        data, keys = self._encode_delta(delta)
+                    batch = self._queue_record(session, data, delta, keys)
+            finally:
+                self._release_batch_lock()
+            for session in sessions:
+                self._search_saved(session)
+        if batch is not None:
+            self._wait(batch)
+
+    def _queue_record(
+        self, session: Session, data: bytes, delta: Optional[Dict[str, Any]], keys: List[str],
+    ) -> _Batch:
+        """
+        Index a snapshot (delta None) or delta record of `session`, whose
+        messages reference blob `keys`, and queue it.
+        """
+        start = self._offset
+        entry = self._index.get(session.id)
+        if delta is None:
+            entry = self._entry_for(session, start, len(data))
+            entry.fps = [fingerprint(m) for m in session.messages]
+            entry.blobs = keys
+            self._index[session.id] = entry
+        else:
+            assert entry is not None and entry.fps is not None
+            entry.fps = self._apply_fps(entry.fps, delta)
+            entry.count = len(entry.fps)
+            entry.title = session.title
+            entry.group = session.group
+            entry.updated_at = session.updated_at
+            entry.deltas.append([start, len(data)])
+            entry.blobs = list(dict.fromkeys(entry.blobs + keys))
+        self._offset = start + len(data)
+        self._record_count += 1
+        return self._enqueue(data, self._index_row(session.id, entry))
+
+    def _import_sessions(self, sessions: List[Session]) -> None:
+        with self._lock:
+            self._hold_for_batch()
+            batch = None
+            try:
+                for sess in sessions:
+                    data, keys = self._encode(sess)
+                    batch = self._queue_record(sess, data, None, keys)
+            finally:
+                self._release_batch_lock()
+        if batch is not None:
+            self._wait(batch)
 
-    def archive_session(self, session_id: str) -> Optional[Dict[str, Any]]:
-        sess = self.get_session(session_id)
-        if not sess:
-            return None
+    # ---- group commit ----
 
-        archived_at = time.time()
-        archive_id = uuid4().hex
-        filename = f"archive_{int(archived_at)}_{session_id}.txt"
-        file_path = os.path.join(self.archives_dir, filename)
-        content = self._build_archive_text(sess, archived_at)
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(content)
-
-        archive_meta = {
-            "archive_id": archive_id,
-            "session_id": sess.id,
-            "title": sess.title,
-            "group": sess.group,
-            "archived_at": archived_at,
-            "created_at": sess.created_at,
-            "message_count": len(sess.messages),
-            "file_path": file_path,
-            "file_name": filename,
+    def _hold_for_batch(self) -> None:
+        """
+        Take the exclusive file lock for the batch about to be queued; it is
+        released once `_write_pending` has written the batch. The first
+        record of a batch refreshes the index under it, so no other process
+        appends between computing a delta and writing it.
+        """
+        if not self._batch_locked:
+            self._flock.acquire(exclusive=True)
+            self._batch_locked = True
+            self._refresh()
+
+    def _release_batch_lock(self) -> None:
+        """Drop the batch's file lock once nothing is queued (lock held)."""
+        if self._batch_locked and not self._batch.records:
+            self._batch_locked = False
+            self._flock.release()
+
+    def _enqueue(self, data: bytes, row: bytes) -> _Batch:
+        batch = self._batch
+        if not batch.records:
+            batch.queued_at = time.perf_counter()
+        batch.records.append(data)
+        batch.rows.append(row)
+        batch.size += len(data)
+        if self._writer is None or not self._writer.is_alive():
+            self._writer = threading.Thread(target=self._writer_loop, name="snlite-store-writer", daemon=True)
+            self._writer.start()
+        self._wakeup.set()
+        return batch
+
+    def _writer_loop(self) -> None:
+        while True:
+            self._wakeup.wait()
+            if self.batch_window_s:
+                time.sleep(self.batch_window_s)
+            self._wakeup.clear()
+            try:
+                with self._lock:
+                    self._write_pending()
+            except Exception:
+                logger.exception("session store write failed")
+
+    def _wait(self, batch: _Batch) -> None:
+        event = batch.durable if self.durability == "always-fsync" else batch.written
+        while not event.wait(self.batch_window_s * 4 + 0.05):
+            # writer is slow or blocked (e.g. this thread holds the lock): write it ourselves
+            with self._lock:
+                self._write_pending()
+        if batch.error is not None:
+            raise batch.error
+
+    def _write_pending(self) -> None:
+        """Append the queued batch to the log in one write (lock held)."""
+        batch = self._batch
+        if not batch.records:
+            return
+        self._batch = _Batch()
+        try:
+            self._append_batch(batch)
+        finally:
+            self._release_batch_lock()
+
+    def _append_batch(self, batch: _Batch) -> None:
+        expected = self._offset - batch.size
+        started = time.perf_counter()
+        try:
+            with open(self.path, "ab") as f:
+                start = f.tell()
+                f.write(b"".join(batch.records))
+                if self.durability != "none":
+                    f.flush()
+                    if self.durability == "batch-fsync":
+                        batch.written.set()
+                    os.fsync(f.fileno())
+        except BaseException as e:
+            batch.error = e
+            batch.written.set()
+            batch.durable.set()
+            # the index is ahead of the log now
+            self._rebuild_index()
+            raise
+        self._write_stats.record(
+            len(batch.records), batch.size, time.perf_counter() - started,
+            started - batch.queued_at, self.durability != "none",
+        )
+        if self._file_key is None or start != expected:
+            # someone appended without the lock; let the tail scan index it
+            self._offset = expected
+            self._record_count -= len(batch.records)
+            self._refresh()
+        else:
+            with open(self.index_path, "ab") as f:
+                f.write(b"".join(batch.rows))
+            self._index_rows += len(batch.rows)
+            self._maybe_checkpoint()
+        batch.written.set()
+        batch.durable.set()
+
+    def write_stats(self) -> Dict[str, Any]:
+        return {
+            "durability": self.durability,
+            "batch_window_ms": self.batch_window_s * 1000,
+            "queued": len(self._batch.records),
+            **self._write_stats.snapshot(),
         }
-        self._append_archive_index(archive_meta)
-        self.delete_session(session_id)
-        return archive_meta
 
+    @_locked
+    def close(self) -> None:
+        self._write_pending()
+
+    # ---- blobs ----
+
+    def _blob_refs(self) -> Counter:
+        """How many sessions reference each blob key."""
+        return Counter(key for entry in self._index.values() for key in entry.blobs)
+
+    def _release_blobs(self, entries: Iterable[_IndexEntry]) -> None:
+        """Delete the blobs of removed `entries` that are no longer referenced (exclusive lock held)."""
+        keys = [key for entry in entries for key in entry.blobs]
+        if keys:
+            self.blobs.release(keys, self._blob_refs())
+
+    @_writing
     def delete_session(self, session_id: str) -> bool:
         """
         Hard delete all snapshots for a session from JSONL.
@@ -241,83 +781,38 @@ class SessionStore:
         `sessions.jsonl` file, which can otherwise happen with tombstone-only
         deletion.
         """
-        snapshots = self._load_all_snapshots()
-        if not snapshots:
-            return False
-
-        kept: List[Dict[str, Any]] = []
-        found = False
-        for raw in snapshots:
-            if str(raw.get("id")) == session_id:
-                found = True
-                continue
-            kept.append(raw)
-
-        if not found:
+        self._refresh()
+        entry = self._index.get(session_id)
+        if entry is None:
             return False
-
-        with open(self.path, "w", encoding="utf-8") as f:
-            for raw in kept:
-                f.write(json.dumps(raw, ensure_ascii=False) + "\n")
+        self._rewrite(self._live_records(exclude={session_id}))
+        self._release_blobs([entry])
+        self._search_session_deleted(session_id)
         return True
 
-    def export_markdown(self, session_id: str) -> Optional[str]:
-        sess = self.get_session(session_id)
-        if not sess:
-            return None
-        # If deleted
-        if sess.title == "__deleted__":
-            return None
-        lines = [f"# {sess.title}", ""]
-        for m in sess.messages:
-            role = m.get("role", "")
-            content = m.get("content", "")
-            if role == "user":
-                lines.append(f"## User\n\n{content}\n")
-            elif role == "assistant":
-                lines.append(f"## Assistant\n\n{content}\n")
-            elif role == "system":
-                lines.append(f"## System\n\n{content}\n")
-            else:
-                lines.append(f"## {role}\n\n{content}\n")
-        return "\n".join(lines)
-
-    def export_all(self) -> Dict[str, Any]:
-        by_id = self._materialize()
-        items = [asdict(s) for s in sorted(by_id.values(), key=lambda x: x.updated_at, reverse=True) if s.title != "__deleted__"]
-        return {
-            "format": "snlite.sessions.backup.v1",
-            "exported_at": time.time(),
-            "count": len(items),
-            "sessions": items,
-        }
-
+    @_writing
+    def delete_sessions(self, session_ids: Iterable[str]) -> int:
+        self._refresh()
+        doomed = {sid for sid in session_ids if sid in self._index}
+        if doomed:
+            entries = [self._index[sid] for sid in doomed]
+            self._rewrite(self._live_records(exclude=doomed))
+            self._release_blobs(entries)
+            for sid in doomed:
+                self._search_session_deleted(sid)
+        return len(doomed)
+
+    @_writing
     def import_all(self, sessions: List[Dict[str, Any]], mode: str = "append") -> Dict[str, int]:
         if mode not in ("append", "replace"):
             raise ValueError("mode must be append or replace")
 
-        existing = self._materialize()
+        self._refresh()
+        previous = list(self._index.values())
+        existing: Dict[str, Union[Session, _IndexEntry]] = dict(self._index)
         imported = 0
         skipped = 0
 
-        def _to_session(raw: Dict[str, Any]) -> Optional[Session]:
-            try:
-                sid = str(raw.get("id") or "").strip() or uuid4().hex
-                title = str(raw.get("title") or "New Chat").strip() or "New Chat"
-                group = self._normalize_group(raw.get("group"))
-                created_at = float(raw.get("created_at") or time.time())
-                updated_at = float(raw.get("updated_at") or created_at)
-                messages = raw.get("messages") or []
-                if not isinstance(messages, list):
-                    messages = []
-                normalized = []
-                for m in messages:
-                    if isinstance(m, dict) and "role" in m and "content" in m:
-                        normalized.append(m)
-                return Session(id=sid, title=title, group=group, created_at=created_at, updated_at=updated_at, messages=normalized)
-            except Exception:
-                return None
-
         if mode == "replace":
             existing = {}
 
@@ -325,7 +820,7 @@ class SessionStore:
             if not isinstance(raw, dict):
                 skipped += 1
                 continue
-            sess = _to_session(raw)
+            sess = self._session_from_import(raw)
             if not sess:
                 skipped += 1
                 continue
@@ -337,14 +832,141 @@ class SessionStore:
             existing[sess.id] = sess
             imported += 1
 
-        out = sorted(existing.values(), key=lambda x: x.updated_at)
-        self._write_all(out)
-        return {"imported": imported, "skipped": skipped, "total": len(out)}
+        records = []
+        for sid, item in sorted(existing.items(), key=lambda kv: kv[1].updated_at):
+            if isinstance(item, Session):
+                records.append(self._snapshot_record(item))
+            else:
+                records.append((sid, self._read_lines(item), item))
+        self._rewrite(records)
+        self._release_blobs(previous)
+        self._search_resync()
+        return {"imported": imported, "skipped": skipped, "total": len(records)}
+
+    @_reading
+    def garbage_stats(self) -> Dict[str, int]:
+        self._refresh()
+        live_bytes = 0
+        live_records = 0
+        for entry in self._index.values():
+            for _, length in entry.locations():
+                live_bytes += length
+                live_records += 1
+        archives = self._archives.stats()
+        archive_live = archives["archive_bytes"] - archives["archive_dead_bytes"]
+        blobs = self.blobs.stats(self._blob_refs())
+        blob_live = blobs["blob_bytes"] - blobs["blob_dead_bytes"]
+        return {
+            "total_bytes": self._offset + archives["archive_bytes"] + blobs["blob_bytes"],
+            "live_bytes": live_bytes + archive_live + blob_live,
+            "dead_bytes": max(0, self._offset - live_bytes) + archives["archive_dead_bytes"] + blobs["blob_dead_bytes"],
+            "records": self._record_count,
+            "live_records": live_records,
+            "dead_records": max(0, self._record_count - live_records),
+            "sessions": len(self._index),
+            **archives,
+            **blobs,
+        }
 
     def compact(self) -> Dict[str, int]:
-        snapshots = self._load_all_snapshots()
-        before = len(snapshots)
-        by_id = self._materialize()
-        ordered = sorted(by_id.values(), key=lambda x: x.updated_at)
-        self._write_all(ordered)
-        return {"before": before, "after": len(ordered), "saved": max(0, before - len(ordered))}
+        """
+        Rewrite the session log (see `_compact_log`), repack archive
+        segments and remove blobs that no session references.
+        """
+        stats = self._compact_log()
+        with self._lock, self._flock.exclusive():
+            repacked = self._archives.repack()
+            self._refresh()
+            blobs_removed = self.blobs.sweep(self._blob_refs())
+        return {
+            **stats,
+            "archives_moved": repacked["moved"],
+            "archive_segments_removed": repacked["segments_removed"],
+            "archive_files_removed": repacked["legacy_removed"],
+            "blobs_removed": blobs_removed,
+        }
+
+    def _compact_log(self) -> Dict[str, int]:
+        """
+        Rewrite the log with one snapshot per live session.
+
+        The new file is written from a point-in-time copy of the index while
+        appends continue; records appended meanwhile are copied over and
+        indexed under the lock right before the atomic rename. If the log
+        was rewritten by someone else in the meantime, nothing is replaced.
+        """
+        with self._lock, self._flock.shared():
+            self._refresh()
+            before = self._record_count
+            generation = self._generation
+            covered = self._offset
+            entries = sorted(
+                ((sid, replace(e, deltas=list(e.deltas))) for sid, e in self._index.items()),
+                key=lambda kv: kv[1].updated_at,
+            )
+            try:
+                src = open(self.path, "rb")
+            except FileNotFoundError:
+                return {"before": 0, "after": 0, "saved": 0}
+
+        tmp = self.path + ".compact"
+        try:
+            with src, open(tmp, "wb") as out:
+                index, size, count = self._write_records(out, self._live_records(merge=True, entries=entries, src=src))
+                after = count
+                with self._lock, self._flock.exclusive():
+                    self._refresh()
+                    if self._generation != generation:
+                        raise _CompactionSuperseded()
+                    src.seek(covered)
+                    tail = src.read(self._offset - covered)
+                    out.write(tail)
+                    out.flush()
+                    os.fsync(out.fileno())
+                    os.replace(tmp, self.path)
+                    self._index = index
+                    self._record_count = count
+                    self._scan(split_records(tail)[0], size)
+                    self._offset = size + len(tail)
+                    self._file_key = self._stat_key()
+                    self._generation = self._flock.bump_generation()
+                    self._write_index_file()
+        except _CompactionSuperseded:
+            os.remove(tmp)
+            return {"before": before, "after": before, "saved": 0}
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return {"before": before, "after": after, "saved": max(0, before - after)}
+
+
+STORE_BACKENDS = ("jsonl", "sqlite", "sharded")
+
+
+def open_store(data_dir: str, backend: Optional[str] = None) -> BaseSessionStore:
+    """
+    Create the session store selected by `backend` or SNLITE_STORE
+    (jsonl | sqlite | sharded, default jsonl), with SNLITE_STORE_DURABILITY
+    (default: the backend's `default_durability`), SNLITE_STORE_BATCH_MS and SNLITE_STORE_FORMAT (json | msgpack, for the
+    log-based backends) applied.
+    """
+    name = (backend or os.getenv("SNLITE_STORE") or "jsonl").strip().lower()
+    durability = (os.getenv("SNLITE_STORE_DURABILITY") or "").strip().lower() or None
+    record_format = (os.getenv("SNLITE_STORE_FORMAT") or "").strip().lower() or None
+    if name == "jsonl":
+        return SessionStore(
+            data_dir,
+            durability=durability,
+            batch_window_ms=float(os.getenv("SNLITE_STORE_BATCH_MS", "0")),
+            record_format=record_format,
+        )
+    if name == "sqlite":
+        from snlite.sqlite_store import SqliteSessionStore
+
+        return SqliteSessionStore(data_dir, durability=durability)
+    if name == "sharded":
+        from snlite.sharded_store import ShardedSessionStore
+
+        return ShardedSessionStore(data_dir, durability=durability, record_format=record_format)
+    raise ValueError(f"unknown SNLITE_STORE: {name} (expected one of {', '.join(STORE_BACKENDS)})")
@@ -0,0 +1,717 @@
+from __future__ import annotations
+
+import base64
+import json
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from uuid import uuid4
+
+if TYPE_CHECKING:
+    from snlite.search import SearchIndex
+
+
+DEFAULT_GROUP = "未分组"
+
+# Saves always return after their data is written. none: never fsync;
+# batch-fsync: fsync once per write batch, after the savers are released;
+# always-fsync: savers return only after the fsync.
+DURABILITY_MODES = ("none", "batch-fsync", "always-fsync")
+
+# Operations accepted by BaseSessionStore.bulk
+BULK_OPS = ("rename", "set_group", "merge_groups", "archive", "delete")
+
+@dataclass(slots=True)
+class Session:
+    id: str
+    title: str
+    group: str
+    created_at: float
+    updated_at: float
+    messages: List[Dict[str, Any]]  # {role, content}
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Shallow dict for serializing (unlike `asdict`, messages are not deep-copied)."""
+        return {
+            "id": self.id,
+            "title": self.title,
+            "group": self.group,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "messages": self.messages,
+        }
+
+
+def intern_roles(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Share one string object per role across decoded messages (in place);
+    a long session otherwise holds a separate "assistant" per message.
+    """
+    for m in messages:
+        role = m.get("role") if isinstance(m, dict) else None
+        if type(role) is str:
+            m["role"] = sys.intern(role)
+    return messages
+
+
+def encode_cursor(updated_at: float, session_id: str) -> str:
+    raw = json.dumps([updated_at, session_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        updated_at, session_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return float(updated_at), str(session_id)
+    except Exception:
+        raise ValueError("invalid cursor")
+
+
+class WriteStats:
+    """
+    Counters for store writes. A write may carry several records (a group
+    commit batch); `wait` is how long the oldest record in it was queued.
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.writes = 0
+        self.records = 0
+        self.bytes = 0
+        self.max_batch = 0
+        self.write_ms_total = 0.0
+        self.write_ms_max = 0.0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.fsyncs = 0
+
+    def record(self, records: int, nbytes: int, write_s: float, wait_s: float = 0.0, fsynced: bool = False) -> None:
+        write_ms = write_s * 1000
+        wait_ms = wait_s * 1000
+        with self._lock:
+            self.writes += 1
+            self.records += records
+            self.bytes += nbytes
+            self.max_batch = max(self.max_batch, records)
+            self.write_ms_total += write_ms
+            self.write_ms_max = max(self.write_ms_max, write_ms)
+            self.wait_ms_total += wait_ms
+            self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+            self.fsyncs += int(fsynced)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            n = self.writes or 1
+            return {
+                "writes": self.writes,
+                "records": self.records,
+                "bytes": self.bytes,
+                "avg_batch": round(self.records / n, 2),
+                "max_batch": self.max_batch,
+                "avg_write_ms": round(self.write_ms_total / n, 3),
+                "max_write_ms": round(self.write_ms_max, 3),
+                "avg_wait_ms": round(self.wait_ms_total / n, 3),
+                "max_wait_ms": round(self.wait_ms_max, 3),
+                "fsyncs": self.fsyncs,
+            }
+
+
+def _summary_matches(s: Dict[str, Any], title_prefix: str, query: str) -> bool:
+    title = str(s.get("title") or "").lower()
+    if title_prefix and not title.startswith(title_prefix):
+        return False
+    if query and query not in title and query not in str(s.get("group") or "").lower():
+        return False
+    return True
+
+
+class SessionImporter:
+    """
+    Incremental import into `store` with `import_all` semantics. Feed backup
+    sessions to `add`; when it returns True, call `flush` to write the
+    pending batch. `finish` writes the rest and, in "replace" mode, deletes
+    sessions that were not in the backup.
+    """
+    def __init__(self, store: "BaseSessionStore", mode: str, batch_size: int) -> None:
+        if mode not in ("append", "replace"):
+            raise ValueError("mode must be append or replace")
+        self.store = store
+        self.mode = mode
+        self.batch_size = batch_size
+        self._known = {s["id"]: s["updated_at"] for s in store.list_sessions()}
+        self._seen: Set[str] = set()
+        self._pending: List[Session] = []
+        self.imported = 0
+        self.skipped = 0
+
+    def add(self, raw: Any) -> bool:
+        sess = self.store._session_from_import(raw) if isinstance(raw, dict) else None
+        if not sess:
+            self.skipped += 1
+            return False
+        prev = self._known.get(sess.id)
+        if self.mode == "append" and prev is not None and prev > sess.updated_at:
+            self.skipped += 1
+            return False
+        if self.mode == "replace" and sess.id in self._seen and prev is not None and prev > sess.updated_at:
+            self.skipped += 1
+            return False
+        self._known[sess.id] = sess.updated_at
+        self._seen.add(sess.id)
+        self._pending.append(sess)
+        self.imported += 1
+        return len(self._pending) >= self.batch_size
+
+    def flush(self) -> None:
+        if self._pending:
+            batch, self._pending = self._pending, []
+            self.store._import_sessions(batch)
+
+    def finish(self) -> Dict[str, int]:
+        self.flush()
+        if self.mode == "replace":
+            stale = [sid for sid in self._known if sid not in self._seen]
+            self.store.delete_sessions(stale)
+            for sid in stale:
+                del self._known[sid]
+        self.store._search_resync()
+        return {"imported": self.imported, "skipped": self.skipped, "total": len(self._known)}
+
+
+class BaseSessionStore(ABC):
+    """
+    Storage interface used by the web app. Backends implement persistence of
+    sessions and archives; title/group edits, archive text and markdown
+    export are shared here.
+
+    Backends report content changes through the `_search_*` hooks so an
+    attached SearchIndex stays current without rescanning the store.
+    """
+
+    search: Optional["SearchIndex"] = None
+    # Used when no durability (DURABILITY_MODES) is configured
+    default_durability = "none"
+
+    def _normalize_group(self, group: Optional[str]) -> str:
+        g = str(group or "").strip()
+        return g or DEFAULT_GROUP
+
+    # ---- sessions ----
+
+    @abstractmethod
+    def list_sessions(self) -> List[Dict[str, Any]]:
+        """
+        Session summaries (id/title/group/updated_at/created_at), newest first.
+        """
+        ...
+
+    def list_sessions_page(
+        self,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        group: Optional[str] = None,
+        title_prefix: Optional[str] = None,
+        query: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        One page of session summaries ordered by (updated_at, id) descending.
+
+        `cursor` is the `next_cursor` of the previous page. `group` filters
+        exactly, `title_prefix` and `query` (substring of title or group)
+        case-insensitively. `groups` counts the sessions matching the text
+        filters per group, ignoring `group`, so a sidebar can show them all.
+        Raises ValueError on a malformed cursor.
+        """
+        after = decode_cursor(cursor) if cursor else None
+        prefix = (title_prefix or "").strip().lower()
+        q = (query or "").strip().lower()
+
+        groups: Dict[str, int] = {}
+        matched: List[Dict[str, Any]] = []
+        for s in self.list_sessions():
+            if s.get("title") == "__deleted__" or not _summary_matches(s, prefix, q):
+                continue
+            groups[s["group"]] = groups.get(s["group"], 0) + 1
+            if group is not None and s["group"] != group:
+                continue
+            matched.append(s)
+
+        matched.sort(key=lambda s: (s["updated_at"], s["id"]), reverse=True)
+        if after:
+            matched = [s for s in matched if (s["updated_at"], s["id"]) < after]
+        items = matched[:limit]
+        next_cursor = None
+        if len(matched) > limit:
+            next_cursor = encode_cursor(items[-1]["updated_at"], items[-1]["id"])
+        return {"items": items, "next_cursor": next_cursor, "groups": groups}
+
+    @abstractmethod
+    def get_session(self, session_id: str) -> Optional[Session]:
+        ...
+
+    def get_session_window(
+        self, session_id: str, limit: int, before: Optional[int] = None,
+    ) -> Optional[Tuple[Session, int, int]]:
+        """
+        The session with `messages` cut down to at most `limit` messages
+        ending right before index `before` (default: the end), plus the total
+        message count and the index of the first returned message.
+        """
+        sess = self.get_session(session_id)
+        if not sess:
+            return None
+        total = len(sess.messages)
+        end = total if before is None else max(0, min(before, total))
+        start = max(0, end - limit)
+        sess.messages = sess.messages[start:end]
+        return sess, total, start
+
+    @abstractmethod
+    def save_session(self, session: Session) -> None:
+        """
+        Persist `session` and bump its updated_at.
+        """
+        ...
+
+    @abstractmethod
+    def delete_session(self, session_id: str) -> bool:
+        """
+        Hard delete; the session content must not remain in storage.
+        """
+        ...
+
+    def delete_sessions(self, session_ids: Iterable[str]) -> int:
+        """
+        Hard delete several sessions; returns how many existed.
+        """
+        return sum(1 for sid in set(session_ids) if self.delete_session(sid))
+
+    def _save_sessions(self, sessions: List[Session]) -> None:
+        """
+        `save_session` for several sessions; backends that can write them
+        together override this.
+        """
+        for sess in sessions:
+            self.save_session(sess)
+
+    def create_session(self, title: str = "New Chat", group: str = DEFAULT_GROUP) -> Session:
+        now = time.time()
+        sess = Session(
+            id=uuid4().hex,
+            title=title,
+            group=self._normalize_group(group),
+            created_at=now,
+            updated_at=now,
+            messages=[],
+        )
+        self.save_session(sess)
+        return sess
+
+    def rename_session(self, session_id: str, title: str) -> Optional[Session]:
+        sess = self.get_session(session_id)
+        if not sess:
+            return None
+        sess.title = title
+        self.save_session(sess)
+        return sess
+
+    def set_session_group(self, session_id: str, group: str) -> Optional[Session]:
+        sess = self.get_session(session_id)
+        if not sess:
+            return None
+        sess.group = self._normalize_group(group)
+        self.save_session(sess)
+        return sess
+
+    # ---- archives ----
+
+    @abstractmethod
+    def list_archives(self) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def get_archive(self, archive_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Archive metadata plus its text under "content".
+        """
+        ...
+
+    @abstractmethod
+    def delete_archive(self, archive_id: str) -> bool:
+        ...
+
+    @abstractmethod
+    def _put_archive(self, archive_meta: Dict[str, Any], content: str) -> Dict[str, Any]:
+        """
+        Store archive text; returns the metadata as it will be listed.
+        """
+        ...
+
+    def _build_archive_text(self, sess: Session, archived_at: float) -> str:
+        lines = [
+            f"# {sess.title}",
+            "",
+            f"会话ID: {sess.id}",
+            f"分组: {sess.group}",
+            f"创建时间戳: {sess.created_at}",
+            f"归档时间戳: {archived_at}",
+            "",
+            "---",
+            "",
+        ]
+        for m in sess.messages:
+            role = m.get("role", "unknown")
+            content = m.get("content", "")
+            lines.append(f"[{role}]")
+            lines.append(content)
+            lines.append("")
+        return "\n".join(lines).strip() + "\n"
+
+    def _put_archives(self, items: List[Tuple[Dict[str, Any], str]]) -> List[Dict[str, Any]]:
+        """
+        `_put_archive` for several (metadata, text) pairs; backends that can
+        write them together override this.
+        """
+        return [self._put_archive(meta, content) for meta, content in items]
+
+    def _archive_sessions(self, sessions: List[Session]) -> List[Dict[str, Any]]:
+        """Write archives of `sessions` (which stay in place); returns their metadata."""
+        archived_at = time.time()
+        items = []
+        for sess in sessions:
+            archive_meta = {
+                "archive_id": uuid4().hex,
+                "session_id": sess.id,
+                "title": sess.title,
+                "group": sess.group,
+                "archived_at": archived_at,
+                "created_at": sess.created_at,
+                "message_count": len(sess.messages),
+            }
+            items.append((archive_meta, self._build_archive_text(sess, archived_at)))
+        metas = self._put_archives(items) if items else []
+        if self.search:
+            for archive_meta, (_, content) in zip(metas, items):
+                self.search.add_archive(archive_meta, content)
+        return metas
+
+    def archive_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        sess = self.get_session(session_id)
+        if not sess:
+            return None
+        archive_meta = self._archive_sessions([sess])[0]
+        self.delete_session(session_id)
+        return archive_meta
+
+    # ---- bulk ----
+
+    def bulk(self, ops: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Apply a list of session operations in one pass:
+        - {"op": "rename", "id", "title"}
+        - {"op": "set_group", "id" | "ids", "group"}
+        - {"op": "merge_groups", "from": [group, ...], "into": group}
+        - {"op": "archive" | "delete", "id" | "ids" | "group"}
+
+        Ops apply in order to the state left by the previous ones, reading
+        each session at most once. Then the renamed/regrouped sessions are
+        saved together, all archives are written together and every
+        archived or deleted session is removed with a single
+        `delete_sessions` (one log rewrite for the jsonl backend).
+
+        Returns `results` - one row per op and target session
+        (`{"index", "op", "id"?, "ok", "error"?, ...}`) - and the number of
+        sessions saved, archived and deleted.
+        """
+        summaries = {s["id"]: s for s in self.list_sessions() if s.get("title") != "__deleted__"}
+        loaded: Dict[str, Session] = {}
+        dirty: Dict[str, None] = {}
+        archive: Dict[str, Dict[str, Any]] = {}  # session id -> its result row
+        doomed: Dict[str, None] = {}
+        results: List[Dict[str, Any]] = []
+
+        def load(sid: str) -> Optional[Session]:
+            if sid not in loaded:
+                sess = self.get_session(sid) if sid in summaries else None
+                if not sess:
+                    return None
+                loaded[sid] = sess
+            return loaded[sid]
+
+        def group_of(sid: str) -> str:
+            return loaded[sid].group if sid in loaded else self._normalize_group(summaries[sid].get("group"))
+
+        def live(group: Optional[str] = None) -> List[str]:
+            return [sid for sid in summaries if sid not in doomed and (group is None or group_of(sid) == group)]
+
+        for index, op in enumerate(ops):
+            kind = op.get("op") if isinstance(op, dict) else None
+            head: Dict[str, Any] = {"index": index, "op": kind}
+            try:
+                if kind not in BULK_OPS:
+                    raise ValueError(f"unknown op (expected one of {', '.join(BULK_OPS)})")
+                if kind == "merge_groups":
+                    sources = op.get("from")
+                    if not isinstance(sources, list) or not sources:
+                        raise ValueError("from must be a non-empty list of groups")
+                    into = self._normalize_group(op.get("into"))
+                    names = {self._normalize_group(g) for g in sources} - {into}
+                    moved = 0
+                    for sid in live():
+                        if group_of(sid) in names:
+                            sess = load(sid)
+                            if sess:
+                                sess.group = into
+                                dirty[sid] = None
+                                moved += 1
+                    results.append({**head, "ok": True, "into": into, "moved": moved})
+                    continue
+
+                if "id" in op:
+                    targets = [str(op["id"])]
+                elif "ids" in op and kind != "rename":
+                    if not isinstance(op["ids"], list):
+                        raise ValueError("ids must be a list")
+                    targets = [str(x) for x in op["ids"]]
+                elif "group" in op and kind in ("archive", "delete"):
+                    targets = live(self._normalize_group(op["group"]))
+                else:
+                    raise ValueError("id is required" if kind == "rename" else "id or ids is required")
+                if kind == "rename":
+                    title = str(op.get("title") or "").strip()
+                    if not title:
+                        raise ValueError("title is required")
+                if kind == "set_group" and "group" not in op:
+                    raise ValueError("group is required")
+            except ValueError as e:
+                results.append({**head, "ok": False, "error": str(e)})
+                continue
+
+            for sid in targets:
+                row: Dict[str, Any] = {**head, "id": sid}
+                results.append(row)
+                if sid not in summaries or sid in doomed:
+                    row.update(ok=False, error="gone" if sid in doomed else "not found")
+                    continue
+                if kind in ("archive", "delete"):
+                    doomed[sid] = None
+                    if kind == "archive":
+                        archive[sid] = row
+                    row["ok"] = True
+                    continue
+                sess = load(sid)
+                if not sess:
+                    row.update(ok=False, error="not found")
+                    continue
+                if kind == "rename":
+                    sess.title = title
+                else:
+                    sess.group = self._normalize_group(op["group"])
+                dirty[sid] = None
+                row.update(ok=True, title=sess.title, group=sess.group)
+
+        saved = [loaded[sid] for sid in dirty if sid not in doomed]
+        if saved:
+            self._save_sessions(saved)
+
+        to_archive = [sess for sess in (load(sid) for sid in archive) if sess]
+        for archive_meta in self._archive_sessions(to_archive):
+            archive[archive_meta["session_id"]]["archive_id"] = archive_meta["archive_id"]
+        for sid, row in archive.items():
+            if "archive_id" not in row:
+                row.update(ok=False, error="not found")
+                doomed.pop(sid, None)
+
+        deleted = self.delete_sessions(list(doomed)) if doomed else 0
+        return {"results": results, "saved": len(saved), "archived": len(to_archive), "deleted": deleted}
+
+    # ---- search ----
+
+    def attach_search(self, index: "SearchIndex") -> Dict[str, int]:
+        """
+        Keep `index` updated from now on and catch it up with the store.
+        """
+        self.search = index
+        return index.sync(self)
+
+    def _search_saved(self, session: Session) -> None:
+        if self.search:
+            self.search.update_session(session)
+
+    def _search_session_deleted(self, session_id: str) -> None:
+        if self.search:
+            self.search.remove_session(session_id)
+
+    def _search_archive_deleted(self, archive_id: str) -> None:
+        if self.search:
+            self.search.remove_archive(archive_id)
+
+    def _search_resync(self) -> None:
+        if self.search:
+            self.search.sync(self)
+
+    def search_text(self, q: str, limit: int = 20, kind: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Ranked session/archive hits for `q`, each with a text snippet around
+        the first match. Empty when no index is attached.
+        """
+        if not self.search:
+            return []
+        hits = self.search.query(q, limit=limit, kind=kind)
+        for hit in hits:
+            text = ""
+            if hit["kind"] == "session":
+                sess = self.get_session(hit["id"])
+                if sess:
+                    text = "\n".join(str(m.get("content") or "") for m in sess.messages)
+            else:
+                item = self.get_archive(hit["id"])
+                if item:
+                    text = item.get("content") or ""
+            hit["snippet"] = self.search.snippet(text or hit["title"], q)
+        return hits
+
+    # ---- export / import / maintenance ----
+
+    def export_markdown(self, session_id: str) -> Optional[str]:
+        sess = self.get_session(session_id)
+        if not sess:
+            return None
+        # If deleted
+        if sess.title == "__deleted__":
+            return None
+        lines = [f"# {sess.title}", ""]
+        for m in sess.messages:
+            role = m.get("role", "")
+            content = m.get("content", "")
+            if role == "user":
+                lines.append(f"## User\n\n{content}\n")
+            elif role == "assistant":
+                lines.append(f"## Assistant\n\n{content}\n")
+            elif role == "system":
+                lines.append(f"## System\n\n{content}\n")
+            else:
+                lines.append(f"## {role}\n\n{content}\n")
+        return "\n".join(lines)
+
+    def iter_sessions(self) -> Iterator[Dict[str, Any]]:
+        """
+        Every live session as a backup dict, newest first, loaded one at a
+        time.
+        """
+        for summary in self.list_sessions():
+            if summary["title"] == "__deleted__":
+                continue
+            sess = self.get_session(summary["id"])
+            if sess:
+                yield {
+                    "id": sess.id,
+                    "title": sess.title,
+                    "group": sess.group,
+                    "created_at": sess.created_at,
+                    "updated_at": sess.updated_at,
+                    "messages": sess.messages,
+                }
+
+    def export_all(self) -> Dict[str, Any]:
+        """
+        Backup document in the "snlite.sessions.backup.v1" format.
+        """
+        items = list(self.iter_sessions())
+        return {
+            "format": "snlite.sessions.backup.v1",
+            "exported_at": time.time(),
+            "count": len(items),
+            "sessions": items,
+        }
+
+    def _session_from_import(self, raw: Dict[str, Any]) -> Optional[Session]:
+        try:
+            sid = str(raw.get("id") or "").strip() or uuid4().hex
+            title = str(raw.get("title") or "New Chat").strip() or "New Chat"
+            group = self._normalize_group(raw.get("group"))
+            created_at = float(raw.get("created_at") or time.time())
+            updated_at = float(raw.get("updated_at") or created_at)
+            messages = raw.get("messages") or []
+            if not isinstance(messages, list):
+                messages = []
+            normalized = []
+            for m in messages:
+                if isinstance(m, dict) and "role" in m and "content" in m:
+                    normalized.append(m)
+            return Session(id=sid, title=title, group=group, created_at=created_at, updated_at=updated_at, messages=normalized)
+        except Exception:
+            return None
+
+    @abstractmethod
+    def import_all(self, sessions: List[Dict[str, Any]], mode: str = "append") -> Dict[str, int]:
+        """
+        Merge backup sessions ("append": newer updated_at wins) or replace
+        everything ("replace"). Returns imported/skipped/total counts.
+        """
+        ...
+
+    @abstractmethod
+    def _import_sessions(self, sessions: List[Session]) -> None:
+        """
+        Write sessions as given, keeping their updated_at.
+        """
+        ...
+
+    def importer(self, mode: str = "append", batch_size: int = 200) -> "SessionImporter":
+        return SessionImporter(self, mode, batch_size)
+
+    def import_stream(self, sessions: Iterable[Dict[str, Any]], mode: str = "append") -> Dict[str, int]:
+        """
+        `import_all` for an iterable of backup sessions, written in batches
+        so the whole backup never has to be in memory.
+        """
+        imp = self.importer(mode)
+        for raw in sessions:
+            if imp.add(raw):
+                imp.flush()
+        return imp.finish()
+
+    @abstractmethod
+    def compact(self) -> Dict[str, int]:
+        """
+        Reclaim space; returns before/after/saved counts.
+        """
+        ...
+
+    @abstractmethod
+    def garbage_stats(self) -> Dict[str, int]:
+        """
+        Storage usage; must include total_bytes and dead_bytes (space that
+        compact would reclaim).
+        """
+        ...
+
+    def write_stats(self) -> Dict[str, Any]:
+        """
+        Write batching and latency counters, if the backend keeps them.
+        """
+        return {}
+
+    def close(self) -> None:
+        """
+        Flush pending writes. The store stays usable afterwards.
+        """
+
+    def maybe_compact(self, ratio: float, min_bytes: int, max_dead_bytes: int) -> Optional[Dict[str, int]]:
+        """
+        Compact when dead space is at least `ratio` of a store of at least
+        `min_bytes`, or exceeds `max_dead_bytes`. Returns compact stats, or
+        None if nothing was done.
+        """
+        stats = self.garbage_stats()
+        total = stats.get("total_bytes", 0)
+        dead = stats.get("dead_bytes", 0)
+        if total <= 0 or dead <= 0:
+            return None
+        if dead >= max_dead_bytes or (total >= min_bytes and dead / total >= ratio):
+            return self.compact()
+        return None
@@ -14,6 +14,14 @@ let state = {
   chatSearchMatches: [],
   chatSearchIndex: -1,
   selectedArchiveId: null,
+  sessionItems: [],
+  sessionGroups: {},
+  sessionsCursor: null,
+  sessionsLoading: false,
+  searchHits: [],
+  historyOffset: 0,
+  historyLoading: false,
+  watchAbort: null,
 };
 
 let attachedImage = { name: null, b64: null };
@@ -21,6 +29,8 @@ let attachedFiles = []; // {name, mime, size, b64}
 
 const FILE_MAX_BYTES = 6 * 1024 * 1024;
 const FILE_MAX_COUNT = 3;
+const SESSIONS_PAGE_SIZE = 100;
+const HISTORY_PAGE_SIZE = 40;
 
 const I18N_KEY = "snliteyao.ui.lang.v1";
 const i18nState = {
@@ -562,6 +572,18 @@ function setStage(text) {
   $("stageBadge").textContent = text || t("status.idle");
 }
 
+// Badge text for the stage of a "status" or "resync" stream event
+function stageLabel(s) {
+  if (s.stage === "thinking") return t("stage.thinking");
+  if (s.stage === "queued") {
+    return t("stage.queued", {
+      position: s.position ?? "…",
+      eta: Math.max(1, Math.round((s.eta_ms || 0) / 1000)),
+    });
+  }
+  return t("stage.answering");
+}
+
 function setModelStatus(text) {
   $("modelStatus").textContent = text || "";
 }
@@ -712,8 +734,12 @@ function createMessageRow(role, opts = {}) {
     row.appendChild(avatar);
   }
 
-  $("messages").appendChild(row);
-  maybeAutoScroll(true);
+  if (opts.before) {
+    $("messages").insertBefore(row, opts.before);
+  } else {
+    $("messages").appendChild(row);
+    maybeAutoScroll(true);
+  }
   return { row, bubble, contentEl: content, metaEl: metaLine };
 }
 
@@ -723,7 +749,9 @@ function setMessageContent(contentEl, rawText, bubbleEl = null) {
 }
 
 function clearUI() {
+  state.watchAbort?.abort();
   $("messages").innerHTML = "";
+  state.historyOffset = 0;
   state.chatSearchMatches = [];
   state.chatSearchIndex = -1;
   updateChatSearch();
@@ -875,30 +903,72 @@ async function unloadModel() {
 }
 
 /* ---------- Sessions ---------- */
+async function fetchSessionsPage(cursor) {
+  const params = new URLSearchParams({ limit: String(SESSIONS_PAGE_SIZE) });
+  const q = ($("sessionSearch")?.value || "").trim();
+  if (q) params.set("q", q);
+  if (cursor) params.set("cursor", cursor);
+  return apiGet(`/api/sessions?${params}`);
+}
+
+async function fetchSearchHits() {
+  const q = ($("sessionSearch")?.value || "").trim();
+  if (!q) return [];
+  const r = await apiGet(`/api/search?${new URLSearchParams({ q, limit: "20" })}`);
+  return r.items || [];
+}
+
 async function refreshSessions() {
-  const items = await apiGet("/api/sessions");
-  const q = ($("sessionSearch")?.value || "").trim().toLowerCase();
-  const filtered = q
-    ? items.filter((s) => {
-      const t = (s.title || "").toLowerCase();
-      const g = (s.group || "").toLowerCase();
-      return t.includes(q) || g.includes(q);
-    })
-    : items;
+  const [page, hits] = await Promise.all([fetchSessionsPage(null), fetchSearchHits()]);
+  state.sessionItems = page.items || [];
+  state.sessionGroups = page.groups || {};
+  state.sessionsCursor = page.next_cursor || null;
+  state.searchHits = hits;
+  renderSessions();
+
+  const items = state.sessionItems;
+  if (!state.currentSessionId && items.length) {
+    state.currentSessionId = items[0].id;
+    await openSession(items[0].id);
+    await refreshSessions();
+  }
+}
+
+async function loadMoreSessions() {
+  if (!state.sessionsCursor || state.sessionsLoading) return;
+  state.sessionsLoading = true;
+  try {
+    const page = await fetchSessionsPage(state.sessionsCursor);
+    state.sessionItems.push(...(page.items || []));
+    state.sessionGroups = page.groups || state.sessionGroups;
+    state.sessionsCursor = page.next_cursor || null;
+    renderSessions();
+  } finally {
+    state.sessionsLoading = false;
+  }
+}
+
+function renderSessions() {
   const container = $("sessions");
   container.innerHTML = "";
 
   const grouped = new Map();
-  for (const s of filtered) {
+  for (const s of state.sessionItems) {
     const groupName = (s.group || t("session.ungrouped")).trim() || t("session.ungrouped");
-    if (!grouped.has(groupName)) grouped.set(groupName, []);
-    grouped.get(groupName).push(s);
+    if (!grouped.has(groupName)) grouped.set(groupName, { count: state.sessionGroups[s.group], list: [] });
+    grouped.get(groupName).list.push(s);
   }
 
-  for (const [groupName, list] of grouped.entries()) {
+  for (const [groupName, { count, list }] of grouped.entries()) {
     const head = document.createElement("div");
     head.className = "session-group-title";
-    head.textContent = groupName;
+    const label = document.createElement("span");
+    label.textContent = count ? `${groupName} · ${count}` : groupName;
+    const action = document.createElement("button");
+    action.className = "group-action";
+    action.textContent = t("session.archive_group");
+    action.onclick = () => archiveGroup(list[0].group, count || list.length);
+    head.append(label, action);
     container.appendChild(head);
 
     for (const s of list) {
@@ -914,10 +984,42 @@ async function refreshSessions() {
     }
   }
 
-  if (!state.currentSessionId && items.length) {
-    state.currentSessionId = items[0].id;
-    await openSession(items[0].id);
-    await refreshSessions();
+  if (state.sessionsCursor) {
+    const more = document.createElement("button");
+    more.className = "ghost";
+    more.textContent = t("session.load_more");
+    more.onclick = () => loadMoreSessions();
+    container.appendChild(more);
+  }
+
+  if (state.searchHits.length) renderSearchHits(container);
+}
+
+function renderSearchHits(container) {
+  const head = document.createElement("div");
+  head.className = "session-group-title";
+  head.textContent = `${t("session.content_matches")} · ${state.searchHits.length}`;
+  container.appendChild(head);
+
+  for (const h of state.searchHits) {
+    const div = document.createElement("div");
+    const isArchive = h.kind === "archive";
+    div.className = "search-hit";
+    const tag = isArchive ? t("tile.archives") : (h.group || t("session.ungrouped"));
+    div.innerHTML = `<div class="search-hit-head"><span class="session-title">${escapeHtml(h.title || t("session.new_chat"))}</span><span class="session-meta">${escapeHtml(tag)}</span></div><div class="search-hit-snippet">${escapeHtml(h.snippet || "")}</div>`;
+    div.onclick = async () => {
+      if (isArchive) {
+        const detail = await apiGet(`/api/archives/${h.id}`);
+        state.selectedArchiveId = h.id;
+        $("archiveContent").value = detail.content || "";
+        await refreshArchives();
+        return;
+      }
+      state.currentSessionId = h.id;
+      await openSession(h.id);
+      await refreshSessions();
+    };
+    container.appendChild(div);
   }
 }
 
@@ -947,6 +1049,18 @@ async function archiveSession() {
   await refreshArchives();
 }
 
+async function archiveGroup(group, count) {
+  const ok = confirm(t("confirm.archive_group", { group, count }));
+  if (!ok) return;
+  const r = await apiPost("/api/sessions/bulk", { ops: [{ op: "archive", group }] });
+  if ((r.results || []).some((x) => x.ok && x.id === state.currentSessionId)) {
+    state.currentSessionId = null;
+    clearUI();
+  }
+  await refreshSessions();
+  await refreshArchives();
+}
+
 async function deleteSession() {
   if (!state.currentSessionId) return;
   const ok = confirm(t("confirm.delete_session"));
@@ -1051,29 +1165,34 @@ async function exportSessionJson() {
   URL.revokeObjectURL(a.href);
 }
 
-async function exportAllSessions() {
-  const r = await fetch('/api/export/sessions.json');
-  if (!r.ok) {
-    alert(t('alert.backup_failed'));
-    return;
-  }
-  const data = await r.json();
+function exportAllSessions() {
+  // streamed by the server straight to the download, never held in memory
   const ts = new Date().toISOString().replace(/[:.]/g, '-');
-  const blob = new Blob([JSON.stringify(data, null, 2)], { type: 'application/json;charset=utf-8' });
   const a = document.createElement('a');
-  a.href = URL.createObjectURL(blob);
-  a.download = `snliteyao_backup_${ts}.json`;
+  a.href = '/api/export/sessions.ndjson?gzip=true';
+  a.download = `snliteyao_backup_${ts}.ndjson.gz`;
   a.click();
-  URL.revokeObjectURL(a.href);
 }
 
 async function importAllSessions() {
   const picker = document.createElement('input');
   picker.type = 'file';
-  picker.accept = '.json,application/json';
+  picker.accept = '.json,.ndjson,.gz,application/json';
   picker.onchange = async (e) => {
     const file = e.target.files && e.target.files[0];
     if (!file) return;
+    if (/\.(ndjson|gz)$/i.test(file.name)) {
+      const mode = confirm(t('confirm.import_mode')) ? 'replace' : 'append';
+      const r = await fetch(`/api/sessions/import.ndjson?mode=${mode}`, { method: 'POST', body: file });
+      if (!r.ok) {
+        alert(t('alert.invalid_json'));
+        return;
+      }
+      const result = await r.json();
+      alert(t('alert.import_done', { imported: result.imported, skipped: result.skipped }));
+      await refreshSessions();
+      return;
+    }
     let parsed;
     try {
       parsed = JSON.parse(await file.text());
@@ -1102,24 +1221,50 @@ async function compactSessions() {
   alert(t('alert.compaction_done', { before: result.before, after: result.after, saved: result.saved }));
 }
 
+function fetchHistoryPage(sessionId, before = null) {
+  const params = new URLSearchParams({ limit: String(HISTORY_PAGE_SIZE), strip_meta: "true" });
+  if (before !== null) params.set("before", String(before));
+  return apiGet(`/api/sessions/${sessionId}?${params}`);
+}
+
+function renderHistoryMessages(messages, before = null) {
+  for (const m of messages) {
+    if (m.role !== "user" && m.role !== "assistant") continue;
+    const msg = createMessageRow(m.role, { raw: m.content, before });
+    setMessageContent(msg.contentEl, m.content, msg.bubble);
+  }
+}
+
 async function openSession(sessionId) {
-  const sess = await apiGet(`/api/sessions/${sessionId}`);
+  const sess = await fetchHistoryPage(sessionId);
   if ($("sessionGroup")) {
     $("sessionGroup").value = sess.group || "";
   }
   clearUI();
-  for (const m of sess.messages) {
-    if (m.role === "user") {
-      const msg = createMessageRow("user", { raw: m.content });
-      setMessageContent(msg.contentEl, m.content, msg.bubble);
-    } else if (m.role === "assistant") {
-      const msg = createMessageRow("assistant", { raw: m.content });
-      setMessageContent(msg.contentEl, m.content, msg.bubble);
-    }
-  }
+  state.historyOffset = sess.offset || 0;
+  renderHistoryMessages(sess.messages);
   maybeAutoScroll(true);
   updateRegenButtons();
   updateChatSearch();
+  if (!state.streaming) watchActiveGeneration(sessionId);
+}
+
+async function loadEarlierMessages() {
+  const sessionId = state.currentSessionId;
+  if (!sessionId || state.historyOffset <= 0 || state.historyLoading) return;
+  state.historyLoading = true;
+  try {
+    const page = await fetchHistoryPage(sessionId, state.historyOffset);
+    if (sessionId !== state.currentSessionId) return;
+    const scroller = $("chatScroll");
+    const prevHeight = scroller.scrollHeight;
+    renderHistoryMessages(page.messages, $("messages").firstChild);
+    state.historyOffset = page.offset || 0;
+    scroller.scrollTop += scroller.scrollHeight - prevHeight;
+    updateChatSearch();
+  } finally {
+    state.historyLoading = false;
+  }
 }
 
 async function stopStreaming() {
@@ -1129,7 +1274,7 @@ async function stopStreaming() {
 
 async function maybeAutoTitle(sessionId) {
   try {
-    const sess = await apiGet(`/api/sessions/${sessionId}`);
+    const sess = await apiGet(`/api/sessions/${sessionId}?limit=2&strip_meta=true`);
     if (![t("session.new_chat"), "New Chat", "新聊天"].some((x) => sess.title === x || (sess.title || "").startsWith(x))) return;
     const hasUser = (sess.messages || []).some(m => m.role === "user" && (m.content || "").trim().length > 0);
     if (!hasUser) return;
@@ -1368,9 +1513,6 @@ async function regenerateLast() {
     return;
   }
 
-  const reader = resp.body.getReader();
-  const decoder = new TextDecoder("utf-8");
-  let buffer = "";
   let assistantRaw = "";
   const streamMeta = { fileChars: 0, fileTruncated: false, elapsedMs: null, outputChars: null, cancelled: false, finishReason: "" };
 
@@ -1378,108 +1520,97 @@ async function regenerateLast() {
   if (!userScrolledUp) maybeAutoScroll(true);
 
   try {
-    while (true) {
-      const { value, done } = await reader.read();
-      if (done) break;
-      buffer += decoder.decode(value, { stream: true });
-
-      let idx;
-      while ((idx = buffer.indexOf("\n\n")) !== -1) {
-        const frame = buffer.slice(0, idx);
-        buffer = buffer.slice(idx + 2);
-
-        const lines = frame.split("\n").map(l => l.trimEnd());
-        let eventType = "message";
-        let dataLine = null;
-
-        for (const l of lines) {
-          if (l.startsWith("event:")) eventType = l.slice(6).trim();
-          if (l.startsWith("data:")) dataLine = l.slice(5).trim();
-        }
-        if (!dataLine) continue;
-
-        if (eventType === "meta") {
-          try { state.requestId = JSON.parse(dataLine).request_id; } catch {}
-          continue;
-        }
+    await readEventStream(resp, (eventType, dataLine) => {
+      if (eventType === "meta") {
+        try { state.requestId = JSON.parse(dataLine).request_id; } catch {}
+        return;
+      }
 
-        if (eventType === "request_meta") {
-          try {
-            const obj = JSON.parse(dataLine);
-            const fx = obj.file_extract || {};
-            streamMeta.fileChars = Number(fx.total_chars || 0);
-            streamMeta.fileTruncated = !!fx.truncated;
-            setAssistantMeta(assistantMsg.metaEl, streamMeta);
-          } catch {}
-          continue;
-        }
+      if (eventType === "request_meta") {
+        try {
+          const obj = JSON.parse(dataLine);
+          const fx = obj.file_extract || {};
+          streamMeta.fileChars = Number(fx.total_chars || 0);
+          streamMeta.fileTruncated = !!fx.truncated;
+          setAssistantMeta(assistantMsg.metaEl, streamMeta);
+        } catch {}
+        return;
+      }
 
 
-        if (eventType === "status") {
-          try {
-            const s = JSON.parse(dataLine);
-            if (s.stage === "thinking") setStage(t("stage.thinking"));
-            if (s.stage === "answering") setStage(t("stage.answering"));
-          } catch {}
-          continue;
-        }
+      if (eventType === "status") {
+        try {
+          setStage(stageLabel(JSON.parse(dataLine)));
+        } catch {}
+        return;
+      }
 
-        if (eventType === "thinking") {
-          if (!$("showTrace").checked) continue;
-          try {
-            const obj = JSON.parse(dataLine);
-            if (obj.token) {
-              $("wsText").textContent += obj.token;
-              $("wsText").scrollTop = $("wsText").scrollHeight;
-            }
-          } catch {}
-          continue;
-        }
+      if (eventType === "thinking") {
+        if (!$("showTrace").checked) return;
+        try {
+          const obj = JSON.parse(dataLine);
+          if (obj.token) {
+            $("wsText").textContent += obj.token;
+            $("wsText").scrollTop = $("wsText").scrollHeight;
+          }
+        } catch {}
+        return;
+      }
 
-        if (eventType === "content") {
-          try {
-            const obj = JSON.parse(dataLine);
-            if (obj.token) {
-              assistantRaw += obj.token;
-              setMessageContent(assistantMsg.contentEl, assistantRaw, assistantMsg.bubble);
-              maybeAutoScroll(false);
-            }
-          } catch {}
-          continue;
-        }
+      if (eventType === "content") {
+        try {
+          const obj = JSON.parse(dataLine);
+          if (obj.token) {
+            assistantRaw += obj.token;
+            setMessageContent(assistantMsg.contentEl, assistantRaw, assistantMsg.bubble);
+            maybeAutoScroll(false);
+          }
+        } catch {}
+        return;
+      }
 
-        if (eventType === "error") {
-          assistantRaw += `\n${t("stream.error_prefix")} ${dataLine}`;
+      if (eventType === "resync") {
+        try {
+          const obj = JSON.parse(dataLine);
+          assistantRaw = obj.content || "";
           setMessageContent(assistantMsg.contentEl, assistantRaw, assistantMsg.bubble);
-          maybeAutoScroll(false);
-          continue;
-        }
+          if ($("showTrace").checked) $("wsText").textContent = obj.thinking || "";
+          setStage(stageLabel(obj));
+        } catch {}
+        return;
+      }
 
-        if (eventType === "done") {
-          try {
-            const obj = JSON.parse(dataLine);
-            streamMeta.elapsedMs = obj.elapsed_ms;
-            streamMeta.outputChars = obj.output_chars;
-            streamMeta.cancelled = !!obj.cancelled;
-            streamMeta.finishReason = obj.finish_reason || "";
-            if (obj.finish_reason === "cancelled") {
-              assistantRaw += `\n\n${t("stream.generation_stopped")}`;
-              setMessageContent(assistantMsg.contentEl, assistantRaw, assistantMsg.bubble);
-            } else if (obj.finish_reason === "failed") {
-              assistantRaw += `\n\n${t("stream.generation_failed")}`;
-              setMessageContent(assistantMsg.contentEl, assistantRaw, assistantMsg.bubble);
-            } else if (obj.finish_reason === "interrupted") {
-              assistantRaw += `\n\n${t("stream.generation_interrupted")}`;
-              setMessageContent(assistantMsg.contentEl, assistantRaw, assistantMsg.bubble);
-            }
-            setAssistantMeta(assistantMsg.metaEl, streamMeta);
-          } catch {}
-          setStage(t("status.idle"));
-          maybeAutoScroll(false);
-          continue;
-        }
+      if (eventType === "error") {
+        assistantRaw += `\n${t("stream.error_prefix")} ${dataLine}`;
+        setMessageContent(assistantMsg.contentEl, assistantRaw, assistantMsg.bubble);
+        maybeAutoScroll(false);
+        return;
       }
-    }
+
+      if (eventType === "done") {
+        try {
+          const obj = JSON.parse(dataLine);
+          streamMeta.elapsedMs = obj.elapsed_ms;
+          streamMeta.outputChars = obj.output_chars;
+          streamMeta.cancelled = !!obj.cancelled;
+          streamMeta.finishReason = obj.finish_reason || "";
+          if (obj.finish_reason === "cancelled") {
+            assistantRaw += `\n\n${t("stream.generation_stopped")}`;
+            setMessageContent(assistantMsg.contentEl, assistantRaw, assistantMsg.bubble);
+          } else if (obj.finish_reason === "failed") {
+            assistantRaw += `\n\n${t("stream.generation_failed")}`;
+            setMessageContent(assistantMsg.contentEl, assistantRaw, assistantMsg.bubble);
+          } else if (obj.finish_reason === "interrupted") {
+            assistantRaw += `\n\n${t("stream.generation_interrupted")}`;
+            setMessageContent(assistantMsg.contentEl, assistantRaw, assistantMsg.bubble);
+          }
+          setAssistantMeta(assistantMsg.metaEl, streamMeta);
+        } catch {}
+        setStage(t("status.idle"));
+        maybeAutoScroll(false);
+        return;
+      }
+    });
   } finally {
     state.streaming = false;
     $("btnSend").disabled = false;
@@ -1494,6 +1625,129 @@ async function regenerateLast() {
   }
 }
 
+/* ---------- Streams ---------- */
+const STREAM_RESUME_ATTEMPTS = 5;
+
+// Calls onEvent(eventType, dataLine) for each SSE event of a chat stream.
+// If the connection drops before "done", re-attaches to the same
+// generation with Last-Event-ID and carries on where it stopped.
+async function readEventStream(resp, onEvent, { requestId = null, signal = null } = {}) {
+  let lastEventId = 0;
+  let finished = false;
+  let attempts = 0;
+
+  while (true) {
+    try {
+      const reader = resp.body.getReader();
+      const decoder = new TextDecoder("utf-8");
+      let buffer = "";
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let idx;
+        while ((idx = buffer.indexOf("\n\n")) !== -1) {
+          const frame = buffer.slice(0, idx);
+          buffer = buffer.slice(idx + 2);
+
+          let eventType = "message";
+          let dataLine = null;
+          for (const l of frame.split("\n").map(l => l.trimEnd())) {
+            // ids only move forward; a resync carries the newest one
+            if (l.startsWith("id:")) lastEventId = Math.max(lastEventId, Number(l.slice(3).trim()) || 0);
+            if (l.startsWith("event:")) eventType = l.slice(6).trim();
+            if (l.startsWith("data:")) dataLine = l.slice(5).trim();
+          }
+          if (!dataLine) continue;
+
+          if (eventType === "meta") {
+            try { requestId = JSON.parse(dataLine).request_id; } catch {}
+          }
+          if (eventType === "done") finished = true;
+          attempts = 0;
+          onEvent(eventType, dataLine);
+        }
+      }
+    } catch {
+      // connection lost; try to re-attach below
+    }
+
+    while (true) {
+      if (finished || !requestId || signal?.aborted || attempts >= STREAM_RESUME_ATTEMPTS) return;
+      attempts += 1;
+      await new Promise((r) => setTimeout(r, 500 * attempts));
+      try {
+        resp = await fetch(`/api/chat/stream/${encodeURIComponent(requestId)}`, {
+          headers: lastEventId ? { "Last-Event-ID": String(lastEventId) } : {},
+          signal,
+        });
+      } catch {
+        continue;
+      }
+      if (!resp.ok) return;
+      break;
+    }
+  }
+}
+
+// Shows a generation still running in this session (started in another
+// tab, or by a stream this page lost) as it continues.
+async function watchActiveGeneration(sessionId) {
+  state.watchAbort?.abort();
+  let items = [];
+  try {
+    items = (await apiGet(`/api/chat/streams?session_id=${encodeURIComponent(sessionId)}`)).items || [];
+  } catch {
+    return;
+  }
+  const gen = items[items.length - 1];
+  if (!gen || state.streaming || sessionId !== state.currentSessionId) return;
+
+  const controller = new AbortController();
+  state.watchAbort = controller;
+  let resp;
+  try {
+    resp = await fetch(`/api/chat/stream/${encodeURIComponent(gen.request_id)}`, { signal: controller.signal });
+  } catch {
+    return;
+  }
+  if (!resp.ok) return;
+
+  const row = createMessageRow("assistant", { raw: "" });
+  let raw = "";
+  let finished = false;
+  setStage(t("stage.answering"));
+  maybeAutoScroll(true);
+  try {
+    await readEventStream(resp, (eventType, dataLine) => {
+      let obj;
+      try { obj = JSON.parse(dataLine); } catch { return; }
+      if (eventType === "status") {
+        setStage(stageLabel(obj));
+        return;
+      }
+      if (eventType === "done") {
+        finished = true;
+        return;
+      }
+      if (eventType === "content" && obj.token) raw += obj.token;
+      else if (eventType === "resync") raw = obj.content || "";
+      else return;
+      setMessageContent(row.contentEl, raw, row.bubble);
+      maybeAutoScroll(false);
+    }, { requestId: gen.request_id, signal: controller.signal });
+  } finally {
+    if (state.watchAbort === controller) state.watchAbort = null;
+  }
+  if (finished && !state.streaming && sessionId === state.currentSessionId) {
+    setStage(t("status.idle"));
+    // replace the live copy with the saved answer
+    await openSession(sessionId);
+    await refreshSessions();
+  }
+}
+
 /* ---------- Send ---------- */
 async function send() {
   if (state.streaming) return;
@@ -1577,9 +1831,6 @@ async function send() {
     return;
   }
 
-  const reader = resp.body.getReader();
-  const decoder = new TextDecoder("utf-8");
-  let buffer = "";
   let assistantRaw = "";
   const streamMeta = { fileChars: 0, fileTruncated: false, elapsedMs: null, outputChars: null, cancelled: false, finishReason: "" };
 
@@ -1587,107 +1838,96 @@ async function send() {
   if (!userScrolledUp) maybeAutoScroll(true);
 
   try {
-    while (true) {
-      const { value, done } = await reader.read();
-      if (done) break;
-      buffer += decoder.decode(value, { stream: true });
-
-      let idx;
-      while ((idx = buffer.indexOf("\n\n")) !== -1) {
-        const frame = buffer.slice(0, idx);
-        buffer = buffer.slice(idx + 2);
-
-        const lines = frame.split("\n").map(l => l.trimEnd());
-        let eventType = "message";
-        let dataLine = null;
-
-        for (const l of lines) {
-          if (l.startsWith("event:")) eventType = l.slice(6).trim();
-          if (l.startsWith("data:")) dataLine = l.slice(5).trim();
-        }
-        if (!dataLine) continue;
-
-        if (eventType === "meta") {
-          try { state.requestId = JSON.parse(dataLine).request_id; } catch {}
-          continue;
-        }
+    await readEventStream(resp, (eventType, dataLine) => {
+      if (eventType === "meta") {
+        try { state.requestId = JSON.parse(dataLine).request_id; } catch {}
+        return;
+      }
 
-        if (eventType === "request_meta") {
-          try {
-            const obj = JSON.parse(dataLine);
-            const fx = obj.file_extract || {};
-            streamMeta.fileChars = Number(fx.total_chars || 0);
-            streamMeta.fileTruncated = !!fx.truncated;
-            setAssistantMeta(assistantMsg.metaEl, streamMeta);
-          } catch {}
-          continue;
-        }
+      if (eventType === "request_meta") {
+        try {
+          const obj = JSON.parse(dataLine);
+          const fx = obj.file_extract || {};
+          streamMeta.fileChars = Number(fx.total_chars || 0);
+          streamMeta.fileTruncated = !!fx.truncated;
+          setAssistantMeta(assistantMsg.metaEl, streamMeta);
+        } catch {}
+        return;
+      }
 
-        if (eventType === "status") {
-          try {
-            const s = JSON.parse(dataLine);
-            if (s.stage === "thinking") setStage(t("stage.thinking"));
-            if (s.stage === "answering") setStage(t("stage.answering"));
-          } catch {}
-          continue;
-        }
+      if (eventType === "status") {
+        try {
+          setStage(stageLabel(JSON.parse(dataLine)));
+        } catch {}
+        return;
+      }
 
-        if (eventType === "thinking") {
-          if (!$("showTrace").checked) continue;
-          try {
-            const obj = JSON.parse(dataLine);
-            if (obj.token) {
-              $("wsText").textContent += obj.token;
-              $("wsText").scrollTop = $("wsText").scrollHeight;
-            }
-          } catch {}
-          continue;
-        }
+      if (eventType === "thinking") {
+        if (!$("showTrace").checked) return;
+        try {
+          const obj = JSON.parse(dataLine);
+          if (obj.token) {
+            $("wsText").textContent += obj.token;
+            $("wsText").scrollTop = $("wsText").scrollHeight;
+          }
+        } catch {}
+        return;
+      }
 
-        if (eventType === "content") {
-          try {
-            const obj = JSON.parse(dataLine);
-            if (obj.token) {
-              assistantRaw += obj.token;
-              setMessageContent(assistantMsg.contentEl, assistantRaw, assistantMsg.bubble);
-              maybeAutoScroll(false);
-            }
-          } catch {}
-          continue;
-        }
+      if (eventType === "content") {
+        try {
+          const obj = JSON.parse(dataLine);
+          if (obj.token) {
+            assistantRaw += obj.token;
+            setMessageContent(assistantMsg.contentEl, assistantRaw, assistantMsg.bubble);
+            maybeAutoScroll(false);
+          }
+        } catch {}
+        return;
+      }
 
-        if (eventType === "error") {
-          assistantRaw += `\n${t("stream.error_prefix")} ${dataLine}`;
+      if (eventType === "resync") {
+        try {
+          const obj = JSON.parse(dataLine);
+          assistantRaw = obj.content || "";
           setMessageContent(assistantMsg.contentEl, assistantRaw, assistantMsg.bubble);
-          maybeAutoScroll(false);
-          continue;
-        }
+          if ($("showTrace").checked) $("wsText").textContent = obj.thinking || "";
+          setStage(stageLabel(obj));
+        } catch {}
+        return;
+      }
 
-        if (eventType === "done") {
-          try {
-            const obj = JSON.parse(dataLine);
-            streamMeta.elapsedMs = obj.elapsed_ms;
-            streamMeta.outputChars = obj.output_chars;
-            streamMeta.cancelled = !!obj.cancelled;
-            streamMeta.finishReason = obj.finish_reason || "";
-            if (obj.finish_reason === "cancelled") {
-              assistantRaw += `\n\n${t("stream.generation_stopped")}`;
-              setMessageContent(assistantMsg.contentEl, assistantRaw, assistantMsg.bubble);
-            } else if (obj.finish_reason === "failed") {
-              assistantRaw += `\n\n${t("stream.generation_failed")}`;
-              setMessageContent(assistantMsg.contentEl, assistantRaw, assistantMsg.bubble);
-            } else if (obj.finish_reason === "interrupted") {
-              assistantRaw += `\n\n${t("stream.generation_interrupted")}`;
-              setMessageContent(assistantMsg.contentEl, assistantRaw, assistantMsg.bubble);
-            }
-            setAssistantMeta(assistantMsg.metaEl, streamMeta);
-          } catch {}
-          setStage(t("status.idle"));
-          maybeAutoScroll(false);
-          continue;
-        }
+      if (eventType === "error") {
+        assistantRaw += `\n${t("stream.error_prefix")} ${dataLine}`;
+        setMessageContent(assistantMsg.contentEl, assistantRaw, assistantMsg.bubble);
+        maybeAutoScroll(false);
+        return;
       }
-    }
+
+      if (eventType === "done") {
+        try {
+          const obj = JSON.parse(dataLine);
+          streamMeta.elapsedMs = obj.elapsed_ms;
+          streamMeta.outputChars = obj.output_chars;
+          streamMeta.cancelled = !!obj.cancelled;
+          streamMeta.finishReason = obj.finish_reason || "";
+          if (obj.finish_reason === "cancelled") {
+            assistantRaw += `\n\n${t("stream.generation_stopped")}`;
+            setMessageContent(assistantMsg.contentEl, assistantRaw, assistantMsg.bubble);
+          } else if (obj.finish_reason === "failed") {
+            assistantRaw += `\n\n${t("stream.generation_failed")}`;
+            setMessageContent(assistantMsg.contentEl, assistantRaw, assistantMsg.bubble);
+          } else if (obj.finish_reason === "interrupted") {
+            assistantRaw += `\n\n${t("stream.generation_interrupted")}`;
+            setMessageContent(assistantMsg.contentEl, assistantRaw, assistantMsg.bubble);
+          }
+          setAssistantMeta(assistantMsg.metaEl, streamMeta);
+        } catch {}
+        setStage(t("status.idle"));
+        maybeAutoScroll(false);
+        return;
+      }
+    });
   } finally {
     state.streaming = false;
     $("btnSend").disabled = false;
@@ -1750,11 +1990,22 @@ async function init() {
     }
   });
 
-  $("chatScroll").addEventListener("scroll", () => updateUserScrolledFlag());
+  $("chatScroll").addEventListener("scroll", () => {
+    updateUserScrolledFlag();
+    if ($("chatScroll").scrollTop < 80) loadEarlierMessages();
+  });
   $("chatSearch").addEventListener("input", () => updateChatSearch());
   $("btnSearchNext").onclick = () => focusChatSearchMatch(state.chatSearchIndex + 1);
   $("btnSearchPrev").onclick = () => focusChatSearchMatch(state.chatSearchIndex - 1);
-  $("sessionSearch").addEventListener("input", () => refreshSessions());
+  let sessionSearchTimer = null;
+  $("sessionSearch").addEventListener("input", () => {
+    clearTimeout(sessionSearchTimer);
+    sessionSearchTimer = setTimeout(() => refreshSessions(), 200);
+  });
+  $("sessions").addEventListener("scroll", () => {
+    const el = $("sessions");
+    if (el.scrollTop + el.clientHeight >= el.scrollHeight - 40) loadMoreSessions();
+  });
 
   $("btnWsClear").onclick = () => $("wsText").textContent = "";
   $("btnWsHide").onclick = () => {
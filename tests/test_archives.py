@@ -0,0 +1,27 @@
+import pytest
+
+from snlite.sharded_store import ShardedSessionStore
+from snlite.store import SessionStore
+
+
+@pytest.mark.parametrize("backend", [SessionStore, ShardedSessionStore])
+def test_deleting_an_archive_removes_its_text_at_once(tmp_path, backend):
+    store = backend(str(tmp_path))
+    keep, doomed = store.create_session("keep me"), store.create_session("secret plans")
+    for sess, text in ((keep, "harmless"), (doomed, "the launch code is 0000")):
+        sess.messages.append({"role": "user", "content": text})
+        store.save_session(sess)
+    kept = store.archive_session(keep.id)
+    gone = store.archive_session(doomed.id)
+    row = dict(store._archives._rows[gone["archive_id"]])
+
+    assert store.delete_archive(gone["archive_id"])
+
+    with open(store._archives._segment_path(row["segment"]), "rb") as f:
+        f.seek(row["offset"])
+        assert f.read(row["length"]) == bytes(row["length"])
+    with open(store.archive_index_path, encoding="utf-8") as f:
+        assert "secret plans" not in f.read()
+    assert store.get_archive(gone["archive_id"]) is None
+    assert "harmless" in store.get_archive(kept["archive_id"])["content"]
+    assert [a["archive_id"] for a in backend(str(tmp_path)).list_archives()] == [kept["archive_id"]]
@@ -0,0 +1,63 @@
+import pytest
+
+from snlite.blobs import BLOB_MIN_CHARS
+from snlite.sharded_store import ShardedSessionStore
+from snlite.sqlite_store import SqliteSessionStore
+from snlite.store import SessionStore
+
+BACKENDS = [SessionStore, SqliteSessionStore, ShardedSessionStore]
+
+DOCUMENT = "the attached document " * (BLOB_MIN_CHARS // 10)
+
+
+def _answer(content, **meta):
+    return {"role": "assistant", "content": content, "meta": meta}
+
+
+def _chat_about(store, title, *answers):
+    sess = store.create_session(title)
+    for answer in answers:
+        sess.messages.append({"role": "user", "content": "question"})
+        sess.messages.append(answer)
+    store.save_session(sess)
+    return sess
+
+
+def _blobs(store):
+    return store.garbage_stats()["blobs"]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_large_meta_is_stored_once_and_released_with_its_last_session(tmp_path, backend):
+    store = backend(str(tmp_path))
+    own = "only in the first session " * 40
+    first = _chat_about(store, "first", _answer("a", prompt=DOCUMENT, file_excerpts=own), _answer("b", prompt=DOCUMENT))
+    second = _chat_about(store, "second", _answer("c", prompt=DOCUMENT, system_text="short"))
+    assert _blobs(store) == 2
+
+    meta = store.get_session(second.id).messages[-1]["meta"]
+    assert meta == {"prompt": DOCUMENT, "system_text": "short"}
+    if backend is SessionStore:
+        with open(store.path, encoding="utf-8") as f:
+            assert DOCUMENT not in f.read()
+
+    assert store.delete_session(first.id)
+    assert _blobs(store) == 1
+    assert backend(str(tmp_path)).get_session(second.id).messages[-1]["meta"]["prompt"] == DOCUMENT
+
+    assert store.delete_session(second.id)
+    assert _blobs(store) == 0
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_compact_removes_blobs_of_replaced_answers(tmp_path, backend):
+    store = backend(str(tmp_path))
+    sess = _chat_about(store, "regenerated", _answer("first try", prompt=DOCUMENT))
+    sess.messages.pop()
+    sess.messages.append(_answer("second try", prompt=DOCUMENT.upper()))
+    store.save_session(sess)
+
+    store.compact()
+    stats = store.garbage_stats()
+    assert stats["blobs"] == 1 and stats["blob_dead_bytes"] == 0
+    assert store.get_session(sess.id).messages[-1]["meta"]["prompt"] == DOCUMENT.upper()
@@ -0,0 +1,61 @@
+import pytest
+
+from snlite.sharded_store import ShardedSessionStore
+from snlite.sqlite_store import SqliteSessionStore
+from snlite.store import SessionStore
+
+BACKENDS = [SessionStore, SqliteSessionStore, ShardedSessionStore]
+
+
+def _sessions(store, n):
+    ids = []
+    for i in range(n):
+        sess = store.create_session(f"S{i}", group="inbox")
+        sess.messages.append({"role": "user", "content": f"question {i}"})
+        store.save_session(sess)
+        ids.append(sess.id)
+    return ids
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_bulk_applies_ops_in_order_and_reports_each_target(tmp_path, backend):
+    store = backend(str(tmp_path))
+    ids = _sessions(store, 120)
+    result = store.bulk([
+        {"op": "archive", "ids": ids[:40]},
+        {"op": "delete", "ids": ids[40:100]},
+        {"op": "rename", "id": ids[100], "title": "Renamed"},
+        {"op": "set_group", "ids": ids[101:110], "group": "work"},
+        {"op": "merge_groups", "from": ["work"], "into": "projects"},
+        {"op": "delete", "ids": [ids[0], "missing"]},
+        {"op": "explode", "id": ids[110]},
+    ])
+
+    assert (result["saved"], result["archived"], result["deleted"]) == (10, 40, 100)
+    rows = result["results"]
+    assert all(r["ok"] for r in rows[:110])
+    assert rows[110]["moved"] == 9
+    assert [(r["ok"], r["error"][:10]) for r in rows[111:]] == [(False, "gone"), (False, "not found"), (False, "unknown op")]
+
+    reopened = backend(str(tmp_path))
+    listed = {s["id"]: s for s in reopened.list_sessions()}
+    assert sorted(listed) == sorted(ids[100:])
+    assert listed[ids[100]]["title"] == "Renamed"
+    assert {listed[sid]["group"] for sid in ids[101:110]} == {"projects"}
+    assert len(reopened.list_archives()) == 40
+
+
+def test_bulk_over_many_sessions_rewrites_the_log_once(tmp_path, monkeypatch):
+    store = SessionStore(str(tmp_path))
+    ids = _sessions(store, 150)
+    rewrites = []
+    rewrite = store._rewrite
+    monkeypatch.setattr(store, "_rewrite", lambda records: (rewrites.append(1), rewrite(records)))
+    generation = store._flock.generation()
+
+    result = store.bulk([{"op": "archive", "ids": ids[:50]}, {"op": "delete", "ids": ids[50:120]}])
+
+    assert (result["archived"], result["deleted"]) == (50, 120)
+    assert len(rewrites) == 1
+    assert store._flock.generation() == generation + 1
+    assert [s["id"] for s in SessionStore(str(tmp_path)).list_sessions()] == ids[:119:-1]
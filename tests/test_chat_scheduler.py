@@ -0,0 +1,53 @@
+import asyncio
+import os
+import tempfile
+
+os.environ.setdefault("SNLITE_DATA_DIR", tempfile.mkdtemp())
+
+import httpx  # noqa: E402
+
+from snlite import main  # noqa: E402
+from snlite.plugins.example_provider import EchoProvider  # noqa: E402
+from snlite.scheduler import ConcurrencyLimits, GenerationScheduler  # noqa: E402
+
+
+class SlowEcho(EchoProvider):
+    name = "slow-echo"
+
+    async def stream_chat(self, model_id, messages, params, cancelled):
+        async for chunk in super().stream_chat(model_id, messages, params, cancelled):
+            await asyncio.sleep(0.01)
+            yield chunk
+
+
+def test_requests_over_the_queue_limit_leave_their_sessions_alone(monkeypatch):
+    # one running and one waiting generation per model
+    monkeypatch.setattr(main, "scheduler", GenerationScheduler(ConcurrencyLimits(default=1), queue_max=1))
+    monkeypatch.setitem(main.PROVIDERS, SlowEcho.name, SlowEcho())
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+            r = await c.post("/api/models/load", json={"provider": SlowEcho.name, "model_id": "m"})
+            assert r.status_code == 200
+            sessions = [(await c.post("/api/sessions", json={})).json()["id"] for _ in range(5)]
+            chats, retried = sessions[:4], sessions[4]
+            r = await c.post("/api/chat/stream", json={"session_id": retried, "user_text": "first"})
+            assert r.status_code == 200
+            before = (await c.get(f"/api/sessions/{retried}")).json()["messages"]
+
+            responses = await asyncio.gather(
+                *[c.post("/api/chat/stream", json={"session_id": sid, "user_text": "q"}) for sid in chats],
+                c.post("/api/chat/regenerate/stream", json={"session_id": retried}),
+            )
+            after = (await c.get(f"/api/sessions/{retried}")).json()["messages"]
+            saved = [len((await c.get(f"/api/sessions/{sid}")).json()["messages"]) for sid in chats]
+        return [r.status_code for r in responses], [r.headers.get("retry-after") for r in responses], before, after, saved
+
+    codes, retry_after, before, after, saved = asyncio.run(run())
+    assert codes == [200, 200, 429, 429, 429]
+    assert all(retry_after[2:])
+    # the rejected questions were not saved, the rejected retry kept its answer
+    assert saved == [2, 2, 0, 0]
+    assert after == before
+    assert main.scheduler.stats()["lanes"][f"{SlowEcho.name}/m"]["running"] == 0
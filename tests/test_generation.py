@@ -0,0 +1,64 @@
+import asyncio
+import json
+
+from snlite.generation import Generation
+from snlite.registry import CancelToken
+from snlite.sse import sse_event, token_event
+
+
+def _publish_tokens(gen, texts):
+    for text in texts:
+        gen.content_parts.append(text)
+        gen.publish([token_event("content", text)])
+
+
+async def _read(gen, after, until_end=False):
+    """
+    Follow `gen` from event id `after` like the web client does: take the
+    text from content/resync events and remember the last `id:` line seen.
+    Reads one chunk unless `until_end`, then drops the connection.
+    """
+    text = ""
+    last_id = after
+    stream = gen.follow(after)
+    try:
+        async for chunk in stream:
+            for frame in chunk.split("\n\n"):
+                fields = dict(line.split(": ", 1) for line in frame.splitlines() if ": " in line)
+                if "id" in fields:
+                    last_id = int(fields["id"])
+                if fields.get("event") == "content":
+                    text += json.loads(fields["data"])["token"]
+                elif fields.get("event") == "resync":
+                    text = json.loads(fields["data"])["content"]
+            if not until_end:
+                break
+    finally:
+        await stream.aclose()
+    return text, last_id
+
+
+def test_resume_after_resync_does_not_repeat_text():
+    async def run():
+        gen = Generation("r1", "s1", CancelToken(), buffer_events=8, orphan_grace_s=30, subscriber_queue=1000)
+        gen.publish([sse_event("meta", {"request_id": "r1"}), sse_event("status", {"stage": "answering"})])
+        _publish_tokens(gen, [f"a{i}," for i in range(3)])
+        text, last_id = await _read(gen, 0)
+        assert text == "a0,a1,a2,"
+
+        # the client falls behind the ring buffer; a status event stays in it
+        _publish_tokens(gen, [f"b{i}," for i in range(18)])
+        gen.publish([sse_event("status", {"stage": "answering"})])
+        _publish_tokens(gen, ["b18,", "b19,"])
+        text, last_id = await _read(gen, last_id)
+        assert text == "".join(gen.content_parts)
+        assert last_id == gen.seq
+
+        # a second drop: only what came after the resync is replayed
+        _publish_tokens(gen, ["c0,", "c1,", "c2,"])
+        gen.publish([sse_event("done", {"done": True})])
+        gen.finish()
+        rest, _ = await _read(gen, last_id, until_end=True)
+        assert text + rest == "".join(gen.content_parts)
+
+    asyncio.run(run())
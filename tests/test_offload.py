@@ -0,0 +1,34 @@
+import asyncio
+import threading
+
+from snlite.offload import BlockingPool
+
+
+def test_iterate_pulls_every_item_in_the_pool():
+    pulled_on = []
+    closed = threading.Event()
+
+    def numbers():
+        try:
+            for i in range(5):
+                pulled_on.append(threading.current_thread().name)
+                yield i
+        finally:
+            closed.set()
+
+    async def run():
+        pool = BlockingPool(threads=2)
+        got = [n async for n in pool.iterate("export", numbers())]
+        assert got == [0, 1, 2, 3, 4]
+        assert pool.stats()["export"]["calls"] == 6  # five items and the end
+
+        # a consumer that stops early closes the iterator in the pool
+        closed.clear()
+        stream = pool.iterate("export", numbers())
+        assert await stream.__anext__() == 0
+        await stream.aclose()
+        assert await asyncio.get_running_loop().run_in_executor(None, closed.wait, 5)
+        pool.shutdown()
+
+    asyncio.run(run())
+    assert pulled_on and all(name.startswith("snlite-io") for name in pulled_on)
@@ -0,0 +1,58 @@
+import time
+
+import pytest
+
+from snlite.retention import DAY_S, RetentionPolicy, apply_retention, plan_retention
+from snlite.store import SessionStore
+from snlite.store_base import DEFAULT_GROUP
+
+
+def test_policy_parses_the_settings():
+    policy = RetentionPolicy.parse("30", "200, scratch=20,=50")
+    assert policy.to_dict() == {"max_age_days": 30.0, "group_max": 200, "group_caps": {"scratch": 20, DEFAULT_GROUP: 50}}
+    assert policy.cap_for("scratch") == 20 and policy.cap_for("work") == 200
+    assert not RetentionPolicy.parse("", "").enabled
+    for bad in (("-1", ""), ("", "scratch=-2"), ("", "lots")):
+        with pytest.raises(ValueError):
+            RetentionPolicy.parse(*bad)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    return now
+
+
+def _session(store, clock, title, group=None):
+    clock[0] += 60
+    sess = store.create_session(title, group=group)
+    sess.messages.append({"role": "user", "content": title})
+    store.save_session(sess)
+    return sess.id
+
+
+def test_plan_and_apply_archive_by_age_then_group_cap(tmp_path, clock, monkeypatch):
+    store = SessionStore(str(tmp_path))
+    old = [_session(store, clock, f"old {i}", "scratch") for i in range(3)]
+    clock[0] += 10 * DAY_S
+    recent = [_session(store, clock, f"recent {i}") for i in range(4)]
+    kept = _session(store, clock, "recent scratch", "scratch")
+    clock[0] += 2 * DAY_S
+    policy = RetentionPolicy.parse("5", "3,scratch=1")
+
+    plan = plan_retention(store, policy)
+    assert [(c["id"], c["reason"]) for c in plan] == [(sid, "age") for sid in old] + [(recent[0], "group_cap")]
+    assert plan_retention(store, RetentionPolicy()) == []
+
+    bulk_calls = []
+    bulk = store.bulk
+    monkeypatch.setattr(store, "bulk", lambda ops: (bulk_calls.append(ops), bulk(ops))[1])
+    first = apply_retention(store, policy, batch=3)
+    assert (first["archived"], first["failed"], first["remaining"]) == (3, 0, 1)
+    assert len(bulk_calls) == 1 and bulk_calls[0] == [{"op": "archive", "ids": old}]
+    assert apply_retention(store, policy, batch=3)["remaining"] == 0
+    assert apply_retention(store, policy, batch=3)["archived"] == 0
+
+    assert sorted(s["id"] for s in store.list_sessions()) == sorted(recent[1:] + [kept])
+    assert sorted(a["session_id"] for a in store.list_archives()) == sorted(old + recent[:1])
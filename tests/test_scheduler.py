@@ -0,0 +1,27 @@
+import asyncio
+
+from snlite.scheduler import ConcurrencyLimits, GenerationScheduler
+
+
+def test_cancelled_running_ticket_keeps_its_slot_until_released():
+    async def run():
+        scheduler = GenerationScheduler(ConcurrencyLimits(default=1))
+        first = scheduler.enqueue("ollama", "m", "interactive", "s1")
+        second = scheduler.enqueue("ollama", "m", "interactive", "s2")
+        assert await first.wait()
+
+        # a stop while the provider call is still winding down
+        first.cancel()
+        assert first.running and not second.running
+        assert scheduler.stats()["lanes"]["ollama/m"]["running"] == 1
+
+        first.release()
+        assert await second.wait()
+
+        # a queued ticket does leave the queue on cancel
+        third = scheduler.enqueue("ollama", "m", "interactive", "s3")
+        third.cancel()
+        assert not await third.wait()
+        assert scheduler.stats()["lanes"]["ollama/m"]["waiting"] == 0
+
+    asyncio.run(run())
@@ -0,0 +1,37 @@
+import json
+
+from snlite.search import SearchIndex
+from snlite.store import SessionStore
+
+
+def _store_with(tmp_path, *texts):
+    store = SessionStore(str(tmp_path))
+    ids = []
+    for text in texts:
+        sess = store.create_session("New Chat")
+        sess.messages.append({"role": "user", "content": text})
+        store.save_session(sess)
+        ids.append(sess.id)
+    return store, ids
+
+
+def test_single_cjk_character_matches_inside_longer_runs(tmp_path):
+    store, (cat, dog) = _store_with(tmp_path, "我的猫很可爱", "小狗在睡觉")
+    index = SearchIndex()
+    index.sync(store)
+
+    assert [h["id"] for h in index.query("猫")] == [cat]
+    assert [h["id"] for h in index.query("可爱")] == [cat]
+    assert [h["id"] for h in index.query("狗")] == [dog]
+    # phrases still need all of their bigrams
+    assert index.query("猫狗") == []
+
+
+def test_index_written_by_an_older_version_is_rebuilt(tmp_path):
+    store, (cat,) = _store_with(tmp_path / "data", "我的猫很可爱")
+    path = tmp_path / "search_index.json"
+    path.write_text(json.dumps({"version": 1, "docs": {}}))
+
+    index = SearchIndex(str(path))
+    assert index.sync(store)["indexed"] == 1
+    assert [h["id"] for h in index.query("猫")] == [cat]
@@ -0,0 +1,39 @@
+import json
+import os
+
+from snlite.sharded_store import ShardedSessionStore
+
+
+def _chat(store, title, turns):
+    sess = store.create_session(title)
+    for i in range(turns):
+        sess.messages.append({"role": "user", "content": f"{title} question {i}"})
+        sess.messages.append({"role": "assistant", "content": f"{title} answer {i}"})
+        store.save_session(sess)
+    return sess
+
+
+def test_torn_shard_record_and_metadata_row_are_cut_off(tmp_path):
+    store = ShardedSessionStore(str(tmp_path))
+    sess = _chat(store, "A", 3)
+    other = _chat(store, "B", 1)
+    shard = store._shard_path(sess.id)
+    size = os.path.getsize(shard)
+    # crashes in the middle of appending a delta and its metadata row
+    with open(shard, "ab") as f:
+        f.write(b'{"op": "delta", "id": "' + sess.id.encode() + b'", "app')
+    with open(store.meta_path, "ab") as f:
+        f.write(b'{"id": "' + sess.id.encode() + b'", "si')
+
+    reopened = ShardedSessionStore(str(tmp_path))
+    assert os.path.getsize(shard) == size
+    # the repaired shard gets a metadata row of its own, after the cut
+    with open(store.meta_path, "rb") as f:
+        assert all(json.loads(line) for line in f.read().splitlines(keepends=True))
+    got = reopened.get_session(sess.id)
+    assert got.messages == sess.messages
+    assert reopened.get_session(other.id).messages == other.messages
+
+    got.messages.append({"role": "user", "content": "after the crash"})
+    reopened.save_session(got)
+    assert ShardedSessionStore(str(tmp_path)).get_session(sess.id).messages == got.messages
@@ -0,0 +1,32 @@
+import pytest
+
+from snlite.sharded_store import ShardedSessionStore
+from snlite.sqlite_store import SqliteSessionStore
+from snlite.store import SessionStore
+
+BACKENDS = [SessionStore, SqliteSessionStore, ShardedSessionStore]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_title_filters_fold_non_ascii_case_like_every_backend(tmp_path, backend):
+    store = backend(str(tmp_path))
+    store.create_session("Привет, мир")
+    store.create_session("Ωμέγα notes", group="Ελληνικά")
+    store.create_session("plain")
+
+    def titles(**filters):
+        return sorted(s["title"] for s in store.list_sessions_page(**filters)["items"])
+
+    assert titles(query="МИР") == ["Привет, мир"]
+    assert titles(title_prefix="ПРИВ") == ["Привет, мир"]
+    assert titles(query="ελληνικά") == ["Ωμέγα notes"]
+    assert titles(query="PLAIN") == ["plain"]
+    assert store.list_sessions_page(query="ΕΛΛΗΝΙΚΆ")["groups"] == {"Ελληνικά": 1}
+
+
+def test_durability_defaults_per_backend(tmp_path):
+    assert SessionStore(str(tmp_path / "jsonl")).durability == "none"
+    assert ShardedSessionStore(str(tmp_path / "sharded")).durability == "none"
+    # synchronous=OFF could corrupt the database on power loss
+    assert SqliteSessionStore(str(tmp_path / "sqlite")).durability == "batch-fsync"
+    assert SqliteSessionStore(str(tmp_path / "sqlite2"), durability="none").durability == "none"
@@ -0,0 +1,318 @@
+import json
+import multiprocessing
+import os
+import threading
+
+import pytest
+
+from snlite import store as store_module
+from snlite.records import CHECKPOINT_EVERY, decode_record, split_records
+from snlite.store import SessionStore
+from snlite.store_base import DURABILITY_MODES
+
+
+def _chat(store, title, turns):
+    sess = store.create_session(title)
+    for i in range(turns):
+        sess.messages.append({"role": "user", "content": f"{title} question {i}"})
+        sess.messages.append({"role": "assistant", "content": f"{title} answer {i}"})
+    store.save_session(sess)
+    return sess
+
+
+def _index_rows(store):
+    with open(store.index_path, "rb") as f:
+        return [json.loads(line) for line in f]
+
+
+def _log_records(store):
+    with open(store.path, "rb") as f:
+        records, _ = split_records(f.read())
+    return [decode_record(r) for r in records]
+
+
+def test_reopened_store_reads_sessions_through_the_sidecar(tmp_path):
+    store = SessionStore(str(tmp_path))
+    a = _chat(store, "A", 2)
+    b = _chat(store, "B", 3)
+    store.close()
+
+    rows = {row["id"]: row for row in _index_rows(store) if "id" in row}
+    with open(store.path, "rb") as f:
+        f.seek(rows[b.id]["offset"])
+        assert json.loads(f.read(rows[b.id]["length"]))["id"] == b.id
+
+    reopened = SessionStore(str(tmp_path))
+    assert reopened.get_session(a.id).messages == a.messages
+    assert reopened.get_session(b.id).messages == b.messages
+    assert [s["title"] for s in reopened.list_sessions()] == ["B", "A"]
+
+
+def test_sidecar_that_does_not_match_the_log_is_rebuilt(tmp_path):
+    store = SessionStore(str(tmp_path))
+    a = _chat(store, "A", 1)
+    store.close()
+    with open(store.index_path, "w") as f:
+        f.write(json.dumps({"id": "ghost", "offset": 0, "length": 5, "title": "t", "group": "g",
+                            "created_at": 0, "updated_at": 0}) + "\n")
+    assert [s["id"] for s in SessionStore(str(tmp_path)).list_sessions()] == [a.id]
+
+    os.remove(store.index_path)
+    assert SessionStore(str(tmp_path)).get_session(a.id).messages == a.messages
+
+
+def test_saves_append_deltas_that_replay_on_reopen(tmp_path):
+    store = SessionStore(str(tmp_path))
+    sess = _chat(store, "A", 1)
+    for i in range(5):
+        sess.messages.append({"role": "user", "content": f"more {i}"})
+        store.save_session(sess)
+    # regenerate: the last answer is popped, then a new one appended
+    sess.messages.append({"role": "assistant", "content": "first try"})
+    store.save_session(sess)
+    sess.messages.pop()
+    store.save_session(sess)
+    sess.messages.append({"role": "assistant", "content": "second try"})
+    sess.title = "Renamed"
+    store.save_session(sess)
+    store.close()
+
+    records = _log_records(store)
+    assert sum(1 for r in records if r.get("op") != "delta") == 1
+    assert sum(1 for r in records if r.get("op") == "delta") == 9
+    # each delta carries only what changed
+    assert [r.get("append") for r in records][2] == [{"role": "user", "content": "more 0"}]
+    assert records[-2] == {"op": "delta", "id": sess.id, "updated_at": records[-2]["updated_at"], "pop": 1}
+
+    reopened = SessionStore(str(tmp_path))
+    got = reopened.get_session(sess.id)
+    assert got.messages == sess.messages
+    assert got.title == "Renamed"
+
+
+def test_sidecar_is_rewritten_as_a_checkpoint(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(store_module, "INDEX_CHECKPOINT_ROWS", 8)
+    store = SessionStore(str(tmp_path))
+    a = _chat(store, "A", 1)
+    b = _chat(store, "B", 1)
+    for i in range(20):
+        sess = (a, b)[i % 2]
+        sess.messages.append({"role": "user", "content": f"more {i}"})
+        store.save_session(sess)
+    store.close()
+
+    rows = _index_rows(store)
+    header = rows[0]
+    assert set(header) == {"checkpoint", "offset", "records", "sessions", "generation"}
+    assert header["sessions"] == 2
+    assert len(rows) < 8 + 3  # not one row per save
+    reopened = SessionStore(str(tmp_path))
+    assert reopened._checkpoint_offset == header["offset"]
+    assert reopened.get_session(a.id).messages == a.messages
+    assert reopened.get_session(b.id).messages == b.messages
+
+    # a checkpoint of an older generation of the log is not trusted
+    header["generation"] += 1
+    with open(store.index_path, "w") as f:
+        f.writelines(json.dumps(row) + "\n" for row in [header] + rows[1:])
+    assert SessionStore(str(tmp_path)).get_session(a.id).messages == a.messages
+    assert "rebuilding" in caplog.text
+
+
+def test_torn_record_at_the_end_of_the_log_is_cut_off(tmp_path):
+    store = SessionStore(str(tmp_path))
+    sess = _chat(store, "A", 2)
+    store.close()
+    size = os.path.getsize(store.path)
+    # a crash in the middle of an append
+    with open(store.path, "ab") as f:
+        f.write(b'{"op": "delta", "id": "' + sess.id.encode() + b'", "append": [{"ro')
+
+    reopened = SessionStore(str(tmp_path))
+    assert os.path.getsize(store.path) == size
+    got = reopened.get_session(sess.id)
+    assert got.messages == sess.messages
+
+    # the next append starts on a line of its own
+    got.messages.append({"role": "user", "content": "after the crash"})
+    reopened.save_session(got)
+    reopened.close()
+    assert SessionStore(str(tmp_path)).get_session(sess.id).messages == got.messages
+    assert all(r["id"] == sess.id for r in _log_records(store))
+
+
+def test_a_new_snapshot_is_written_every_checkpoint_deltas(tmp_path):
+    store = SessionStore(str(tmp_path))
+    sess = store.create_session("A")
+    for i in range(CHECKPOINT_EVERY + 1):
+        sess.messages.append({"role": "user", "content": str(i)})
+        store.save_session(sess)
+    store.close()
+
+    kinds = ["delta" if r.get("op") == "delta" else "snapshot" for r in _log_records(store)]
+    assert kinds == ["snapshot"] + ["delta"] * CHECKPOINT_EVERY + ["snapshot"]
+    assert SessionStore(str(tmp_path)).get_session(sess.id).messages == sess.messages
+
+
+def test_compaction_leaves_one_snapshot_per_session(tmp_path):
+    store = SessionStore(str(tmp_path))
+    a = _chat(store, "A", 3)
+    b = _chat(store, "B", 1)
+    # past CHECKPOINT_EVERY deltas a new snapshot supersedes the old records
+    for i in range(CHECKPOINT_EVERY + 5):
+        a.messages.append({"role": "user", "content": f"more {i}"})
+        store.save_session(a)
+    assert store.garbage_stats()["dead_records"] == CHECKPOINT_EVERY + 1
+
+    assert store.maybe_compact(0.99, 1 << 30, 1 << 30) is None
+    result = store.maybe_compact(0.1, 0, 1 << 30)
+    assert result["after"] == 2 and result["saved"] > CHECKPOINT_EVERY
+    assert [r["id"] for r in _log_records(store)] == [b.id, a.id]  # oldest first
+    assert store.garbage_stats()["dead_bytes"] == 0
+
+    reopened = SessionStore(str(tmp_path))
+    assert reopened.get_session(a.id).messages == a.messages
+    assert reopened.get_session(b.id).messages == b.messages
+
+
+def test_saves_during_compaction_are_kept(tmp_path):
+    store = SessionStore(str(tmp_path))
+    sessions = [_chat(store, f"S{i}", 20) for i in range(20)]
+    for sess in sessions:
+        for i in range(CHECKPOINT_EVERY):
+            sess.messages.append({"role": "user", "content": f"more {i}"})
+            store.save_session(sess)
+
+    compactor = threading.Thread(target=store.compact)
+    compactor.start()
+    for i in range(50):
+        sess = sessions[i % len(sessions)]
+        sess.messages.append({"role": "user", "content": f"during {i}"})
+        store.save_session(sess)
+    compactor.join()
+    store.close()
+
+    reopened = SessionStore(str(tmp_path))
+    for sess in sessions:
+        assert reopened.get_session(sess.id).messages == sess.messages
+
+
+@pytest.mark.parametrize("durability", DURABILITY_MODES)
+def test_durability_modes_persist_and_fsync_as_configured(tmp_path, monkeypatch, durability):
+    fsynced = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: (fsynced.append(fd), real_fsync(fd)))
+    store = SessionStore(str(tmp_path), durability=durability)
+    sess = _chat(store, "A", 2)
+    # always-fsync returns only once the batch is on disk
+    if durability == "always-fsync":
+        assert fsynced
+    store.close()
+
+    stats = store.write_stats()
+    assert stats["durability"] == durability
+    assert (stats["fsyncs"] > 0) == (durability != "none")
+    assert SessionStore(str(tmp_path)).get_session(sess.id).messages == sess.messages
+
+
+def test_unknown_durability_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        SessionStore(str(tmp_path), durability="sometimes")
+
+
+def test_concurrent_saves_are_written_in_shared_batches(tmp_path):
+    store = SessionStore(str(tmp_path), batch_window_ms=20)
+    sessions = [store.create_session(f"S{i}") for i in range(8)]
+    before = store.write_stats()["writes"]
+    barrier = threading.Barrier(len(sessions))
+
+    def chat(sess):
+        barrier.wait()
+        for i in range(5):
+            sess.messages.append({"role": "user", "content": f"{sess.title} {i}"})
+            store.save_session(sess)
+
+    threads = [threading.Thread(target=chat, args=(s,)) for s in sessions]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    stats = store.write_stats()
+    assert stats["max_batch"] > 1
+    assert stats["writes"] - before < len(sessions) * 5
+    reopened = SessionStore(str(tmp_path))
+    for sess in sessions:
+        assert reopened.get_session(sess.id).messages == sess.messages
+
+
+def test_two_stores_on_one_dir_see_each_others_saves(tmp_path):
+    one = SessionStore(str(tmp_path))
+    two = SessionStore(str(tmp_path))
+    a = _chat(one, "A", 2)
+    assert two.get_session(a.id).messages == a.messages
+
+    theirs = two.get_session(a.id)
+    theirs.messages.append({"role": "user", "content": "from two"})
+    two.save_session(theirs)
+    b = _chat(two, "B", 1)
+
+    assert one.get_session(a.id).messages == theirs.messages
+    assert {s["id"] for s in one.list_sessions()} == {a.id, b.id}
+
+
+def test_a_rewrite_by_another_store_reloads_the_sidecar(tmp_path, monkeypatch):
+    one = SessionStore(str(tmp_path))
+    two = SessionStore(str(tmp_path))
+    reloads = []
+    load_index = two._load_index
+    monkeypatch.setattr(two, "_load_index", lambda: (reloads.append(1), load_index()))
+    a = _chat(one, "A", 2)
+    b = _chat(one, "B", 1)
+    for i in range(CHECKPOINT_EVERY + 5):
+        a.messages.append({"role": "user", "content": f"more {i}"})
+        one.save_session(a)
+    assert two.get_session(b.id).messages == b.messages
+    generation = two._flock.generation()
+
+    # every byte offset `two` knows moves; it reads the sidecar `one` wrote
+    # instead of scanning the new log
+    one.compact()
+    assert two._flock.generation() == generation + 1
+    assert two.get_session(a.id).messages == a.messages
+    assert reloads == [1] and two._checkpoint_offset == two._offset
+    assert two.get_session(b.id).messages == b.messages
+
+    two.delete_session(a.id)
+    assert one.get_session(a.id) is None
+    b.messages.append({"role": "user", "content": "after the rewrites"})
+    one.save_session(b)
+    assert two.get_session(b.id).messages == b.messages
+
+
+def _save_from_another_process(data_dir, name, turns):
+    store = SessionStore(data_dir)
+    sess = store.create_session(name)
+    for i in range(turns):
+        sess.messages.append({"role": "user", "content": f"{name} {i}"})
+        store.save_session(sess)
+    store.close()
+
+
+def test_processes_sharing_a_dir_do_not_lose_saves(tmp_path):
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=_save_from_another_process, args=(str(tmp_path), f"P{i}", 40)) for i in range(3)]
+    for p in procs:
+        p.start()
+    local = _chat(SessionStore(str(tmp_path)), "local", 20)
+    for p in procs:
+        p.join(60)
+        assert p.exitcode == 0
+
+    reopened = SessionStore(str(tmp_path))
+    by_title = {s["title"]: s["id"] for s in reopened.list_sessions()}
+    assert sorted(by_title) == ["P0", "P1", "P2", "local"]
+    for i in range(3):
+        messages = reopened.get_session(by_title[f"P{i}"]).messages
+        assert [m["content"] for m in messages] == [f"P{i} {n}" for n in range(40)]
+    assert reopened.get_session(local.id).messages == local.messages